@@ -0,0 +1,134 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from namespaces import DEFAULT_NAMESPACE
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# 0 disables the cache.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+
+class SemanticCache:
+    # Caches generated answers by query embedding and the set of retrieved
+    # chunk ids. A lookup hits when an entry retrieved exactly the same chunks
+    # and its query embedding has cosine similarity >= threshold. Entries
+    # expire after ttl seconds, the least recently used are evicted beyond
+    # max_entries, and everything is dropped when the index version changes.
+    # Keys carry no session or history, so callers only use it for
+    # questions asked without conversation history.
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> (chunk key, unit vector, answer, created at)
+        self._by_chunks = {}  # chunk key -> set of entry ids
+        self._ids = itertools.count()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_chunks.clear()
+            self._version = version
+
+    def _remove(self, entry_id):
+        chunk_key = self._entries.pop(entry_id)[0]
+        ids = self._by_chunks[chunk_key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_chunks[chunk_key]
+
+    def lookup(self, embedding, chunk_ids, version):
+        if self.max_entries <= 0:
+            return None
+        chunk_key = tuple(sorted(chunk_ids))
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_chunks.get(chunk_key, ())):
+                _, vector, _, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query, vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def store(self, embedding, chunk_ids, version, answer):
+        if self.max_entries <= 0:
+            return
+        chunk_key = tuple(sorted(chunk_ids))
+        with self._lock:
+            self._check_version(version)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (chunk_key, self._normalize(embedding), answer, time.time())
+            self._by_chunks.setdefault(chunk_key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_chunks.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "max_entries": self.max_entries,
+            }
+
+
+answer_cache = SemanticCache()
+# One cache per namespace: chunk ids are only unique within a namespace, and
+# a rebuild of one namespace must not drop the answers of the others.
+_caches = {DEFAULT_NAMESPACE: answer_cache}
+_caches_lock = threading.Lock()
+
+
+def get_answer_cache(namespace=DEFAULT_NAMESPACE):
+    cache = _caches.get(namespace)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(namespace)
+            if cache is None:
+                cache = _caches[namespace] = SemanticCache()
+    return cache
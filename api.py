@@ -1,7 +1,9 @@
 # api.py
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from query_data import get_response
+from query_data import get_response, warm_up_steps
+from routes import probes_router
+from warmup import warm_up
 # from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -15,13 +17,22 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.include_router(probes_router)
+
+@app.on_event("startup")
+def load_retrieval_engine():
+    # Load the embedding model and open the vector store once, before the first /ask
+    # (in the background with FAST_START=1, see warmup.py).
+    # A rebuilt index is picked up automatically when its version is activated.
+    warm_up.start(warm_up_steps())
 
 class QueryRequest(BaseModel):
     query_text: str
+    session_id: str
 
 @app.post("/ask")
 def ask_question(request: QueryRequest):
-    response = get_response(request.query_text)
+    response = get_response(request.query_text, request.session_id)
     if response == "Unable to find matching results.":
         raise HTTPException(status_code=404, detail=response)
     return {"response": response}
@@ -1,15 +1,26 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
-from query_data import get_response
+from typing import List, Optional, Tuple
+from datetime import datetime
+from query_data import get_response, stream_response, warm_up_steps
+from retrieval import get_engine, engines, index_path
+from index_versions import create_version, activate, collect_garbage
+from answer_cache import get_answer_cache
+from usage import usage_by_session, usage_by_day
+from warmup import warm_up
+from namespaces import DEFAULT_NAMESPACE
+from vector_store import SearchFilter
+from ingest import UploadSizeLimit, clear_documents
+from routes import UPLOAD_FOLDER, documents_router, probes_router, checked_namespace, upload_folder
+import storage
+from storage import documents_collection, ensure_indexes
 import os
-import fitz  # PyMuPDF
-from pymongo import MongoClient
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-import subprocess
 import logging
-import shutil
+import json
 from fastapi.staticfiles import StaticFiles
 
 load_dotenv()
@@ -26,97 +37,129 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Refuses oversized upload bodies before they are spooled to disk.
+app.add_middleware(UploadSizeLimit)
+app.include_router(documents_router)
+app.include_router(probes_router)
+
+@app.on_event("startup")
+def load_retrieval_engine():
+    # Load the embedding model and open the default namespace's vector store
+    # once, before the first /ask, or in the background with FAST_START=1
+    # (see warmup.py). Other namespaces are opened on first use.
+    warm_up.start(warm_up_steps())
+
+class QueryFilters(BaseModel):
+    # Only chunks of these source files, within these inclusive (first, last)
+    # page ranges (0-based, as stored) and uploaded within these bounds are
+    # searched.
+    sources: Optional[List[str]] = None
+    pages: Optional[List[Tuple[int, int]]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def to_search_filter(self):
+        return SearchFilter(
+            sources=self.sources,
+            pages=self.pages,
+            uploaded_after=self.uploaded_after.timestamp() if self.uploaded_after else None,
+            uploaded_before=self.uploaded_before.timestamp() if self.uploaded_before else None,
+        )
 
 class QueryRequest(BaseModel):
     query_text: str
     session_id: str
+    filters: Optional[QueryFilters] = None
+    namespace: str = DEFAULT_NAMESPACE
+
+    def search_filter(self):
+        return self.filters.to_search_filter() if self.filters else None
 
 @app.post("/ask")
 def ask_question(request: QueryRequest):
-    response = get_response(request.query_text, request.session_id)
+    namespace = checked_namespace(request.namespace)
+    response = get_response(request.query_text, request.session_id, request.search_filter(), namespace)
     if response == "Unable to find matching results.":
         raise HTTPException(status_code=404, detail=response)
     return {"response": response}
 
-UPLOAD_FOLDER = 'uploads'
-MONGO_URI = os.environ['MONGO_URI']
-DATABASE_NAME = "document_db"
-COLLECTION_NAME = "documents"
-
-client = MongoClient(MONGO_URI)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    # Server-sent events: one "data" event per piece of generated text,
+    # then a "done" event (or an "error" event if generation fails).
+    namespace = checked_namespace(request.namespace)
+
+    async def events():
+        try:
+            async for text in stream_response(request.query_text, request.session_id, request.search_filter(),
+                                              namespace):
+                yield f"data: {json.dumps({'text': text})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Exception occurred: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def store_documents(file_path, filename):
-    with fitz.open(file_path) as pdf:
-        for page_num in range(len(pdf)):
-            page = pdf.load_page(page_num)
-            text = page.get_text()
-            document = {
-                "page_content": text,
-                "metadata": {"source": filename, "page": page_num}
-            }
-            collection.insert_one(document)
-    logger.info(f"Document {filename} stored in MongoDB.")
-
-@app.post("/upload/")
-async def upload_files(files: list[UploadFile] = File(...)):
-    for file in files:
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
-        
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(file.file.read())
-        
-        store_documents(file_path, file.filename)
-    return {"filenames": [file.filename for file in files]}
-
-@app.post("/update-database/")
-async def update_database():
-    try:
-        logger.info("Starting database update...")
-        result = subprocess.run(["python3", "create_database.py"], capture_output=True, text=True)
-        logger.info(f"Subprocess result: {result}")
-        if result.returncode != 0:
-            logger.error(f"Error updating database: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"Error updating database: {result.stderr}")
-        return {"detail": "Database updated successfully."}
-    except Exception as e:
-        logger.error(f"Exception occurred: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.on_event("startup")
+def prepare_uploads():
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    ensure_indexes()
+
+@app.on_event("shutdown")
+def close_storage():
+    storage.close()
+
+@app.get("/cache/stats")
+async def cache_stats(namespace: str = DEFAULT_NAMESPACE):
+    namespace = checked_namespace(namespace)
+    return {"answers": get_answer_cache(namespace).stats(), "query_embeddings": get_engine().query_cache.stats(),
+            "indexes": engines.stats()}
+
+@app.get("/usage/sessions/{session_id}")
+async def session_usage(session_id: str):
+    usage = await run_in_threadpool(usage_by_session, session_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="No usage recorded for this session.")
+    return usage
+
+@app.get("/usage/daily")
+async def daily_usage(days: int = 30, session_id: Optional[str] = None):
+    return {"days": await run_in_threadpool(usage_by_day, days, session_id)}
 
 @app.post("/clear-data/")
-async def clear_data():
+async def clear_data(namespace: str = DEFAULT_NAMESPACE):
+    # Clears one namespace; the others are left alone.
+    namespace = checked_namespace(namespace)
     try:
         # Clear MongoDB collection
-        collection.delete_many({})
-        logger.info("MongoDB collection cleared.")
-
-        # Delete all files in uploads/ directory
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
+        collection = await run_in_threadpool(documents_collection, namespace)
+        await run_in_threadpool(clear_documents, collection)
+        get_answer_cache(namespace).invalidate()
+        logger.info(f"MongoDB collection of namespace {namespace} cleared.")
+
+        # Delete all files in the namespace's uploads/ directory
+        folder = upload_folder(namespace)
+        for filename in os.listdir(folder) if os.path.isdir(folder) else []:
+            file_path = os.path.join(folder, filename)
             if os.path.isfile(file_path):
                 os.unlink(file_path)
         logger.info("Uploads directory cleared.")
 
-                # Delete files inside chroma/ directory
-        chroma_dir = 'chroma'
-        if os.path.exists(chroma_dir):
-            for filename in os.listdir(chroma_dir):
-                file_path = os.path.join(chroma_dir, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    logger.error(f"Failed to delete {file_path}. Reason: {e}")
-            logger.info("Files inside Chroma directory deleted.")
+        # Switch to an empty index version instead of deleting files under
+        # running queries. The previous version is kept like after any build,
+        # as other workers may still be reading it; the next clear or build
+        # deletes it.
+        root = index_path(namespace)
+        version, _directory = create_version(root)
+        activate(root, version)
+        engine = get_engine(namespace)
+        engine.refresh()
+        collect_garbage(root, engine.open_versions())
+        logger.info("Index cleared.")
 
         return {"detail": "All data cleared successfully."}
     except Exception as e:
@@ -133,4 +176,6 @@ if __name__ == "__main__":
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=8000)
\ No newline at end of file
+    # With several workers, run embedding_server.py and set EMBEDDING_SOCKET
+    # so they share one embedding model.
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=int(os.getenv("API_WORKERS", "1")))
\ No newline at end of file
@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import string
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# End-to-end benchmark: synthetic PDFs -> store_documents -> generate_data_store
+# -> concurrent /ask requests against a real uvicorn server, all in this
+# process with MongoDB replaced by mongomock and Gemini by llm.FakeBackend.
+# Embeddings use the local sentence-transformers model. Results are written
+# as JSON; pass a previous result as --baseline to see what changed.
+
+# Headline numbers printed next to the --baseline run's.
+COMPARED = [
+    ("ingest", "pages_per_second"),
+    ("index", "chunks_per_second"),
+    ("update", "seconds"),
+    ("update", "version_copy_seconds"),
+    ("ask", "throughput_rps"),
+    ("ask", "p50_ms"),
+    ("ask", "p95_ms"),
+    ("ask", "p99_ms"),
+    ("process", "peak_rss_mb"),
+]
+
+
+def configure_environment(args):
+    # Must run before any module of the app is imported: they read their
+    # settings at import time.
+    os.environ["MONGO_URI"] = "mongomock://"
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.llm_token_delay)
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_SIZE"] = "0"
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def latency_summary(latencies):
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+    }
+
+
+def make_pdfs(directory, documents, pages_per_document, seed=0, first=0):
+    # Manual-like pages. Every page states one fact about a part number;
+    # the questions ask for those facts. Files are numbered from first.
+    import fitz
+
+    from benchmark_retrieval import TOPICS, WORDS
+
+    rng = random.Random(seed)
+    files = []
+    questions = []
+    for d in range(documents):
+        filename = f"manual-{first + d:04d}.pdf"
+        pdf = fitz.open()
+        for _ in range(pages_per_document):
+            part = f"{rng.choice(string.ascii_uppercase)}{rng.choice(string.ascii_uppercase)}-{rng.randint(1000, 9999)}"
+            topic = rng.choice(TOPICS)
+            fact = f"The {topic} part {part} must be serviced every {rng.randint(2, 48)} months."
+            words = rng.choices(WORDS + TOPICS, k=rng.randint(150, 250))
+            words.insert(rng.randrange(len(words)), fact)
+            page = pdf.new_page()
+            page.insert_textbox(page.rect + (50, 50, -50, -50), " ".join(words), fontsize=9)
+            questions.append(f"How often must the {topic} part {part} be serviced?")
+        path = os.path.join(directory, filename)
+        pdf.save(path)
+        pdf.close()
+        files.append((path, filename))
+    return files, questions
+
+
+def version_copy(root):
+    # Times copying the active index version as an incremental update does,
+    # and how much of it is copied rather than hard-linked.
+    from index_versions import create_version, discard_version
+
+    started = time.perf_counter()
+    version, path = create_version(root, copy_active=True)
+    elapsed = time.perf_counter() - started
+    copied = linked = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(directory, name))
+            if stat.st_nlink > 1:
+                linked += stat.st_size
+            else:
+                copied += stat.st_size
+    discard_version(root, version)
+    return {
+        "version_copy_seconds": round(elapsed, 3),
+        "copied_mb": round(copied / 2**20, 1),
+        "linked_mb": round(linked / 2**20, 1),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="benchmark-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The API server failed to start.")
+        time.sleep(0.05)
+    return server, thread
+
+
+def ask(base_url, question, session_id, stream):
+    # Returns (seconds to the full answer, seconds to the first byte).
+    body = json.dumps({"query_text": question, "session_id": session_id}).encode("utf-8")
+    request = urllib.request.Request(f"{base_url}/ask/stream" if stream else f"{base_url}/ask", data=body,
+                                     headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read(1)
+        first_byte = time.perf_counter() - started
+        response.read()
+    return time.perf_counter() - started, first_byte
+
+
+def run_load(base_url, questions, requests, concurrency, stream, sessions):
+    def one(i):
+        try:
+            return ask(base_url, questions[i % len(questions)], f"bench-{i % sessions}", stream)
+        except Exception:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    ok = [result for result in results if result is not None]
+    summary = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": requests - len(ok),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    if ok:
+        summary.update(latency_summary([total for total, _first in ok]))
+        if stream:
+            summary["first_byte"] = latency_summary([first for _total, first in ok])
+    return summary
+
+
+def compare(result, baseline):
+    print(f"\nCompared with {baseline['started_at']}:")
+    for section, name in COMPARED:
+        old = baseline.get(section, {}).get(name)
+        new = result.get(section, {}).get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        print(f"  {section}.{name:18s} {old:10.2f} -> {new:10.2f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=20, help="Synthetic PDFs to upload.")
+    parser.add_argument("--pages", type=int, default=25, help="Pages per PDF.")
+    parser.add_argument("--update-documents", type=int, default=1,
+                        help="PDFs uploaded after the full build and indexed by an incremental update.")
+    parser.add_argument("--requests", type=int, default=500, help="/ask requests to send.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clients sending requests at once.")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests sent before measuring.")
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct chat sessions the requests use.")
+    parser.add_argument("--stream", action="store_true", help="Use /ask/stream and also report time to first byte.")
+    parser.add_argument("--llm-token-delay", type=float, default=0.0,
+                        help="Seconds the fake LLM waits per streamed word.")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on.")
+    parser.add_argument("--output", type=str, default="benchmark_e2e.json")
+    parser.add_argument("--baseline", type=str, default=None, help="A previous --output file to compare against.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    configure_environment(args)
+
+    # Imported here, after configure_environment(). app must be imported
+    # from the repository root (it mounts ./static); everything it writes
+    # afterwards goes to a scratch directory.
+    import app as api
+    from create_database import generate_data_store
+    from ingest import store_documents, hash_file
+    from jobs import IndexJob
+    from metrics import stage_metrics
+    from retrieval import CHROMA_PATH
+    from storage import documents_collection
+
+    result = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "vector_backend": os.getenv("VECTOR_BACKEND", "chroma"),
+        },
+    }
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="e2e-bench-")
+    server = None
+    try:
+        os.chdir(workdir)
+        os.makedirs("pdfs")
+        started = time.perf_counter()
+        files, questions = make_pdfs(os.path.join(workdir, "pdfs"), args.documents, args.pages, args.seed)
+        print(f"Generated {len(files)} PDFs with {len(questions)} pages in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        stats = store_documents(documents_collection(), [(path, name, hash_file(path)) for path, name in files])
+        elapsed = time.perf_counter() - started
+        result["ingest"] = {
+            "documents": len(files),
+            "pages": stats["pages"],
+            "seconds": round(elapsed, 3),
+            "pages_per_second": round(stats["pages"] / elapsed, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "parser_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        }
+        print(f"Ingest: {result['ingest']}")
+
+        job = IndexJob("benchmark")
+        started = time.perf_counter()
+        generate_data_store(full=True, progress=job)
+        elapsed = time.perf_counter() - started
+        result["index"] = {
+            "chunks": job.chunks_done,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(job.chunks_done / elapsed, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        print(f"Index: {result['index']}")
+
+        if args.update_documents:
+            os.makedirs("update")
+            update_files, update_questions = make_pdfs(os.path.join(workdir, "update"), args.update_documents,
+                                                       args.pages, args.seed + 1, first=args.documents)
+            questions += update_questions
+            stats = store_documents(documents_collection(),
+                                    [(path, name, hash_file(path)) for path, name in update_files])
+            result["update"] = version_copy(CHROMA_PATH)
+            job = IndexJob("benchmark-update")
+            started = time.perf_counter()
+            generate_data_store(progress=job)
+            result["update"].update({
+                "pages": stats["pages"],
+                "chunks": job.chunks_done,
+                "seconds": round(time.perf_counter() - started, 3),
+            })
+            print(f"Update: {result['update']}")
+
+        port = free_port()
+        started = time.perf_counter()
+        server, thread = start_server(api.app, port)
+        result["startup_seconds"] = round(time.perf_counter() - started, 3)
+        base_url = f"http://127.0.0.1:{port}"
+
+        rng = random.Random(args.seed)
+        rng.shuffle(questions)
+        if args.warmup:
+            run_load(base_url, questions[-args.warmup:], args.warmup, args.concurrency, args.stream, args.sessions)
+        stage_metrics.reset()
+        result["ask"] = run_load(base_url, questions, args.requests, args.concurrency, args.stream, args.sessions)
+        result["ask"]["stages"] = stage_metrics.summary()
+        print(f"Ask: { {k: v for k, v in result['ask'].items() if k != 'stages'} }")
+
+        result["process"] = {"peak_rss_mb": round(peak_rss_mb(), 1)}
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import random
+import string
+import time
+
+from sentence_transformers import SentenceTransformer
+from embeddings import SentenceTransformerEmbeddings
+from retrieval import EMBEDDING_MODEL_NAME
+
+
+def make_chunks(count, min_len=50, max_len=500, seed=0):
+    # Synthetic chunks with the same length spread as split_text output.
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(2000)]
+    chunks = []
+    for _ in range(count):
+        target = rng.randint(min_len, max_len)
+        text = ""
+        while len(text) < target:
+            text += rng.choice(words) + " "
+        chunks.append(text[:target])
+    return chunks
+
+
+def per_chunk_loop(model, chunks):
+    # The original create_database.py embedding path.
+    return [model.encode(chunk).tolist() for chunk in chunks]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000, help="Number of synthetic chunks to embed.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--model", type=str, default=EMBEDDING_MODEL_NAME)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    model = SentenceTransformer(args.model, device="cpu")
+    model.encode(chunks[:8])  # warm up
+
+    elapsed = timed(lambda: per_chunk_loop(model, chunks))
+    baseline = len(chunks) / elapsed
+    print(f"per-chunk loop:                        {baseline:8.1f} chunks/sec")
+
+    for sort_by_length in (False, True):
+        for batch_size in args.batch_sizes:
+            embeddings = SentenceTransformerEmbeddings(args.model, batch_size=batch_size,
+                                                       sort_by_length=sort_by_length, device="cpu")
+            elapsed = timed(lambda: embeddings.encode(chunks))
+            rate = len(chunks) / elapsed
+            label = f"batched (batch={batch_size}, sorted={sort_by_length})"
+            print(f"{label:38s} {rate:8.1f} chunks/sec  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import random
+import string
+import time
+
+import numpy as np
+
+from bm25 import BM25Index
+from embeddings import SentenceTransformerEmbeddings
+from retrieval import EMBEDDING_MODEL_NAME, reciprocal_rank_fusion
+
+TOPICS = ["pump", "valve", "motor", "bearing", "seal", "filter", "sensor", "gasket", "impeller", "shaft",
+          "housing", "coupling", "controller", "manifold", "regulator", "actuator", "nozzle", "compressor"]
+WORDS = ["install", "replace", "inspect", "torque", "pressure", "temperature", "maintenance", "warranty",
+         "assembly", "clearance", "lubricate", "tighten", "operating", "maximum", "minimum", "specified",
+         "procedure", "check", "ensure", "remove", "clean", "adjust", "monthly", "annual", "service", "unit"]
+
+
+def make_vocabulary(rng, size=20000):
+    # Pseudo-words with Zipf-distributed frequencies, like real text.
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(size)]
+    weights = [1.0 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+
+def make_corpus(count, planted, seed=0):
+    # Manual-like chunks. Every planted chunk mentions one part number; the
+    # matching query asks about that part number in otherwise generic terms.
+    rng = random.Random(seed)
+    vocabulary, weights = make_vocabulary(rng)
+    chunks = []
+    for _ in range(count):
+        words = rng.choices(WORDS + TOPICS, k=rng.randint(10, 30))
+        words += rng.choices(vocabulary, weights=weights, k=rng.randint(30, 50))
+        rng.shuffle(words)
+        chunks.append(" ".join(words))
+    queries = []
+    for target in rng.sample(range(count), planted):
+        part = f"{rng.choice(string.ascii_uppercase)}{rng.choice(string.ascii_uppercase)}-{rng.randint(1000, 9999)}"
+        words = chunks[target].split()
+        words.insert(rng.randrange(len(words)), f"part {part}")
+        chunks[target] = " ".join(words)
+        queries.append((f"What is the {rng.choice(WORDS)} procedure for the {rng.choice(TOPICS)} part {part}?", target))
+    return chunks, queries
+
+
+def percentile(values, p):
+    return float(np.percentile(np.asarray(values) * 1000, p))
+
+
+def report(name, hits, latencies):
+    print(f"{name:8s} recall@k {np.mean(hits):.3f}   p50 {percentile(latencies, 50):7.2f} ms   "
+          f"p95 {percentile(latencies, 95):7.2f} ms")
+
+
+def compare(args):
+    chunks, queries = make_corpus(args.chunks, args.queries)
+    keys = [str(i) for i in range(len(chunks))]
+    embeddings = SentenceTransformerEmbeddings(args.model, device="cpu")
+    matrix = embeddings.encode(chunks)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    keyword_index = BM25Index()
+    keyword_index.add(keys, chunks)
+    depth = args.k * 4
+
+    results = {"vector": ([], []), "bm25": ([], []), "hybrid": ([], [])}
+    for query, target in queries:
+        vector = embeddings.encode([query])[0]
+        vector /= np.linalg.norm(vector)
+
+        start = time.perf_counter()
+        scores = matrix @ vector
+        top = np.argpartition(-scores, depth)[:depth]
+        vector_keys = [keys[i] for i in top[np.argsort(-scores[top])]]
+        vector_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        keyword_keys = [key for key, _score in keyword_index.search(query, k=depth)]
+        keyword_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fused = [key for key, _score in reciprocal_rank_fusion([vector_keys, keyword_keys])]
+        fusion_time = time.perf_counter() - start
+
+        for name, ranked, elapsed in (("vector", vector_keys, vector_time),
+                                      ("bm25", keyword_keys, keyword_time),
+                                      ("hybrid", fused, vector_time + keyword_time + fusion_time)):
+            results[name][0].append(str(target) in ranked[:args.k])
+            results[name][1].append(elapsed)
+
+    print(f"{len(chunks)} chunks, {len(queries)} part-number queries, k={args.k} (search time excludes query encoding)")
+    for name, (hits, latencies) in results.items():
+        report(name, hits, latencies)
+
+
+def scale(args):
+    # BM25 latency on its own at corpus sizes too large to embed here.
+    chunks, queries = make_corpus(args.bm25_chunks, args.queries, seed=1)
+    start = time.perf_counter()
+    keyword_index = BM25Index()
+    keyword_index.add([str(i) for i in range(len(chunks))], chunks)
+    print(f"BM25 build over {len(chunks)} chunks: {time.perf_counter() - start:.1f}s")
+    hits, latencies = [], []
+    for query, target in queries:
+        start = time.perf_counter()
+        ranked = [key for key, _score in keyword_index.search(query, k=args.k)]
+        latencies.append(time.perf_counter() - start)
+        hits.append(str(target) in ranked)
+    report("bm25", hits, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000, help="Corpus size for the recall comparison.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--bm25-chunks", type=int, default=0,
+                        help="Also time BM25 alone on a corpus of this size (e.g. 1000000).")
+    parser.add_argument("--model", type=str, default=EMBEDDING_MODEL_NAME)
+    args = parser.parse_args()
+    compare(args)
+    if args.bm25_chunks:
+        scale(args)
+
+
+if __name__ == "__main__":
+    main()
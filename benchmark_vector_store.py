@@ -0,0 +1,136 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from retrieval import CHROMA_PATH
+from index_versions import active_version
+from vector_store import ChromaVectorStore, NumpyVectorStore, NUMPY_STORE_DIR, normalize_rows
+
+
+def rss_mb():
+    # Current resident set size; falls back to the peak where /proc is missing.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_vectors(count, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((count, dimension), dtype=np.float32)
+
+
+def build_chroma(path, vectors, texts, batch_size=5000):
+    store = ChromaVectorStore(path, None)
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        store.add_embeddings([str(i) for i in range(start, min(end, len(texts)))], vectors[start:end],
+                             texts[start:end], [{"row": i} for i in range(start, min(end, len(texts)))])
+    store.close()
+
+
+def read_chroma(path):
+    # Every embedding and text of an existing Chroma persist directory.
+    store = ChromaVectorStore(path, None)
+    stored = store.db.get(include=["embeddings", "documents", "metadatas"])
+    store.close()
+    return stored["ids"], np.asarray(stored["embeddings"], dtype=np.float32), stored["documents"], stored["metadatas"]
+
+
+def measure(backend, path, queries, k, results):
+    # Runs in a fresh process so load time and RSS are not shared with the
+    # other backends.
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if backend == "chroma":
+        store = ChromaVectorStore(path, None)
+    else:
+        store = NumpyVectorStore(path)
+    store.search_by_vector(queries[0], k=k)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    top = [[doc.page_content for doc, _score in store.search_by_vector(query, k=k)] for query in queries]
+    elapsed = time.perf_counter() - start
+    results.put({
+        "backend": backend,
+        "load_seconds": load_time,
+        "qps": len(queries) / elapsed,
+        "rss_mb": rss_mb() - rss_before,
+        "top": top,
+    })
+
+
+def run(backend, path, queries, k):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(backend, path, queries, k, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma-path", type=str, default=None,
+                        help=f"Benchmark against this existing Chroma persist directory (e.g. {CHROMA_PATH}) "
+                             "instead of a synthetic one.")
+    parser.add_argument("--chunks", type=int, default=100000, help="Size of the synthetic index.")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="vector-bench-")
+    try:
+        if args.chroma_path:
+            # The active version, for an index directory with versions.
+            _version, chroma_path = active_version(args.chroma_path)
+            chroma_path = chroma_path or args.chroma_path
+            ids, vectors, texts, metadatas = read_chroma(chroma_path)
+        else:
+            chroma_path = os.path.join(workdir, "chroma")
+            # Unit length, so Chroma's L2 ranking matches cosine ranking.
+            vectors = normalize_rows(make_vectors(args.chunks, args.dimension))
+            ids = [str(i) for i in range(len(vectors))]
+            texts = [f"chunk {i}" for i in range(len(vectors))]
+            metadatas = [{"row": i} for i in range(len(vectors))]
+            start = time.perf_counter()
+            build_chroma(chroma_path, vectors, texts)
+            print(f"Chroma build: {time.perf_counter() - start:.1f}s")
+
+        numpy_paths = {}
+        for quantization in ("float32", "int8"):
+            path = os.path.join(workdir, NUMPY_STORE_DIR, quantization)
+            start = time.perf_counter()
+            NumpyVectorStore(path, quantization=quantization).add_embeddings(ids, vectors, texts, metadatas)
+            print(f"numpy {quantization} build: {time.perf_counter() - start:.1f}s")
+            numpy_paths[f"numpy-{quantization}"] = path
+
+        queries = make_vectors(args.queries, vectors.shape[1], seed=1)
+        print(f"{len(ids)} vectors of dimension {vectors.shape[1]}, {args.queries} queries, k={args.k}")
+        reference = None
+        for backend, path in [("chroma", chroma_path)] + list(numpy_paths.items()):
+            result = run("chroma" if backend == "chroma" else "numpy", path, queries, args.k)
+            if reference is None:
+                reference = result["top"]
+            overlap = np.mean([len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(result["top"], reference)])
+            print(f"{backend:14s} load {result['load_seconds'] * 1000:8.1f} ms   {result['qps']:8.1f} QPS   "
+                  f"RSS +{result['rss_mb']:7.1f} MB   top-{args.k} overlap with chroma {overlap:.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+import json
+import logging
+import os
+import re
+import shutil
+from collections import Counter
+
+import numpy as np
+
+# Keeps part numbers and codes such as "xj-4521" or "v2.1" as one token.
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+MAX_TOKEN_LENGTH = 40
+# Very common words add large postings lists and nothing to ranking.
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or our
+she so that the their them then there these they this to was we were what when which who will with you your
+""".split())
+# Segments are merged into one once there are more than this many, or once
+# this fraction of their documents has been deleted.
+MAX_SEGMENTS = 8
+MAX_DELETED_RATIO = 0.2
+SEGMENTS_FILE = "segments.json"
+# Query terms found in more than this fraction of chunks are "common": they
+# do not select candidates on their own when the query has rarer terms, see
+# BM25Index.search.
+COMMON_TERM_RATIO = 0.05
+
+# 64-bit FNV-1a, used to look keys up in a segment's sorted key hashes.
+FNV_OFFSET_BASIS = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+KEY_FILES = ("key_offsets", "key_blob", "key_hashes", "key_docs")
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS and len(token) <= MAX_TOKEN_LENGTH
+    ]
+
+
+def hash_keys(encoded):
+    # FNV-1a of each UTF-8 encoded key, one byte column at a time over all
+    # keys at once.
+    hashes = np.full(len(encoded), FNV_OFFSET_BASIS, dtype=np.uint64)
+    if not encoded:
+        return hashes
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    width = max(int(lengths.max()), 1)
+    columns = np.asarray(encoded, dtype=f"S{width}").view(np.uint8).reshape(len(encoded), width)
+    for j in range(width):
+        active = lengths > j
+        hashes[active] = (hashes[active] ^ columns[active, j]) * FNV_PRIME
+    return hashes
+
+
+class KeyTable:
+    # The keys of a segment's documents: UTF-8 bytes back to back in one
+    # blob, with offsets, plus the key hashes sorted with their document
+    # numbers for lookups. Loaded segments memory-map all four arrays, so
+    # keys take no process memory until they are read.
+    def __init__(self, key_offsets, key_blob, key_hashes, key_docs):
+        self.key_offsets = key_offsets
+        self.key_blob = key_blob
+        self.key_hashes = key_hashes
+        self.key_docs = key_docs
+
+    @classmethod
+    def from_keys(cls, keys):
+        encoded = [str(key).encode("utf-8") for key in keys]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(key) for key in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls.from_hashes(offsets, blob, hash_keys(encoded))
+
+    @classmethod
+    def from_hashes(cls, offsets, blob, hashes):
+        # hashes are in document order.
+        order = np.argsort(hashes, kind="stable")
+        return cls(offsets, blob, hashes[order], order.astype(np.int32))
+
+    def __len__(self):
+        return len(self.key_offsets) - 1
+
+    def __getitem__(self, doc):
+        return bytes(self.key_blob[self.key_offsets[doc]:self.key_offsets[doc + 1]]).decode("utf-8")
+
+    def take(self, docs):
+        return [self[doc] for doc in docs]
+
+    def hashes_by_doc(self):
+        hashes = np.empty(len(self), dtype=np.uint64)
+        hashes[self.key_docs] = self.key_hashes
+        return hashes
+
+    def select(self, live):
+        # The keys of the documents where live is set, without decoding or
+        # hashing them again.
+        lengths = np.diff(self.key_offsets)
+        offsets = np.zeros(int(live.sum()) + 1, dtype=np.int64)
+        np.cumsum(lengths[live], out=offsets[1:])
+        blob = np.asarray(self.key_blob)[np.repeat(live, lengths)]
+        return offsets, blob, self.hashes_by_doc()[live]
+
+    @classmethod
+    def concatenate(cls, parts):
+        # parts are (offsets, blob, hashes) triples from select().
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for part_offsets, _blob, _hashes in parts:
+            offsets.append(part_offsets[1:] + base)
+            base += int(part_offsets[-1])
+        return cls.from_hashes(
+            np.concatenate(offsets),
+            np.concatenate([blob for _offsets, blob, _hashes in parts] or [np.zeros(0, dtype=np.uint8)]),
+            np.concatenate([hashes for _offsets, _blob, hashes in parts] or [np.zeros(0, dtype=np.uint64)]),
+        )
+
+    def lookup(self, hashes):
+        # (positions in hashes, documents) whose key hashes are equal. Keys
+        # with equal hashes are not compared; callers that must be exact
+        # check the keys.
+        left = np.searchsorted(self.key_hashes, hashes, side="left")
+        right = np.searchsorted(self.key_hashes, hashes, side="right")
+        counts = right - left
+        positions = np.repeat(np.arange(len(hashes)), counts)
+        starts = np.repeat(left, counts)
+        steps = np.arange(len(positions)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return positions, np.asarray(self.key_docs[starts + steps], dtype=np.int64)
+
+    def save(self, path):
+        for name in KEY_FILES:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(os.path.join(path, "key_blob.npy")):
+            # Segments saved before the key table kept a fixed-width string
+            # array; converted here and written in this layout by the next
+            # merge.
+            return cls.from_keys(np.load(os.path.join(path, "keys.npy"), mmap_mode="r").tolist())
+        return cls(**{name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in KEY_FILES})
+
+
+class Segment:
+    # An immutable block of documents with CSR postings: the postings of term
+    # i are doc_ids[offsets[i]:offsets[i + 1]] with matching tfs. Deletions
+    # only flip the deleted mask.
+    def __init__(self, terms, offsets, doc_ids, tfs, doc_lens, keys, deleted=None):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.keys = keys
+        self.deleted = np.zeros(len(doc_lens), dtype=bool) if deleted is None else deleted
+        self.term_index = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, keys, texts):
+        vocabulary = {}
+        term_ids = []
+        doc_ids = []
+        tfs = []
+        doc_lens = np.zeros(len(keys), dtype=np.int32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+        return cls.from_postings(list(vocabulary), np.asarray(term_ids, dtype=np.int32),
+                                 np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.uint16),
+                                 doc_lens, keys)
+
+    @classmethod
+    def from_postings(cls, terms, term_ids, doc_ids, tfs, doc_lens, keys):
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        return cls(np.asarray(terms, dtype=f"<U{MAX_TOKEN_LENGTH}"), offsets, doc_ids[order], tfs[order],
+                   doc_lens, keys if isinstance(keys, KeyTable) else KeyTable.from_keys(keys))
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def postings(self, term):
+        i = self.term_index.get(term)
+        if i is None:
+            return None, None
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.doc_ids[start:stop], self.tfs[start:stop]
+
+    def document_frequencies(self):
+        return dict(zip(self.terms.tolist(), np.diff(self.offsets).tolist()))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("terms", "offsets", "doc_ids", "tfs", "doc_lens"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        self.keys.save(path)
+        self.save_deleted(path)
+
+    def save_deleted(self, path):
+        # Replaced rather than rewritten: other index versions may hard-link
+        # the file.
+        deleted_path = os.path.join(path, "deleted.npy")
+        with open(deleted_path + ".tmp", "wb") as f:
+            np.save(f, self.deleted)
+        os.replace(deleted_path + ".tmp", deleted_path)
+
+    @classmethod
+    def load(cls, path):
+        # The postings arrays and keys are memory-mapped; only the
+        # vocabulary is loaded into a dict.
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if name in ("doc_ids", "tfs") else None)
+            for name in ("terms", "offsets", "doc_ids", "tfs", "doc_lens", "deleted")
+        }
+        return cls(keys=KeyTable.load(path), **arrays)
+
+
+class BM25Index:
+    # Okapi BM25 over a list of segments. Upserting a document deletes its
+    # old copy and adds it to a new segment; segments are merged when there
+    # are too many or too much of them is deleted. Document frequencies count
+    # deleted documents until the next merge. A key is live in at most one
+    # segment; keys are found through the segments' hash-sorted key tables,
+    # so no key-to-document map is held in memory.
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.segments = []
+        self._segment_names = []
+        self._next_segment = 0
+        self._live = 0
+        self._df = Counter()
+        self._total_length = 0
+        self._dirty = set()
+
+    def __len__(self):
+        return self._live
+
+    def _register(self, segment, name):
+        self.segments.append(segment)
+        self._segment_names.append(name)
+        self._live += int((~segment.deleted).sum())
+        self._df.update(segment.document_frequencies())
+        self._total_length += int(segment.doc_lens[~segment.deleted].sum())
+
+    def _find(self, keys):
+        # (segment index, document) of each live document stored under one
+        # of keys, comparing the keys themselves and not just their hashes.
+        hashes = hash_keys([key.encode("utf-8") for key in keys])
+        for index, segment in enumerate(self.segments):
+            for position, doc in zip(*segment.keys.lookup(hashes)):
+                if not segment.deleted[doc] and segment.keys[doc] == keys[position]:
+                    yield index, int(doc)
+
+    def add(self, keys, texts):
+        # The last text of a key given more than once wins.
+        latest = dict(zip(keys, texts))
+        if not latest:
+            return
+        self.delete(list(latest))
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        self._register(Segment.build(list(latest), list(latest.values())), name)
+        self._dirty.add(name)
+
+    def delete(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+        for index, doc in list(self._find(keys)):
+            segment = self.segments[index]
+            if not segment.deleted.flags.writeable:
+                segment.deleted = segment.deleted.copy()
+            segment.deleted[doc] = True
+            self._live -= 1
+            self._total_length -= int(segment.doc_lens[doc])
+            self._dirty.add(self._segment_names[index])
+
+    def _term_scores(self, term, doc_ids, tfs, doc_lens, total_docs, avg_len):
+        df = self._df[term]
+        idf = np.log1p((total_docs - df + 0.5) / (df + 0.5))
+        tf = tfs.astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_lens / avg_len)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def _allowed(self, keys):
+        # Per-segment masks of the documents stored under keys, matched by
+        # key hash only: a 64-bit collision between two chunk ids could at
+        # worst let one extra chunk through a filter.
+        hashes = hash_keys([key.encode("utf-8") for key in keys])
+        allowed = []
+        for segment in self.segments:
+            mask = np.zeros(len(segment), dtype=bool)
+            mask[segment.keys.lookup(hashes)[1]] = True
+            allowed.append(mask)
+        return allowed
+
+    def search(self, query_text, k=5, keys=None):
+        # keys, when given, restricts the results to those documents.
+        terms = [term for term in dict.fromkeys(tokenize(query_text)) if term in self._df]
+        total_docs = self._live
+        if not terms or total_docs == 0:
+            return []
+        allowed = self._allowed(keys) if keys is not None else None
+        avg_len = max(self._total_length / total_docs, 1.0)
+        # Selective terms pick the candidate chunks; common terms only add to
+        # the scores of those candidates instead of scanning their long
+        # postings lists. Without selective terms, every term is scanned.
+        selective = [term for term in terms if self._df[term] <= COMMON_TERM_RATIO * total_docs]
+        common = [term for term in terms if term not in selective] if selective else []
+        if not selective:
+            selective = terms
+        results_keys = []
+        results_scores = []
+        for index, segment in enumerate(self.segments):
+            if allowed is not None and not allowed[index].any():
+                continue
+            scores = None
+            for term in selective:
+                doc_ids, tfs = segment.postings(term)
+                if doc_ids is None or len(doc_ids) == 0:
+                    continue
+                if scores is None:
+                    scores = np.zeros(len(segment), dtype=np.float32)
+                scores[doc_ids] += self._term_scores(term, doc_ids, tfs, segment.doc_lens[doc_ids], total_docs, avg_len)
+            if scores is None:
+                continue
+            scores[segment.deleted] = 0
+            if allowed is not None:
+                scores[~allowed[index]] = 0
+            candidates = np.flatnonzero(scores)
+            for term in common:
+                doc_ids, tfs = segment.postings(term)
+                if doc_ids is None or len(doc_ids) == 0:
+                    continue
+                # Postings are sorted by document, so candidates can be
+                # looked up with a binary search.
+                positions = np.minimum(np.searchsorted(doc_ids, candidates), len(doc_ids) - 1)
+                found = doc_ids[positions] == candidates
+                matched = candidates[found]
+                scores[matched] += self._term_scores(term, matched, tfs[positions[found]], segment.doc_lens[matched],
+                                                     total_docs, avg_len)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+            results_keys.extend(segment.keys.take(candidates.tolist()))
+            results_scores.extend(scores[candidates].tolist())
+        ranked = sorted(zip(results_keys, results_scores), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+    def needs_compaction(self):
+        total = sum(len(segment) for segment in self.segments)
+        deleted = total - self._live
+        return len(self.segments) > MAX_SEGMENTS or (total and deleted / total > MAX_DELETED_RATIO)
+
+    def compact(self):
+        # Merge all live documents into a single segment.
+        vocabulary = {}
+        term_ids, doc_ids, tfs, doc_lens, keys = [], [], [], [], []
+        doc_base = 0
+        for segment in self.segments:
+            live = ~segment.deleted
+            new_doc_ids = np.cumsum(live) - 1 + doc_base
+            local_terms = np.repeat(np.arange(len(segment.terms)), np.diff(segment.offsets))
+            keep = live[segment.doc_ids]
+            mapping = np.asarray([vocabulary.setdefault(term, len(vocabulary)) for term in segment.terms.tolist()],
+                                 dtype=np.int32)
+            term_ids.append(mapping[local_terms[keep]] if len(mapping) else np.zeros(0, dtype=np.int32))
+            doc_ids.append(new_doc_ids[segment.doc_ids[keep]].astype(np.int32))
+            tfs.append(np.asarray(segment.tfs[keep]))
+            doc_lens.append(segment.doc_lens[live])
+            keys.append(segment.keys.select(live))
+            doc_base += int(live.sum())
+        merged = Segment.from_postings(
+            list(vocabulary),
+            np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.uint16),
+            np.concatenate(doc_lens) if doc_lens else np.zeros(0, dtype=np.int32),
+            KeyTable.concatenate(keys),
+        )
+        self.segments, self._segment_names, self._df = [], [], Counter()
+        self._live = self._total_length = 0
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        self._register(merged, name)
+        self._dirty = {name}
+        logger.info(f"Compacted BM25 index into one segment of {len(merged)} chunks.")
+
+    def save(self, directory):
+        if self.needs_compaction():
+            self.compact()
+        os.makedirs(directory, exist_ok=True)
+        for segment, name in zip(self.segments, self._segment_names):
+            if name in self._dirty:
+                path = os.path.join(directory, name)
+                if os.path.exists(os.path.join(path, "offsets.npy")):
+                    segment.save_deleted(path)
+                else:
+                    segment.save(path)
+        self._dirty.clear()
+        segments_path = os.path.join(directory, SEGMENTS_FILE)
+        with open(segments_path + ".tmp", "w") as f:
+            json.dump({"segments": self._segment_names, "next_segment": self._next_segment}, f)
+        os.replace(segments_path + ".tmp", segments_path)
+        # Remove segments that were merged away.
+        for entry in os.listdir(directory):
+            if entry.startswith("seg-") and entry not in self._segment_names:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory):
+        index = cls()
+        with open(os.path.join(directory, SEGMENTS_FILE), "r") as f:
+            state = json.load(f)
+        for name in state["segments"]:
+            index._register(Segment.load(os.path.join(directory, name)), name)
+        index._next_segment = state["next_segment"]
+        return index
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, SEGMENTS_FILE))
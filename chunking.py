@@ -0,0 +1,127 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+
+# Chunk size and overlap are counted in CHUNK_SIZE_UNIT: "chars", or
+# "tokens" (tiktoken cl100k_base tokens, closer to what the embedding model
+# sees).
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+CHUNK_SIZE_UNIT = os.getenv("CHUNK_SIZE_UNIT", "chars")
+TOKEN_ENCODING = "cl100k_base"
+# Pages are sent to the workers in batches of this size; every batch comes
+# back as one batch of chunks.
+PAGES_PER_BATCH = 200
+MAX_CHUNK_WORKERS = os.cpu_count() or 1
+# Corpora of at most this many batches are split in-process; starting the
+# pool would cost more than it saves.
+MIN_PARALLEL_BATCHES = 2
+
+logger = logging.getLogger(__name__)
+
+_splitters = {}
+
+
+def get_splitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, unit=CHUNK_SIZE_UNIT):
+    # One splitter per settings and process; the tiktoken encoding is loaded
+    # once per worker rather than once per batch.
+    key = (chunk_size, chunk_overlap, unit)
+    splitter = _splitters.get(key)
+    if splitter is None:
+        # Imported on first use, so serving processes never import langchain.
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        if unit == "tokens":
+            splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                encoding_name=TOKEN_ENCODING,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                add_start_index=True,
+            )
+        elif unit == "chars":
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                length_function=len,
+                add_start_index=True,
+            )
+        else:
+            raise ValueError(f"Unknown chunk size unit: {unit}")
+        _splitters[key] = splitter
+    return splitter
+
+
+def split_pages(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, unit=CHUNK_SIZE_UNIT):
+    # pages are (page_content, metadata) pairs; returns the chunks as
+    # (page_content, metadata) pairs. Plain tuples pickle much faster than
+    # Documents. Runs in a worker process for large corpora.
+    splitter = get_splitter(chunk_size, chunk_overlap, unit)
+    chunks = splitter.split_documents([Document(page_content=text, metadata=metadata) for text, metadata in pages])
+    return [(chunk.page_content, chunk.metadata) for chunk in chunks]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Spawned for the same reason as the parser pool in ingest.py.
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=MAX_CHUNK_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def page_batches(documents, batch_size=PAGES_PER_BATCH):
+    batch = []
+    for doc in documents:
+        batch.append((doc.page_content, doc.metadata))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_documents(chunks):
+    return [Document(page_content=text, metadata=metadata) for text, metadata in chunks]
+
+
+def iter_chunks(documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, unit=CHUNK_SIZE_UNIT,
+                batch_size=PAGES_PER_BATCH):
+    # Yields lists of chunk Documents, one per batch of pages, in page order.
+    # Chunks keep their page's metadata plus start_index, so
+    # retrieval.chunk_id gives every chunk a stable (source, page, offset) id.
+    # At most two batches per worker are in flight, so chunks can be embedded
+    # while later pages are still being split.
+    batches = page_batches(documents, batch_size)
+    first = [batch for _, batch in zip(range(MIN_PARALLEL_BATCHES + 1), batches)]
+    total = 0
+    if len(first) <= MIN_PARALLEL_BATCHES:
+        for batch in first:
+            chunks = to_documents(split_pages(batch, chunk_size, chunk_overlap, unit))
+            total += len(chunks)
+            yield chunks
+    else:
+        pool = get_pool()
+        pending = deque()
+        for batch in itertools.chain(first, batches):
+            pending.append(pool.submit(split_pages, batch, chunk_size, chunk_overlap, unit))
+            if len(pending) >= 2 * MAX_CHUNK_WORKERS:
+                chunks = to_documents(pending.popleft().result())
+                total += len(chunks)
+                yield chunks
+        while pending:
+            chunks = to_documents(pending.popleft().result())
+            total += len(chunks)
+            yield chunks
+    logger.info(f"Split pages into {total} chunks of up to {chunk_size} {unit} with {chunk_overlap} overlap.")
@@ -1,232 +1,410 @@
-# import logging
-# from langchain_community.document_loaders import DirectoryLoader
-# from langchain.text_splitter import RecursiveCharacterTextSplitter
-# from langchain.schema import Document
-# from langchain_openai import OpenAIEmbeddings
-# from langchain_community.vectorstores import Chroma
-# import openai 
-# from dotenv import load_dotenv
-# import os
-# import shutil
-# from pymongo import MongoClient
-
-# # Configure logging
-# logging.basicConfig(level=logging.INFO)
-# logger = logging.getLogger(__name__)
-
-# # Load environment variables. Assumes that project contains .env file with API keys
-# load_dotenv()
-
-# # Set OpenAI API key 
-# openai.api_key = os.environ['OPENAI_API_KEY']
-
-# CHROMA_PATH = "chroma"
-# MONGO_URI = os.environ['MONGO_URI']
-# DATABASE_NAME = "document_db"
-# COLLECTION_NAME = "documents"
-
-# client = MongoClient(MONGO_URI)
-# db = client[DATABASE_NAME]
-# collection = db[COLLECTION_NAME]
-
-# def main():
-#     try:
-#         logger.info("Starting database update...")
-#         generate_data_store()
-#         logger.info("Database updated successfully.")
-#     except Exception as e:
-#         logger.error(f"Error updating database: {str(e)}")
-#     finally:
-#         logger.info("Exiting script.")
-
-# def generate_data_store():
-#     documents = load_documents()
-#     chunks = split_text(documents)
-#     save_to_chroma(chunks)
-
-# def load_documents():
-#     documents = []
-#     for doc in collection.find():
-#         documents.append(Document(page_content=doc["page_content"], metadata=doc["metadata"]))
-#     logger.info(f"Loaded {len(documents)} documents from MongoDB.")
-#     return documents
-
-# def split_text(documents: list[Document]):
-#     text_splitter = RecursiveCharacterTextSplitter(
-#         chunk_size=500,
-#         chunk_overlap=250,
-#         length_function=len,
-#         add_start_index=True,
-#     )
-#     chunks = text_splitter.split_documents(documents)
-#     logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks.")
-
-#     document = chunks[10]
-#     logger.debug(document.page_content)
-#     logger.debug(document.metadata)
-
-#     return chunks
-
-# def save_to_chroma(chunks: list[Document]):
-#     # Clear out the database first.
-#     if os.path.exists(CHROMA_PATH):
-#         shutil.rmtree(CHROMA_PATH)
-#         logger.info(f"Cleared existing Chroma database at {CHROMA_PATH}.")
-
-#     # Create a new DB from the documents.
-#     db = Chroma.from_documents(
-#         chunks, OpenAIEmbeddings(), persist_directory=CHROMA_PATH
-#     )
-#     db.persist()
-#     logger.info(f"Saved {len(chunks)} chunks to {CHROMA_PATH}.")
-
-# if __name__ == "__main__":
-#     main()
-
 import logging
 from colorlog import ColoredFormatter
-from langchain_community.document_loaders import DirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-# from langchain.schema import Document
 from langchain_core.documents import Document
-from langchain_community.vectorstores import Chroma
-from sentence_transformers import SentenceTransformer
-import openai 
 from dotenv import load_dotenv
 import os
-import shutil
-from pymongo import MongoClient
-import tiktoken
-from datetime import datetime
-
-# Configure logging with colorlog
-formatter = ColoredFormatter(
-    "%(log_color)s%(levelname)s:%(name)s:%(message)s",  # Fixed format string
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG': 'cyan',
-        'INFO': 'green',
-        'WARNING': 'yellow',
-        'ERROR': 'red',
-        'CRITICAL': 'red,bg_white',
-    }
-)
-
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
+import argparse
+import hashlib
+import itertools
+import json
+from retrieval import CHROMA_PATH, KEYWORD_INDEX_DIR, get_engine, chunk_id, index_path
+from index_versions import active_version, create_version, activate, discard_version, collect_garbage
+from bm25 import BM25Index
+from vector_store import open_vector_store
+from chunking import iter_chunks, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SIZE_UNIT
+from pipeline import prefetch, BackgroundWriter
+from storage import documents_collection, references_collection
+from metrics import stage, timed
+from namespaces import DEFAULT_NAMESPACE
 
 logger = logging.getLogger(__name__)
-logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
-# Load environment variables. Assumes that project contains .env file with API keys
-load_dotenv()
 
-CHROMA_PATH = "chroma"
-MONGO_URI = os.environ['MONGO_URI']
-DATABASE_NAME = "document_db"
-COLLECTION_NAME = "documents"
-TOKEN_LOG_FILE = "token_log.txt"
-
-client = MongoClient(MONGO_URI)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
+def configure_logging():
+    # Colored console output when run as a script. Index jobs of the servers
+    # import this module, and their log lines go to the server's handlers.
+    formatter = ColoredFormatter(
+        "%(log_color)s%(levelname)s:%(name)s:%(message)s",  # Fixed format string
+        datefmt=None,
+        reset=True,
+        log_colors={
+            'DEBUG': 'cyan',
+            'INFO': 'green',
+            'WARNING': 'yellow',
+            'ERROR': 'red',
+            'CRITICAL': 'red,bg_white',
+        }
+    )
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
 
-class SentenceTransformerEmbeddings:
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+# Load environment variables. Assumes that project contains .env file with API keys
+load_dotenv()
 
-    def embed_documents(self, documents: list[Document]):
-        print("Embedding documents...")
-        return [self.model.encode(doc).tolist() for doc in documents]
+# Page and chunk content hashes of what is currently in Chroma, used to
+# work out what an incremental update has to embed or delete.
+MANIFEST_FILE = "manifest.json"
+UPSERT_BATCH_SIZE = 1000
+# Pages fetched from MongoDB per round trip.
+READ_BATCH_SIZE = 500
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Rebuild the whole index instead of updating it incrementally.")
+    parser.add_argument("--namespace", type=str, default=DEFAULT_NAMESPACE, help="The corpus to index.")
+    args = parser.parse_args()
     try:
         logger.info("Starting database update...")
-        generate_data_store()
+        generate_data_store(full=args.full, namespace=args.namespace)
         logger.info("Database updated successfully.")
     except Exception as e:
         logger.error(f"Error updating database: {str(e)}")
     finally:
         logger.info("Exiting script.")
 
-def generate_data_store():
-    documents = load_documents()
-    chunks = split_text(documents)
-    save_to_chroma(chunks)
-
-def load_documents():
-    documents = []
-    for doc in collection.find():
-        # Log the raw data coming from the database
-        # logger.info(f"Raw document from MongoDB: {doc}")
-        
-        # Ensure the document is correctly converted from JSON to Document object
-        if isinstance(doc, dict) and "page_content" in doc and "metadata" in doc:
-            
-            documents.append(Document(page_content=doc["page_content"], metadata=doc["metadata"]))
+def generate_data_store(full=False, progress=None, namespace=DEFAULT_NAMESPACE):
+    # progress, when given, is a jobs.IndexJob that is kept up to date with
+    # the current phase and chunk counts. Pages are streamed from MongoDB, so
+    # memory use does not grow with the size of the collection. Every
+    # namespace has its own collection and index directory.
+    collection = documents_collection(namespace)
+    with stage("ingest", "index_build"):
+        if progress:
+            progress.set_phase("loading", pages=collection.estimated_document_count())
+        occurrences = {}
+        documents = record_occurrences(occurrences, assign_page_keys(load_documents(collection)))
+        _version, active_directory = active_version(index_path(namespace))
+        manifest = None if full or active_directory is None else load_manifest(active_directory)
+        if manifest is None:
+            new_manifest = build_manifest()
+            save_to_chroma(iter_chunks(record_pages(new_manifest, documents)), new_manifest, progress=progress,
+                           namespace=namespace, occurrences=occurrences)
         else:
-            logger.warning(f"Skipping invalid document: {doc}")
-    # print(documents[0])
-    logger.info(f"Loaded {len(documents)} documents from MongoDB.")
-    return documents
-
-def split_text(documents):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=250,
-        length_function=len,
-        add_start_index=True,
-    )
-    chunks = text_splitter.split_documents(documents)
-    logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks.")
-    logger.info(type(chunks[0]))
-    # Check the type of each chunk
-    for i, chunk in enumerate(chunks):
-        if isinstance(chunk, Document):
-            logger.debug(f"Chunk {i}: Document content: {chunk.page_content[:50]}")
-        else:
-            logger.error(f"Chunk {i} is not a Document object: {chunk}")
-            # Convert chunk back to Document if needed
-            chunks[i] = Document(page_content=str(chunk), metadata={})
-    # print(chunks[2])
-    return chunks
-
-# def log_token_count(documents):
-#     encoding = tiktoken.encoding_for_model("gpt-3.5")
-#     total_tokens = sum(len(encoding.encode(doc.page_content)) for doc in documents)
-
-#     with open(TOKEN_LOG_FILE, "a") as log_file:
-#         log_file.write(f"{datetime.now()}: Total Tokens: {total_tokens}\n")
-
-
-
-def save_to_chroma(chunks):
-    # Validate chunks before proceeding
-
-    for i, chunk in enumerate(chunks):
-        if not isinstance(chunk, Document):
-            logger.error(f"Invalid chunk at index {i}: {chunk}")
-            return
-
-        logger.debug(f"Chunk {i} - page_content: {chunk.page_content[:50]}, metadata: {chunk.metadata}")
-
-    if os.path.exists(CHROMA_PATH):
-        shutil.rmtree(CHROMA_PATH)
-        logger.info(f"Cleared existing Chroma database at {CHROMA_PATH}.")
-
-    embedding_model = SentenceTransformerEmbeddings('sentence-transformers/all-MiniLM-L6-v2')
+            update_chroma(documents, manifest, occurrences, progress=progress, namespace=namespace)
+
+def get_embedding_model():
+    # Reuse the process-wide model, so in-process updates do not load a
+    # second copy next to the one serving queries.
+    return get_engine().embedding_model
+
+def upsert_chunks(store, chunk_batches, progress=None, on_saved=None):
+    # Three stages with bounded queues between them: chunk_batches is
+    # consumed on a prefetch thread (reading MongoDB and splitting), batches
+    # are embedded on this thread, and a writer thread upserts them and then
+    # calls on_saved(chunks, ids). The embedding stage never waits for a
+    # write unless the writer is QUEUE_DEPTH batches behind.
+    embedding_model = get_embedding_model()
+
+    def write(batch):
+        chunks, ids, embeddings = batch
+        with stage("ingest", "persist"):
+            store.add_embeddings(ids, embeddings, [chunk.page_content for chunk in chunks],
+                                 [chunk.metadata for chunk in chunks])
+        if on_saved:
+            on_saved(chunks, ids)
+        if progress:
+            progress.advance(len(ids))
+
+    saved = 0
+    with BackgroundWriter(write) as writer:
+        # "chunk" is the time to read and split each batch of pages.
+        for chunks in prefetch(timed(chunk_batches, "ingest", "chunk")):
+            for start in range(0, len(chunks), UPSERT_BATCH_SIZE):
+                batch = chunks[start:start + UPSERT_BATCH_SIZE]
+                with stage("ingest", "embed"):
+                    embeddings = embedding_model.encode([chunk.page_content for chunk in batch])
+                writer.put((batch, [chunk_id(chunk) for chunk in batch], embeddings))
+                saved += len(batch)
+    return saved
+
+def page_occurrences(collection, pages):
+    # [source, page, upload time] of every file and page each of pages (raw
+    # MongoDB documents) occurs at, from the references collection. Pages
+    # stored before page dedup only occur where their metadata says.
+    references = {}
+    content_hashes = [page["content_hash"] for page in pages if "content_hash" in page]
+    if content_hashes:
+        cursor = references_collection(collection).find({"content_hash": {"$in": content_hashes}},
+                                                        {"_id": 0, "content_hash": 1, "source": 1, "page": 1,
+                                                         "uploaded_at": 1})
+        for reference in cursor:
+            references.setdefault(reference["content_hash"], []).append(
+                [reference.get("source"), reference.get("page"), reference.get("uploaded_at")])
+    return [
+        sorted(references.get(page.get("content_hash"), []), key=repr) or
+        [[page["metadata"].get("source"), page["metadata"].get("page"), page["metadata"].get("uploaded_at")]]
+        for page in pages
+    ]
+
+def load_documents(collection):
+    # Pages in insertion order, fetched READ_BATCH_SIZE at a time with only
+    # the fields indexing needs. Their occurrences are passed along in
+    # metadata["occurrences"] until record_occurrences takes them out.
+    cursor = collection.find({}, {"_id": 0, "page_content": 1, "metadata": 1, "content_hash": 1}).sort("_id", 1)
+    loaded = 0
+    batch = []
+    for doc in itertools.chain(cursor.batch_size(READ_BATCH_SIZE), [None]):
+        if doc is not None:
+            if "page_content" in doc and "metadata" in doc:
+                batch.append(doc)
+            else:
+                logger.warning(f"Skipping invalid document: {doc}")
+            if len(batch) < READ_BATCH_SIZE:
+                continue
+        for page, occurrences in zip(batch, page_occurrences(collection, batch)):
+            loaded += 1
+            yield Document(page_content=page["page_content"], metadata={**page["metadata"], "occurrences": occurrences})
+        batch = []
+    logger.info(f"Loaded {loaded} documents from MongoDB.")
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def assign_page_keys(documents):
+    # A page is identified by its source file and page number. The same file
+    # can be stored more than once, so repeated pages get a #n suffix.
+    seen = {}
+    for doc in documents:
+        key = f"{doc.metadata.get('source')}:{doc.metadata.get('page')}"
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        doc.metadata["page_key"] = key if count == 0 else f"{key}#{count}"
+        yield doc
+
+def record_occurrences(occurrences, documents):
+    # Moves each page's occurrences into occurrences, by page key, so that
+    # only the first occurrence ends up in the chunks' own metadata.
+    for doc in documents:
+        occurrences[doc.metadata["page_key"]] = doc.metadata.pop("occurrences")
+        yield doc
+
+def occurrence_rows(occurrences):
+    return [(page_key, source, page, uploaded_at)
+            for page_key, page_occurrences in occurrences.items() for source, page, uploaded_at in page_occurrences]
+
+def chunk_settings():
+    return {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP, "unit": CHUNK_SIZE_UNIT}
+
+def build_manifest():
+    # Pages are added by record_pages as they are read and chunk hashes by
+    # record_chunks as chunks are saved.
+    return {"chunking": chunk_settings(), "pages": {}}
+
+def record_pages(manifest, documents):
+    for doc in documents:
+        manifest["pages"][doc.metadata["page_key"]] = {"hash": content_hash(doc.page_content), "chunks": {}}
+        yield doc
+
+def record_chunks(manifest, chunks):
+    for chunk in chunks:
+        manifest["pages"][chunk.metadata["page_key"]]["chunks"][chunk_id(chunk)] = content_hash(chunk.page_content)
+
+def load_manifest(persist_directory=CHROMA_PATH):
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        logger.info("No index manifest found, doing a full rebuild.")
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    # Chunks cut with other settings would never match the new ones.
+    if manifest.get("chunking") != chunk_settings():
+        logger.info("Chunking settings changed since the last build, doing a full rebuild.")
+        return None
+    return manifest
+
+def save_manifest(manifest, persist_directory=CHROMA_PATH):
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def keyword_index_dir(persist_directory=CHROMA_PATH):
+    return os.path.join(persist_directory, KEYWORD_INDEX_DIR)
+
+def load_keyword_index(persist_directory=CHROMA_PATH):
+    # None for an index built before BM25 existed.
+    if not BM25Index.exists(keyword_index_dir(persist_directory)):
+        return None
+    return BM25Index.load(keyword_index_dir(persist_directory))
+
+def update_keyword_index(store, keyword_index, stale_ids, persist_directory=CHROMA_PATH):
+    # keyword_index already has the upserts of the update; the deletions are
+    # applied here. An index built before BM25 existed (keyword_index is
+    # None) is rebuilt once from the chunk texts the vector store holds.
+    if keyword_index is not None:
+        keyword_index.delete(stale_ids)
+    else:
+        stored_ids, stored_texts = store.get_texts()
+        keyword_index = BM25Index()
+        keyword_index.add(stored_ids, stored_texts)
+    keyword_index.save(keyword_index_dir(persist_directory))
+    logger.info(f"Saved BM25 index with {len(keyword_index)} chunks.")
+
+class IndexValidationError(RuntimeError):
+    pass
+
+def manifest_chunk_count(manifest):
+    return sum(len(page["chunks"]) for page in manifest["pages"].values())
+
+def activate_version(namespace, version, store, expected_chunks):
+    # A build is written to a new index version (see index_versions.py),
+    # checked, opened in this process and only then activated. Running
+    # servers switch to it on their next query, while queries already
+    # running finish on the previous version.
+    engine = get_engine(namespace)
+    chunks = len(store)
+    if chunks != expected_chunks:
+        raise IndexValidationError(f"Index version {version} holds {chunks} chunks instead of {expected_chunks}; "
+                                   f"run with --full to rebuild it.")
+    prepared = engine.prepare(version)
+    # Also warms the new version before it takes queries.
+    if expected_chunks and not prepared.search_by_vector(engine.embed_query("warm up"), k=1):
+        raise IndexValidationError(f"Index version {version} returned no search results.")
+    root = index_path(namespace)
+    activate(root, version)
+    engine.refresh()
+    collect_garbage(root, engine.open_versions())
+
+def discard_build(namespace, version):
+    get_engine(namespace).discard(version)
+    discard_version(index_path(namespace), version)
+
+def counted(chunk_batches, progress=None):
+    # Builds split and embed at the same time, so the job's chunk total grows
+    # as batches come out of the splitter.
+    for chunks in chunk_batches:
+        if progress:
+            progress.add_total(len(chunks))
+        yield chunks
+
+def save_to_chroma(chunk_batches, manifest=None, progress=None, namespace=DEFAULT_NAMESPACE, occurrences=None):
+    # chunk_batches is an iterable of lists of chunks; each batch is embedded
+    # and saved as soon as it arrives, see upsert_chunks. The index is built
+    # as a new version next to the active one, which keeps serving queries.
+    # occurrences (see record_occurrences) is complete once chunk_batches is
+    # exhausted and is then stored for filtering.
+    version, persist_directory = create_version(index_path(namespace))
+    embedding_model = get_embedding_model()
     try:
-        # print("Creating Chroma database...",chunks)
-        # print(chunks[0].page_content)
-        db = Chroma.from_documents(
-            chunks, embedding_model, persist_directory=CHROMA_PATH
-        )
-        db.persist()
-        logger.info(f"Saved {len(chunks)} chunks to {CHROMA_PATH}.")
+        store = open_vector_store(persist_directory, embedding_model)
+        keyword_index = BM25Index()
+        if progress:
+            progress.set_phase("embedding", chunks_total=0, chunks_done=0)
+
+        def on_saved(chunks, ids):
+            keyword_index.add(ids, [chunk.page_content for chunk in chunks])
+            if manifest is not None:
+                record_chunks(manifest, chunks)
+
+        saved = upsert_chunks(store, counted(chunk_batches, progress), progress=progress, on_saved=on_saved)
+        if progress:
+            progress.set_phase("saving")
+        if occurrences is not None:
+            store.set_occurrences(occurrence_rows(occurrences))
+        keyword_index.save(keyword_index_dir(persist_directory))
+        if manifest is not None:
+            if occurrences is not None:
+                for key, page in manifest["pages"].items():
+                    page["occurrences"] = occurrences.get(key, [])
+            save_manifest(manifest, persist_directory)
+        activate_version(namespace, version, store, manifest_chunk_count(manifest) if manifest is not None else saved)
+        logger.info(f"Saved {saved} chunks to {persist_directory}.")
     except Exception as e:
         logger.error(f"Failed to create Chroma database: {str(e)}")
+        discard_build(namespace, version)
+        raise
+
+def stale_chunk_ids(old_pages, new_pages):
+    # Chunks of removed pages, and chunks changed pages no longer have.
+    return [cid for key, old_page in old_pages.items() for cid in old_page["chunks"]
+            if key not in new_pages or cid not in new_pages[key]["chunks"]]
+
+def update_chroma(documents, manifest, occurrences, progress=None, namespace=DEFAULT_NAMESPACE):
+    # Only pages whose content hash changed are split again, and only chunks
+    # whose hash changed are embedded. Chunks of removed pages are deleted.
+    # Pages that only gained or lost occurrences just get a new occurrence
+    # table. Changed pages stream through the same split, embed and upsert
+    # stages as a full build, so memory does not grow with the size of the
+    # update. The changes are applied to a copy of the active version, which
+    # keeps serving queries until the copy is activated; it is only made
+    # once there is something to change.
+    old_pages = manifest["pages"]
+    new_pages = {}
+    counts = {"pages": 0, "changed": 0, "moved": 0}
+
+    def changed_pages():
+        for doc in documents:
+            counts["pages"] += 1
+            key = doc.metadata["page_key"]
+            page_hash = content_hash(doc.page_content)
+            old_page = old_pages.get(key)
+            if old_page is not None and old_page["hash"] == page_hash:
+                new_pages[key] = {**old_page, "occurrences": occurrences[key]}
+                if old_page.get("occurrences") != occurrences[key]:
+                    counts["moved"] += 1
+            else:
+                new_pages[key] = {"hash": page_hash, "chunks": {}, "occurrences": occurrences[key]}
+                counts["changed"] += 1
+                yield doc
+
+    def changed_chunks():
+        # Batches of the chunks of changed pages whose hash changed. All
+        # chunks of a page are in the same batch.
+        for chunks in iter_chunks(changed_pages()):
+            changed = []
+            for chunk in chunks:
+                key = chunk.metadata["page_key"]
+                cid = chunk_id(chunk)
+                chunk_hash = content_hash(chunk.page_content)
+                new_pages[key]["chunks"][cid] = chunk_hash
+                old_page = old_pages.get(key)
+                if old_page is None or old_page["chunks"].get(cid) != chunk_hash:
+                    changed.append(chunk)
+            if changed:
+                yield changed
+
+    batches = changed_chunks()
+    first = next(batches, None)
+    if first is None and not stale_chunk_ids(old_pages, new_pages) and not counts["moved"]:
+        logger.info(f"Chroma database is already up to date ({counts['pages']} pages).")
+        return
+
+    embedding_model = get_embedding_model()
+    version, persist_directory = create_version(index_path(namespace), copy_active=True)
+    try:
+        store = open_vector_store(persist_directory, embedding_model)
+        keyword_index = load_keyword_index(persist_directory)
+        if progress:
+            progress.set_phase("embedding", chunks_total=0, chunks_done=0)
+
+        def on_saved(chunks, ids):
+            if keyword_index is not None:
+                keyword_index.add(ids, [chunk.page_content for chunk in chunks])
+
+        upserted = upsert_chunks(store, counted(itertools.chain([first] if first else [], batches), progress),
+                                 progress=progress, on_saved=on_saved)
+        # Known once every page has been read. Upserted chunks are never
+        # stale, so deleting after the upserts gives the same result.
+        stale_ids = stale_chunk_ids(old_pages, new_pages)
+        if progress:
+            progress.set_phase("saving")
+        store.delete(stale_ids)
+        store.maybe_compact()
+        store.set_occurrences(occurrence_rows(occurrences))
+        update_keyword_index(store, keyword_index, stale_ids, persist_directory)
+        new_manifest = {"chunking": chunk_settings(), "pages": new_pages}
+        save_manifest(new_manifest, persist_directory)
+        activate_version(namespace, version, store, manifest_chunk_count(new_manifest))
+        logger.info(f"Updated {persist_directory}: {counts['changed']} of {counts['pages']} pages changed and "
+                    f"{counts['moved']} changed occurrences, upserted {upserted} chunks, deleted {len(stale_ids)}.")
+    except Exception as e:
+        logger.error(f"Failed to update Chroma database: {str(e)}")
+        discard_build(namespace, version)
+        raise
 
 if __name__ == "__main__":
+    configure_logging()
     main()
\ No newline at end of file
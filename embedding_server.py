@@ -0,0 +1,220 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+from embeddings import SentenceTransformerEmbeddings, QueryBatcher
+
+# Embedding sidecar: one process holds the embedding model and serves every
+# API worker over a Unix socket, so adding workers does not add model copies
+# and encodes are serialized instead of competing for the CPU. Small requests
+# (single queries, or a worker's own query batch) from all workers are merged
+# into shared batches by a QueryBatcher; large ones (index builds) are encoded
+# as they are. Start it with `python embedding_server.py` and set
+# EMBEDDING_SOCKET in the API workers to its socket path.
+#
+# Protocol, on a persistent connection: the client sends a 4-byte length and
+# a JSON list of texts; the server answers with (rows, dimension) and the
+# embeddings as raw little-endian float32, which the client receives directly
+# into its result array. An empty list returns just the dimension. Errors are
+# answered with rows = -1 followed by a UTF-8 message of "dimension" bytes.
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET")
+DEFAULT_SOCKET_PATH = "/tmp/rag-embeddings.sock"
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+REQUEST_HEADER = struct.Struct("<I")
+RESPONSE_HEADER = struct.Struct("<iI")
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+
+def recv_into_exactly(sock, view):
+    while len(view):
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("Embedding server connection closed.")
+        view = view[received:]
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    recv_into_exactly(sock, memoryview(buffer))
+    return buffer
+
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    # One thread per worker connection, serving requests until it closes.
+    def handle(self):
+        while True:
+            try:
+                (size,) = REQUEST_HEADER.unpack(recv_exactly(self.request, REQUEST_HEADER.size))
+            except ConnectionError:
+                return
+            if size > MAX_REQUEST_BYTES:
+                self.send_error(f"Request of {size} bytes exceeds the {MAX_REQUEST_BYTES} byte limit.")
+                return
+            try:
+                vectors = self.server.embed(json.loads(recv_exactly(self.request, size)))
+            except ConnectionError:
+                return
+            except Exception as e:
+                logger.error(f"Failed to embed a request: {str(e)}")
+                self.send_error(str(e))
+                continue
+            self.request.sendall(RESPONSE_HEADER.pack(len(vectors), self.server.dimension))
+            if len(vectors):
+                # Sent straight from the array's buffer, without a bytes copy.
+                self.request.sendall(memoryview(np.ascontiguousarray(vectors, dtype="<f4")).cast("B"))
+
+    def send_error(self, message):
+        message = message.encode("utf-8")
+        self.request.sendall(RESPONSE_HEADER.pack(-1, len(message)) + message)
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model):
+        self.model = model
+        self.dimension = model.dimension
+        # One encode at a time: parallel encodes only fight over the cores.
+        self._encode_lock = threading.Lock()
+        self.batcher = QueryBatcher(self._encode)
+        if os.path.exists(socket_path):
+            if socket_is_live(socket_path):
+                raise EmbeddingServerError(f"An embedding server is already listening on {socket_path}.")
+            os.unlink(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+
+    def _encode(self, texts):
+        with self._encode_lock:
+            return self.model.encode(texts)
+
+    def embed(self, texts):
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        if len(texts) > self.batcher.max_batch_size:
+            return self._encode(texts)
+        futures = [self.batcher.submit(text) for text in texts]
+        return np.stack([future.result() for future in futures])
+
+
+def socket_is_live(socket_path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+class RemoteEmbeddings:
+    # Same interface as embeddings.SentenceTransformerEmbeddings, backed by
+    # the embedding server. Connections are pooled, one per concurrent
+    # caller. Safe to share across threads.
+    def __init__(self, socket_path=EMBEDDING_SOCKET or DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self._connections = queue.LifoQueue()
+        self.dimension = self.encode([]).shape[1]
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise EmbeddingServerError(f"Cannot reach the embedding server at {self.socket_path}: {e}")
+        return sock
+
+    def _close_all(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, sock, body):
+        sock.sendall(REQUEST_HEADER.pack(len(body)) + body)
+        rows, size = RESPONSE_HEADER.unpack(recv_exactly(sock, RESPONSE_HEADER.size))
+        if rows < 0:
+            raise EmbeddingServerError(recv_exactly(sock, size).decode("utf-8", "replace"))
+        vectors = np.empty((rows, size), dtype="<f4")
+        if rows:
+            recv_into_exactly(sock, memoryview(vectors).cast("B"))
+        return vectors
+
+    def encode(self, texts):
+        body = json.dumps(list(texts)).encode("utf-8")
+        for attempt in range(2):
+            try:
+                sock = self._connections.get_nowait()
+            except queue.Empty:
+                sock = self._connect()
+            try:
+                vectors = self._request(sock, body)
+            except EmbeddingServerError:
+                # The server may close the connection after an error reply
+                # (it does for oversized requests), so it is not reused.
+                sock.close()
+                raise
+            except OSError:
+                # Pooled connections break when the server restarts; retry
+                # once on a new one.
+                sock.close()
+                self._close_all()
+                if attempt:
+                    raise
+                continue
+            except BaseException:
+                # Interrupted mid-reply: the rest of it would be read as the
+                # next request's answer.
+                sock.close()
+                raise
+            self._connections.put(sock)
+            return vectors
+
+    # Chroma and langchain expect plain lists; convert the whole array once.
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+def main():
+    from retrieval import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", type=str, default=EMBEDDING_SOCKET or DEFAULT_SOCKET_PATH,
+                        help="Unix socket path to listen on.")
+    parser.add_argument("--model", type=str, default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--device", type=str, default=None, help="Torch device, e.g. cpu or cuda.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    logger.info(f"Loading embedding model {args.model}.")
+    model = SentenceTransformerEmbeddings(args.model, device=args.device)
+    model.encode(["warm up"])
+    server = EmbeddingServer(args.socket, model)
+    logger.info(f"Embedding server listening on {args.socket}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
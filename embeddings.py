@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 64
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_BATCH_SIZE = 32
+QUERY_BATCH_WAIT = float(os.getenv("QUERY_BATCH_WAIT_MS", "3")) / 1000
+
+logger = logging.getLogger(__name__)
+
+
+class SentenceTransformerEmbeddings:
+    # Embeds texts in batches into one contiguous float32 array. With
+    # sort_by_length, texts are bucketed by length before batching so each
+    # batch pads to a similar length; results are returned in input order.
+    def __init__(self, model_name: str, batch_size: int = DEFAULT_BATCH_SIZE, sort_by_length: bool = True,
+                 device: str = None):
+        # Imported here: sentence-transformers pulls in torch, which takes
+        # seconds to import.
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+        self.sort_by_length = sort_by_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return embeddings
+        if self.sort_by_length:
+            order = np.argsort([-len(text) for text in texts], kind="stable")
+        else:
+            order = np.arange(len(texts))
+        for start in range(0, len(texts), self.batch_size):
+            batch_idx = order[start:start + self.batch_size]
+            embeddings[batch_idx] = self.model.encode(
+                [texts[i] for i in batch_idx],
+                batch_size=len(batch_idx),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        logger.debug(f"Embedded {len(texts)} texts in batches of {self.batch_size}.")
+        return embeddings
+
+    # Chroma and langchain expect plain lists; convert the whole array once.
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
+
+
+def normalize_query(text):
+    # all-MiniLM-L6-v2 is uncased, so case and runs of whitespace do not
+    # change the embedding.
+    return " ".join(text.split()).lower()
+
+
+class QueryEmbeddingCache:
+    # LRU of query embeddings keyed by a hash of the normalized query text.
+    # Memory is bounded by max_entries vectors.
+    def __init__(self, max_entries=QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        key = self.key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return vector
+
+    def put(self, text, vector):
+        if self.max_entries <= 0:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class QueryBatcher:
+    # Collects queries arriving from concurrent requests for up to max_wait
+    # seconds and embeds them with one encode() call. embed() blocks the
+    # calling thread until its vector is ready.
+    def __init__(self, encode, max_batch_size=QUERY_BATCH_SIZE, max_wait=QUERY_BATCH_WAIT):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text):
+        # A Future of the text's vector, for callers embedding several texts.
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Identical queries in one batch are encoded once.
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            # Copy rows out so a cached vector does not keep the whole batch alive.
+            rows = {text: vectors[i].copy() for i, text in enumerate(texts)}
+            for text, future in batch:
+                future.set_result(rows[text])
+            logger.debug(f"Embedded {len(texts)} queries for {len(batch)} requests in one batch.")
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tokens import count_tokens
+
+# Budget for the verbatim part of the conversation history in the prompt.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+# Upper bound on turns read per request, whatever their size.
+HISTORY_MAX_TURNS = 20
+# Upper bound on turns folded into the summary in one go, so the first
+# request on a very long pre-existing session stays bounded too.
+MAX_FOLD_TURNS = 50
+SUMMARY_MAX_CHARS = 2000
+
+SUMMARY_PROMPT = """
+Summarize the following conversation between a user and an AI assistant named John in a few sentences. Keep names, facts and open questions.
+
+{summary}
+
+{turns}
+
+---
+Summary:
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def format_turn(turn):
+    return f"User: {turn['query_text']}\nJohn: {turn['response_text']}"
+
+
+class HistoryManager:
+    # Builds the conversation history part of the prompt from a
+    # token-budgeted window of the latest turns plus a rolling summary of
+    # everything older. The summary lives in its own collection, one document
+    # per session, and is brought up to date in the background when turns
+    # drop out of the window, so reading history costs the same for a
+    # session of any length. history_collection and summary_collection are
+    # functions returning the collections, called on every use.
+    def __init__(self, history_collection, summary_collection, summarize,
+                 token_budget=HISTORY_TOKEN_BUDGET, max_turns=HISTORY_MAX_TURNS):
+        self._history_collection = history_collection
+        self._summary_collection = summary_collection
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._folding = set()
+        self._lock = threading.Lock()
+
+    @property
+    def history(self):
+        return self._history_collection()
+
+    @property
+    def summaries(self):
+        return self._summary_collection()
+
+    def get_context(self, session_id):
+        turns = list(
+            self.history.find({"session_id": session_id}, {"query_text": 1, "response_text": 1, "timestamp": 1})
+            .sort("timestamp", -1)
+            .limit(self.max_turns + 1)
+        )
+        window = []
+        used = 0
+        for turn in turns[:self.max_turns]:
+            tokens = count_tokens(format_turn(turn))
+            if window and used + tokens > self.token_budget:
+                break
+            window.append(turn)
+            used += tokens
+        window.reverse()
+
+        summary_doc = self.summaries.find_one({"session_id": session_id}) or {}
+        summary = summary_doc.get("summary", "")
+        if window and len(window) < len(turns):
+            # Some turns are older than the window; make sure they end up in
+            # the summary without making this request wait for it.
+            window_start = window[0]["timestamp"]
+            covered_until = summary_doc.get("covered_until")
+            if covered_until is None or covered_until < turns[len(window)]["timestamp"]:
+                self._schedule_fold(session_id, window_start)
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation:\n{summary}")
+        if window:
+            parts.append("\n".join(format_turn(turn) for turn in window))
+        return "\n\n".join(parts)
+
+    def _schedule_fold(self, session_id, window_start):
+        with self._lock:
+            if session_id in self._folding:
+                return
+            self._folding.add(session_id)
+        self._executor.submit(self._fold, session_id, window_start)
+
+    def _fold(self, session_id, window_start):
+        try:
+            summary_doc = self.summaries.find_one({"session_id": session_id}) or {}
+            timestamp_range = {"$lt": window_start}
+            if "covered_until" in summary_doc:
+                timestamp_range["$gt"] = summary_doc["covered_until"]
+            turns = list(
+                self.history.find({"session_id": session_id, "timestamp": timestamp_range})
+                .sort("timestamp", -1)
+                .limit(MAX_FOLD_TURNS)
+            )
+            if not turns:
+                return
+            turns.reverse()
+            prompt = SUMMARY_PROMPT.format(
+                summary=summary_doc.get("summary", ""),
+                turns="\n".join(format_turn(turn) for turn in turns),
+            )
+            summary = self.summarize(prompt).strip()[:SUMMARY_MAX_CHARS]
+            self.summaries.update_one(
+                {"session_id": session_id},
+                {"$set": {"summary": summary, "covered_until": turns[-1]["timestamp"]}},
+                upsert=True,
+            )
+            logger.info(f"Folded {len(turns)} turns into the summary of session {session_id}.")
+        except Exception as e:
+            logger.error(f"Failed to summarize history of session {session_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._folding.discard(session_id)
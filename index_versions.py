@@ -0,0 +1,166 @@
+import logging
+import os
+import shutil
+import uuid
+from fnmatch import fnmatch
+from datetime import datetime
+
+# An index directory (chroma/, or namespaces/<name>/) holds complete index
+# versions side by side, each in versions/<version>/, and a CURRENT file
+# naming the active one. Builds write a new version, are checked, and are
+# then activated by atomically replacing CURRENT, so readers only ever see
+# a finished index. Directories from before versioning (index files
+# directly in the index directory, without a CURRENT file) are still served
+# until the first versioned build, and removed by a later one.
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+# Written next to the index files by some pre-versioning builds; the
+# original code did not write it.
+LEGACY_VERSION_FILE = "index_version"
+# Versions kept after an activation, the active one included, so readers
+# in other processes can finish on the previous one.
+KEEP_INDEX_VERSIONS = max(int(os.getenv("KEEP_INDEX_VERSIONS", "2")), 1)
+# Index files that are never changed in place once written: BM25 segment
+# arrays (deleted.npy is replaced, not rewritten) and the NumPy store's
+# vector files, which are only appended to. Incremental versions hard-link
+# these instead of copying them; everything else (SQLite, Chroma's HNSW
+# files) is copied.
+LINKED_FILES = ("*.npy", "vectors.f32", "vectors.i8", "scales.f32")
+
+logger = logging.getLogger(__name__)
+
+
+def version_path(root, version):
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def new_version_id():
+    # Sorts by creation time.
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+
+def list_versions(root):
+    try:
+        return sorted(os.listdir(os.path.join(root, VERSIONS_DIR)))
+    except FileNotFoundError:
+        return []
+
+
+def read_current(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def legacy_files(root):
+    # The entries of root that belong to a pre-versioning index.
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return [name for name in names if name not in (VERSIONS_DIR, CURRENT_FILE) and not name.endswith(".tmp")]
+
+
+def legacy_version(root):
+    if not legacy_files(root):
+        return None
+    try:
+        with open(os.path.join(root, LEGACY_VERSION_FILE), "r") as f:
+            return f"legacy-{f.read().strip()}"
+    except FileNotFoundError:
+        return "legacy"
+
+
+def active_version(root):
+    # (version, directory) of the index to serve, or (None, None) if there
+    # is none yet.
+    version = read_current(root)
+    if version is not None:
+        return version, version_path(root, version)
+    version = legacy_version(root)
+    if version is not None:
+        return version, root
+    return None, None
+
+
+def link_or_copy(source, destination):
+    # copytree's copy_function: hard-links the files in LINKED_FILES, falling
+    # back to a copy where the file system cannot link.
+    if any(fnmatch(os.path.basename(source), pattern) for pattern in LINKED_FILES):
+        try:
+            os.link(source, destination)
+            return destination
+        except OSError:
+            pass
+    return shutil.copy2(source, destination)
+
+
+def create_version(root, copy_active=False):
+    # A new, not yet active version directory. With copy_active it starts as
+    # a copy of the active version, for incremental updates. Only the files
+    # changed in place are copied, so the cost is the SQLite metadata (and,
+    # for Chroma, the whole index) rather than the vectors and postings.
+    version = new_version_id()
+    path = version_path(root, version)
+    _, active_directory = active_version(root)
+    if copy_active and active_directory is not None:
+        # A legacy directory contains nothing but index files, apart from
+        # versions/ and CURRENT once they exist.
+        shutil.copytree(active_directory, path, copy_function=link_or_copy,
+                        ignore=shutil.ignore_patterns(VERSIONS_DIR, CURRENT_FILE, "*.tmp"))
+    else:
+        os.makedirs(path)
+    return version, path
+
+
+def activate(root, version):
+    # Atomic on POSIX and Windows: readers see either the old or the new
+    # version, never a partial pointer.
+    path = os.path.join(root, CURRENT_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    logger.info(f"Activated index version {version} in {root}.")
+
+
+def discard_version(root, version):
+    # Drops a build that failed or did not pass its checks.
+    shutil.rmtree(version_path(root, version), ignore_errors=True)
+
+
+def remove_legacy_files(root):
+    for name in legacy_files(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.unlink(path)
+
+
+def collect_garbage(root, in_use=(), keep=KEEP_INDEX_VERSIONS):
+    # Deletes versions older than the newest keep ones up to the active one,
+    # except those this process is still reading. Versions newer than the
+    # active one may be builds in progress and are left alone. A
+    # pre-versioning index counts as older than every version.
+    active = read_current(root)
+    if active is None:
+        return []
+    legacy = legacy_version(root)
+    older = [legacy] if legacy is not None else []
+    older += [version for version in list_versions(root) if version < active]
+    removed = []
+    for version in older[:max(len(older) - (keep - 1), 0)]:
+        if version in in_use:
+            continue
+        if version == legacy:
+            remove_legacy_files(root)
+        else:
+            shutil.rmtree(version_path(root, version), ignore_errors=True)
+        removed.append(version)
+    if removed:
+        logger.info(f"Removed {len(removed)} old index versions from {root}.")
+    return removed
@@ -0,0 +1,352 @@
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import fitz  # PyMuPDF
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pymongo.errors import BulkWriteError
+
+from metrics import stage, stage_metrics
+from storage import all_documents_collections, page_text_cache_collection, references_collection
+
+# Large PDFs are split into page ranges of this size so that one big upload
+# is parsed on several cores, not just one.
+PAGES_PER_TASK = 50
+INSERT_BATCH_SIZE = 500
+MAX_PARSE_WORKERS = os.cpu_count() or 1
+# Uploads are streamed to disk in chunks of this size; at most one chunk per
+# file is held in memory.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+# MAX_UPLOAD_BYTES is checked per file, after Starlette has spooled the
+# multipart body. Whole /upload/ request bodies are bounded by this as they
+# arrive, so an oversized upload is refused before it is spooled.
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(4 * MAX_UPLOAD_BYTES)))
+# Extracted text is kept by (file hash, page) for PAGE_TEXT_CACHE_TTL seconds
+# (see storage.py), so a file uploaded to another namespace, or again soon
+# after a failed upload, is not parsed again. Deleting a file drops its entries.
+EXTRACTION_CACHE = os.getenv("EXTRACTION_CACHE", "1") == "1"
+DUPLICATE_KEY_ERROR = 11000
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    # ASGI middleware that answers 413 to requests for paths whose body is
+    # larger than max_bytes: at once when Content-Length says so, otherwise
+    # as soon as that much of a chunked body has been received.
+    def __init__(self, app, paths=("/upload/",), max_bytes=MAX_UPLOAD_REQUEST_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Upload requests are limited to {self.max_bytes} bytes."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the form parsing of the endpoint, which
+                    # passes HTTPExceptions on unchanged.
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One long-lived parser pool per process. Workers are spawned rather than
+    # forked because the API process runs threads (and torch) that are not
+    # safe to fork.
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=MAX_PARSE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def save_upload(file, upload_folder, max_bytes=MAX_UPLOAD_BYTES):
+    # Streams an UploadFile into a temporary file in upload_folder, hashing
+    # it on the way. Returns (temp_path, sha256 hex digest); the caller moves
+    # the file into place with keep_upload() or drops it with discard_upload().
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"{file.filename} is larger than {max_bytes} bytes.")
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        discard_upload(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def keep_upload(temp_path, file_path):
+    os.replace(temp_path, file_path)
+
+
+def discard_upload(temp_path):
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_duplicate(collection, file_hash):
+    # Pages stored before page dedup have no references, only their metadata.
+    if references_collection(collection).find_one({"file_hash": file_hash}, {"_id": 1}) is not None:
+        return True
+    return collection.find_one({"metadata.file_hash": file_hash}, {"_id": 1}) is not None
+
+
+async def is_duplicate_async(collection, file_hash):
+    # Same as is_duplicate, for a Motor collection.
+    if await references_collection(collection).find_one({"file_hash": file_hash}, {"_id": 1}) is not None:
+        return True
+    return await collection.find_one({"metadata.file_hash": file_hash}, {"_id": 1}) is not None
+
+
+def page_document(text, filename, page_num, file_hash, uploaded_at):
+    # uploaded_at (epoch seconds) is stored with every page so questions can
+    # be limited to recent uploads.
+    return {
+        "page_content": text,
+        "content_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "metadata": {"source": filename, "page": page_num, "file_hash": file_hash, "uploaded_at": uploaded_at},
+    }
+
+
+def extract_pages(file_path, filename, file_hash, start, stop, uploaded_at):
+    # Runs in a worker process.
+    documents = []
+    with fitz.open(file_path) as pdf:
+        for page_num in range(start, stop):
+            page = pdf.load_page(page_num)
+            documents.append(page_document(page.get_text(), filename, page_num, file_hash, uploaded_at))
+    return documents
+
+
+def timed_extract_pages(*args):
+    # extract_pages plus the time it took in the worker, which the parent
+    # records; metrics kept in a worker process would never be served.
+    started = time.perf_counter()
+    documents = extract_pages(*args)
+    return documents, time.perf_counter() - started
+
+
+def page_ranges(file_path):
+    with fitz.open(file_path) as pdf:
+        page_count = len(pdf)
+    return [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+
+
+def insert_ignoring_duplicates(collection, documents):
+    # Inserts documents, skipping those whose key is already taken. Returns
+    # the indexes in documents of the skipped ones.
+    if not documents:
+        return set()
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+            raise
+        return {error["index"] for error in e.details["writeErrors"]}
+    return set()
+
+
+def cached_pages(cache, file_hash):
+    # {page number: text} of the pages of file_hash extracted before.
+    return {entry["page"]: entry["text"] for entry in cache.find({"file_hash": file_hash}, {"page": 1, "text": 1})}
+
+
+def cache_pages(cache, documents):
+    # cached_at is what the TTL index expires entries by.
+    cached_at = datetime.now(timezone.utc)
+    entries = [{"_id": f"{doc['metadata']['file_hash']}:{doc['metadata']['page']}",
+                "file_hash": doc["metadata"]["file_hash"], "page": doc["metadata"]["page"], "text": doc["page_content"],
+                "cached_at": cached_at}
+               for doc in documents]
+    # Pages another upload of the same file cached first are skipped.
+    insert_ignoring_duplicates(cache, entries)
+
+
+def page_reference(doc):
+    metadata = doc["metadata"]
+    return {"_id": f"{metadata['file_hash']}:{metadata['page']}", "file_hash": metadata["file_hash"],
+            "page": metadata["page"], "source": metadata["source"], "uploaded_at": metadata["uploaded_at"],
+            "content_hash": doc["content_hash"]}
+
+
+def store_pages(collection, batch):
+    # Each distinct page content is stored once, with the metadata of its
+    # first occurrence. Every (file, page) gets a row in the references
+    # collection naming its content, so repeated pages are not chunked and
+    # embedded again and still count for every file they occur in. Returns
+    # how many pages were new.
+    by_hash = {}
+    for doc in batch:
+        by_hash.setdefault(doc["content_hash"], doc)
+    if not by_hash:
+        return 0
+    with stage("ingest", "insert"):
+        # References go first: remove_file only deletes pages that no
+        # reference names any more.
+        insert_ignoring_duplicates(references_collection(collection), [page_reference(doc) for doc in batch])
+        existing = {doc["content_hash"] for doc in collection.find({"content_hash": {"$in": list(by_hash)}},
+                                                                  {"content_hash": 1})}
+        new = [doc for content_hash, doc in by_hash.items() if content_hash not in existing]
+        # Pages a concurrent upload inserted first are not new.
+        skipped = insert_ignoring_duplicates(collection, new)
+    return len(new) - len(skipped)
+
+
+def prune_page_text_cache(file_hashes):
+    # Drops the cached text of files no namespace stores any more. The cache
+    # is shared between namespaces, so a file removed from one keeps its
+    # entry while another still references it.
+    file_hashes = set(file_hashes)
+    for collection in all_documents_collections():
+        if not file_hashes:
+            break
+        file_hashes -= set(references_collection(collection).distinct(
+            "file_hash", {"file_hash": {"$in": list(file_hashes)}}))
+        file_hashes -= set(collection.distinct("metadata.file_hash", {
+            "metadata.file_hash": {"$in": list(file_hashes)}, "content_hash": {"$exists": False},
+        }))
+    if file_hashes:
+        page_text_cache_collection().delete_many({"file_hash": {"$in": list(file_hashes)}})
+
+
+def remove_file(collection, file_hash):
+    # Drops the references of one file. Pages no other file references are
+    # deleted; shared ones whose metadata named this file take that of a
+    # remaining reference. The file's extracted text is dropped from the
+    # cache too, unless another namespace stores the file. Returns
+    # (references dropped, pages deleted).
+    references = references_collection(collection)
+    content_hashes = {reference["content_hash"]
+                      for reference in references.find({"file_hash": file_hash}, {"content_hash": 1})}
+    released = references.delete_many({"file_hash": file_hash}).deleted_count
+    deleted = 0
+    for content_hash in content_hashes:
+        remaining = references.find_one({"content_hash": content_hash})
+        if remaining is None:
+            deleted += collection.delete_one({"content_hash": content_hash}).deleted_count
+            continue
+        collection.update_one({"content_hash": content_hash, "metadata.file_hash": file_hash}, {"$set": {
+            "metadata": {name: remaining[name] for name in ("source", "page", "file_hash", "uploaded_at")},
+        }})
+    legacy = collection.delete_many({"metadata.file_hash": file_hash, "content_hash": {"$exists": False}})
+    released += legacy.deleted_count
+    deleted += legacy.deleted_count
+    if released:
+        prune_page_text_cache([file_hash])
+    return released, deleted
+
+
+def clear_documents(collection):
+    # Deletes every page and reference of a namespace, and the cached text of
+    # its files that no other namespace stores.
+    references = references_collection(collection)
+    file_hashes = set(references.distinct("file_hash"))
+    file_hashes.update(collection.distinct("metadata.file_hash", {"content_hash": {"$exists": False}}))
+    references.delete_many({})
+    deleted = collection.delete_many({}).deleted_count
+    prune_page_text_cache(file_hashes)
+    return deleted
+
+
+def store_documents(collection, files):
+    # files is a list of (file_path, filename, file_hash). Page ranges found
+    # in the extraction cache are taken from it; the others are parsed in the
+    # process pool. Pages are stored in MongoDB in batches as soon as each
+    # range is done, deduplicated by content (see store_pages). Blocking:
+    # call it from a worker thread.
+    started = time.perf_counter()
+    uploaded_at = time.time()
+    cache = page_text_cache_collection() if EXTRACTION_CACHE else None
+    pool = get_pool()
+    futures = []
+    batches = []
+    cached = 0
+    for file_path, filename, file_hash in files:
+        texts = cached_pages(cache, file_hash) if cache is not None else {}
+        for start, stop in page_ranges(file_path):
+            if all(page_num in texts for page_num in range(start, stop)):
+                batches.append([page_document(texts[page_num], filename, page_num, file_hash, uploaded_at)
+                                for page_num in range(start, stop)])
+                cached += stop - start
+            else:
+                futures.append(pool.submit(timed_extract_pages, file_path, filename, file_hash, start, stop,
+                                           uploaded_at))
+
+    def parsed():
+        for future in as_completed(futures):
+            documents, parse_seconds = future.result()
+            stage_metrics.observe("ingest", "parse", parse_seconds)
+            if cache is not None:
+                cache_pages(cache, documents)
+            yield documents
+
+    pages = 0
+    unique = 0
+    batch = []
+    for documents in itertools.chain(batches, parsed()):
+        batch.extend(documents)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            unique += store_pages(collection, batch)
+            pages += len(batch)
+            batch = []
+    unique += store_pages(collection, batch)
+    pages += len(batch)
+
+    elapsed = time.perf_counter() - started
+    pages_per_second = pages / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Stored {pages} pages from {len(files)} documents in MongoDB "
+                f"in {elapsed:.2f}s ({pages_per_second:.1f} pages/sec): {unique} new, {pages - unique} already stored, "
+                f"{cached} taken from the extraction cache.")
+    return {"pages": pages, "new_pages": unique, "duplicate_pages": pages - unique, "cached_pages": cached,
+            "seconds": round(elapsed, 3), "pages_per_second": round(pages_per_second, 1)}
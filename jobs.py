@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from namespaces import DEFAULT_NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+# How many finished jobs to remember for /jobs/{id}.
+MAX_JOB_HISTORY = 50
+# Updates of different namespaces run side by side, up to this many at once.
+MAX_INDEX_JOBS = int(os.getenv("MAX_INDEX_JOBS", "2"))
+
+
+class IndexJob:
+    # Progress of one index update. The indexing code reports into it through
+    # set_phase(), advance() and add_total(); /jobs/{id} serializes it with to_dict().
+    def __init__(self, job_id, namespace=DEFAULT_NAMESPACE):
+        self.id = job_id
+        self.namespace = namespace
+        self.status = "queued"
+        self.phase = "queued"
+        self.pages = 0
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._embedding_started_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def set_phase(self, phase, **counts):
+        self.phase = phase
+        for name, value in counts.items():
+            setattr(self, name, value)
+        if phase == "embedding":
+            self._embedding_started_at = time.time()
+
+    def advance(self, chunks):
+        self.chunks_done += chunks
+
+    def add_total(self, chunks):
+        # Full rebuilds split and embed at the same time, so the total grows
+        # as chunks come out of the splitter.
+        self.chunks_total += chunks
+
+    @property
+    def chunks_per_second(self):
+        if self._embedding_started_at is None:
+            return None
+        elapsed = (self.finished_at or time.time()) - self._embedding_started_at
+        return round(self.chunks_done / elapsed, 1) if elapsed > 0 else None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "namespace": self.namespace,
+            "status": self.status,
+            "phase": self.phase,
+            "pages": self.pages,
+            "chunks_total": self.chunks_total,
+            "chunks_done": self.chunks_done,
+            "chunks_per_second": self.chunks_per_second,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    # Runs index updates on long-lived worker threads, so the embedding model
+    # stays loaded between updates and the event loop is never blocked. Each
+    # namespace has at most one update at a time: submit() returns the
+    # running job of the namespace instead of starting a second one. Jobs of
+    # different namespaces run concurrently on up to max_workers threads.
+    def __init__(self, max_workers=MAX_INDEX_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = {}  # namespace -> latest job
+
+    def submit(self, target, *args, namespace=DEFAULT_NAMESPACE, **kwargs):
+        # target is called as target(*args, progress=job, namespace=namespace, **kwargs).
+        with self._lock:
+            active = self._active.get(namespace)
+            if active is not None and not active.finished:
+                return active, False
+            job = IndexJob(uuid.uuid4().hex, namespace)
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+            self._active[namespace] = job
+        self._executor.submit(self._run, job, target, args, dict(kwargs, namespace=namespace))
+        return job, True
+
+    def _run(self, job, target, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            target(*args, progress=job, **kwargs)
+        except Exception as e:
+            logger.error(f"Index job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            status = "failed"
+        else:
+            job.phase = "done"
+            status = "succeeded"
+        job.finished_at = time.time()
+        job.status = status
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+
+index_jobs = JobManager()
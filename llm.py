@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "gemini" talks to the Gemini API; "fake" answers locally without network
+# access, for tests and benchmarks.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+FAKE_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiBackend:
+    def __init__(self, model_name=GEMINI_MODEL_NAME):
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        return response.candidates[0].content.parts[0].text
+
+    async def stream(self, prompt):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            # Chunks without parts (e.g. a trailing safety/finish chunk)
+            # carry no text.
+            if chunk.parts:
+                yield chunk.text
+
+
+class FakeBackend:
+    # Deterministic local stand-in for Gemini. The answer echoes the question
+    # and is streamed word by word, optionally with a per-token delay.
+    def __init__(self, token_delay=FAKE_TOKEN_DELAY):
+        self.token_delay = token_delay
+
+    def _answer(self, prompt):
+        question = prompt.rsplit("Question:", 1)[-1].split("Answer:", 1)[0].strip()
+        return f"This is a generated answer to: {question}"
+
+    def generate(self, prompt):
+        return self._answer(prompt)
+
+    async def stream(self, prompt):
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == len(words) - 1 else word + " "
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": FakeBackend,
+}
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                if LLM_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown LLM_BACKEND {LLM_BACKEND!r}, expected one of {sorted(BACKENDS)}.")
+                logger.info(f"Using {LLM_BACKEND} LLM backend.")
+                _llm = BACKENDS[LLM_BACKEND]()
+    return _llm
+
+
+def set_llm(backend):
+    # Swap the process-wide backend, e.g. for a FakeBackend in tests.
+    global _llm
+    _llm = backend
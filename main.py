@@ -1,67 +1,36 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 import os
-import fitz  # PyMuPDF
-from pymongo import MongoClient
 from dotenv import load_dotenv
-import subprocess
+from warmup import warm_up
+from ingest import UploadSizeLimit
+from routes import UPLOAD_FOLDER, documents_router, probes_router
+import storage
+from storage import ensure_indexes
 import logging
 
 load_dotenv()
 
 app = FastAPI()
-UPLOAD_FOLDER = 'uploads'
-
-MONGO_URI = os.environ['MONGO_URI']
-DATABASE_NAME = "document_db"
-COLLECTION_NAME = "documents"
-
-client = MongoClient(MONGO_URI)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
+# Refuses oversized upload bodies before they are spooled to disk.
+app.add_middleware(UploadSizeLimit)
+app.include_router(documents_router)
+app.include_router(probes_router)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def store_documents(file_path, filename):
-    with fitz.open(file_path) as pdf:
-        for page_num in range(len(pdf)):
-            page = pdf.load_page(page_num)
-            text = page.get_text()
-            document = {
-                "page_content": text,
-                "metadata": {"source": filename, "page": page_num}
-            }
-            collection.insert_one(document)
-    logger.info(f"Document {filename} stored in MongoDB.")
-
-@app.post("/upload/")
-async def upload_files(files: list[UploadFile] = File(...)):
-    for file in files:
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
-        
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(file.file.read())
-        
-        store_documents(file_path, file.filename)
-    return {"filenames": [file.filename for file in files]}
+@app.on_event("startup")
+def prepare_uploads():
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    ensure_indexes()
+    # Nothing to preload here; the model is loaded by the first update.
+    warm_up.start([])
 
-@app.post("/update-database/")
-async def update_database():
-    try:
-        logger.info("Starting database update...")
-        result = subprocess.run(["python3", "create_database.py"], capture_output=True, text=True)
-        logger.info(f"Subprocess result: {result}")
-        if result.returncode != 0:
-            logger.error(f"Error updating database: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"Error updating database: {result.stderr}")
-        return {"detail": "Database updated successfully."}
-    except Exception as e:
-        logger.error(f"Exception occurred: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.on_event("shutdown")
+def close_storage():
+    storage.close()
 
 @app.get("/")
 async def main():
@@ -0,0 +1,155 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# Latency of every stage of answering a question ("ask") and of indexing
+# ("ingest"), kept as Prometheus histograms in this process and served as
+# text by the /metrics endpoints. Observing a stage costs a lock and a
+# bisect, so the timers stay on in production.
+STAGE_METRIC = "rag_stage_duration_seconds"
+STAGE_ERRORS_METRIC = "rag_stage_errors_total"
+# Bucket upper bounds in seconds, from cache hits to full index builds.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# OTEL_TRACING=1 also opens an OpenTelemetry span per stage (requires the
+# opentelemetry-api package). Exporters are set up the usual OpenTelemetry
+# way, e.g. by running under opentelemetry-instrument.
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+TRACER_NAME = "rag"
+
+
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class StageMetrics:
+    # Histograms keyed by (pipeline, stage), plus a count of stages that
+    # raised. Safe to share across threads.
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, pipeline, stage, seconds):
+        key = (pipeline, stage)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def error(self, pipeline, stage):
+        key = (pipeline, stage)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+    def summary(self):
+        # {"pipeline.stage": {"count", "mean_ms"}}, for benchmark reports.
+        with self._lock:
+            return {
+                f"{pipeline}.{stage}": {"count": h.count, "mean_ms": round(h.sum / h.count * 1000, 3)}
+                for (pipeline, stage), h in sorted(self._histograms.items()) if h.count
+            }
+
+    def render(self):
+        # Prometheus text exposition format.
+        with self._lock:
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items())
+            errors = sorted(self._errors.items())
+        lines = [
+            f"# HELP {STAGE_METRIC} Time spent in each stage of answering questions and indexing documents.",
+            f"# TYPE {STAGE_METRIC} histogram",
+        ]
+        for (pipeline, stage), counts, total, count in histograms:
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{STAGE_METRIC}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{STAGE_METRIC}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{STAGE_METRIC}_sum{{{labels}}} {total}")
+            lines.append(f"{STAGE_METRIC}_count{{{labels}}} {count}")
+        lines.append(f"# HELP {STAGE_ERRORS_METRIC} Stages that raised an exception.")
+        lines.append(f"# TYPE {STAGE_ERRORS_METRIC} counter")
+        for (pipeline, stage), count in errors:
+            lines.append(f'{STAGE_ERRORS_METRIC}{{pipeline="{pipeline}",stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics()
+
+_tracer = None
+_tracer_loaded = False
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    global _tracer, _tracer_loaded
+    if not _tracer_loaded:
+        with _tracer_lock:
+            if not _tracer_loaded:
+                if OTEL_TRACING:
+                    try:
+                        from opentelemetry import trace
+
+                        _tracer = trace.get_tracer(TRACER_NAME)
+                    except ImportError:
+                        pass
+                _tracer_loaded = True
+    return _tracer
+
+
+class StageTimer:
+    # Yielded by stage(); seconds is set when the stage ends.
+    seconds = 0.0
+
+
+@contextlib.contextmanager
+def stage(pipeline, name):
+    # Times the block and records it under (pipeline, name), as an
+    # OpenTelemetry span too when tracing is on.
+    timer = StageTimer()
+    tracer = get_tracer()
+    span = tracer.start_as_current_span(f"{pipeline}.{name}") if tracer else contextlib.nullcontext()
+    with span:
+        started = time.perf_counter()
+        try:
+            yield timer
+        except Exception:
+            # Not BaseException: a client going away mid-stream is not an error.
+            stage_metrics.error(pipeline, name)
+            raise
+        finally:
+            timer.seconds = time.perf_counter() - started
+            stage_metrics.observe(pipeline, name, timer.seconds)
+
+
+def timed(iterable, pipeline, name):
+    # Yields the items of iterable, recording how long each took to produce.
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        stage_metrics.observe(pipeline, name, time.perf_counter() - started)
+        yield item
@@ -0,0 +1,27 @@
+import re
+
+# A namespace is one tenant's corpus: its own MongoDB collection, index
+# directory, upload folder and answer cache. The default namespace keeps the
+# original names (documents, chroma/, uploads/), so existing deployments
+# need no migration.
+DEFAULT_NAMESPACE = "default"
+# Namespaces end up in collection names and paths, so only a safe subset of
+# characters is allowed.
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class InvalidNamespaceError(ValueError):
+    pass
+
+
+def validate_namespace(namespace):
+    if not isinstance(namespace, str) or not NAMESPACE_PATTERN.match(namespace):
+        raise InvalidNamespaceError(f"Invalid namespace {namespace!r}: use 1 to 64 letters, digits, '-' or '_'.")
+    return namespace
+
+
+def namespaced_path(base, namespace, root):
+    # base for the default namespace, root/namespace for the others.
+    if validate_namespace(namespace) == DEFAULT_NAMESPACE:
+        return base
+    return f"{root}/{namespace}"
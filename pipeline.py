@@ -0,0 +1,92 @@
+import queue
+import threading
+
+# How many batches a stage may run ahead of the next one. Together with the
+# batch size this bounds how much of the corpus is in memory at once.
+QUEUE_DEPTH = 4
+
+_END = object()
+
+
+def prefetch(iterable, maxsize=QUEUE_DEPTH):
+    # Iterates iterable on a background thread, at most maxsize items ahead
+    # of the consumer. An exception in the producer is raised in the
+    # consumer. If the consumer stops early, the producer is stopped at its
+    # next item.
+    items = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                items.put(item)
+            items.put(_END)
+        except BaseException as e:
+            items.put(e)
+
+    thread = threading.Thread(target=produce, name="pipeline-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        # Unblock a producer waiting on a full queue.
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class BackgroundWriter:
+    # Calls write(item) for every put() item on a background thread, with at
+    # most maxsize items waiting. put() and close() raise the first exception
+    # raised by write; items put after it are dropped.
+    def __init__(self, write, maxsize=QUEUE_DEPTH):
+        self.write = write
+        self._items = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="pipeline-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._items.get()
+            if item is _END:
+                return
+            if self._error is None:
+                try:
+                    self.write(item)
+                except BaseException as e:
+                    self._error = e
+
+    def put(self, item):
+        if self._error is not None:
+            raise self._error
+        self._items.put(item)
+
+    def close(self):
+        self._items.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Let queued writes finish, but report the original error.
+            self._items.put(_END)
+            self._thread.join()
+        return False
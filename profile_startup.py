@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+
+# Startup profile of a server module: where the import time goes (from
+# python -X importtime, in a fresh interpreter) and, with --serve, how long a
+# real uvicorn process takes until /healthz and /readyz answer. Compare
+# FAST_START=0 and FAST_START=1 runs to see what lazy loading saves.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(stderr):
+    # [(module, self seconds, cumulative seconds, depth)] in import order.
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return modules
+
+
+def profile_imports(module, top):
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                               capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    modules = parse_importtime(completed.stderr)
+    # Self time summed per top-level package, e.g. all of torch.*.
+    packages = defaultdict(float)
+    for name, self_seconds, _cumulative, _depth in modules:
+        packages[name.split(".")[0]] += self_seconds
+    target = next((cumulative for name, _self, cumulative, _depth in modules if name == module), None)
+    return {
+        "module": module,
+        "interpreter_seconds": round(elapsed, 3),
+        "import_seconds": round(target, 3) if target is not None else None,
+        "modules_imported": len(modules),
+        "packages": [
+            {"package": name, "seconds": round(seconds, 3)}
+            for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+        "slowest": [
+            {"module": name, "self_seconds": round(self_seconds, 3), "cumulative_seconds": round(cumulative, 3)}
+            for name, self_seconds, cumulative, _depth in sorted(modules, key=lambda m: m[2], reverse=True)[:top]
+        ],
+    }
+
+
+def wait_for(url, process, timeout):
+    # Seconds until url answers 200, or None if it did not within timeout.
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {process.returncode}.")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def profile_serving(module, timeout):
+    from benchmark_e2e import free_port
+
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{module}:app", "--host", "127.0.0.1",
+                                "--port", str(port), "--log-level", "warning"], cwd=ROOT)
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/healthz", process, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/readyz", process, timeout)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=5) as response:
+            status = json.load(response)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        "fast_start": os.getenv("FAST_START", "0") == "1",
+        "seconds_to_live": round(live - started, 3) if live else None,
+        "seconds_to_ready": round(ready - started, 3) if ready else None,
+        "warm_up": status,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default="app", help="Server module to profile (app, api or main).")
+    parser.add_argument("--top", type=int, default=15, help="Packages and modules to list.")
+    parser.add_argument("--serve", action="store_true",
+                        help="Also start the server and time /healthz and /readyz (needs a reachable MongoDB).")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for the server.")
+    parser.add_argument("--output", type=str, default=None, help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    result = {"imports": profile_imports(args.module, args.top)}
+    imports = result["imports"]
+    print(f"import {args.module}: {imports['import_seconds']}s, {imports['modules_imported']} modules, "
+          f"interpreter exit after {imports['interpreter_seconds']}s")
+    print("Self time by package:")
+    for row in imports["packages"]:
+        print(f"  {row['package']:30s} {row['seconds']:8.3f}s")
+    print("Slowest imports (cumulative):")
+    for row in imports["slowest"]:
+        print(f"  {row['module']:50s} {row['cumulative_seconds']:8.3f}s")
+
+    if args.serve:
+        result["serving"] = profile_serving(args.module, args.timeout)
+        print(f"Serving: {result['serving']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
 import argparse
+import asyncio
+import logging
 from dotenv import load_dotenv
-import os
-from pymongo import MongoClient
 import time
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.prompts import ChatPromptTemplate
-import google.generativeai as genai
+from retrieval import get_engine, chunk_id
+from llm import get_llm
+from history import HistoryManager
+from answer_cache import get_answer_cache
+from rerank import RERANK, RERANK_CANDIDATES, get_reranker, select_chunks
+from storage import chat_history_collection, session_summaries_collection, async_chat_history_collection
+from tokens import count_tokens, fit_prompt
+from usage import record_usage, record_usage_async
+from metrics import stage
+from namespaces import DEFAULT_NAMESPACE
 
 load_dotenv()  # Load environment variables from .env file
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-model = genai.GenerativeModel('gemini-1.5-flash')
-CHROMA_PATH = "chroma"
+
+logger = logging.getLogger(__name__)
 
 PROMPT_TEMPLATE = """
 You are an AI assistant named John. You are friendly and helpful. Carry on a natural conversation and answer the user's questions based on the context and the conversation history.
@@ -22,54 +27,171 @@ You are an AI assistant named John. You are friendly and helpful. Carry on a nat
 Question: {question}
 Answer: 
 """
+_prompt_template = None
 
-# MongoDB setup
-MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client["chat_db"]
-collection = db["chat_history"]
+def get_prompt_template():
+    # langchain is imported on first use rather than when the server starts.
+    global _prompt_template
+    if _prompt_template is None:
+        from langchain.prompts import ChatPromptTemplate
+
+        _prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+    return _prompt_template
+
+def warm_up_steps(namespace=DEFAULT_NAMESPACE):
+    # Everything the first question would otherwise load, for warmup.WarmUp.
+    steps = [("retrieval", get_engine(namespace).warm_up)]
+    if RERANK:
+        steps.append(("reranker", get_reranker().warm_up))
+    steps.append(("prompt_template", get_prompt_template))
+    steps.append(("llm", get_llm))
+    return steps
+
+# MongoDB setup, shared client from storage.py. Collections are looked up on
+# every call, so a client reopened after storage.close() is picked up.
+history_manager = HistoryManager(chat_history_collection, session_summaries_collection,
+                                 summarize=lambda prompt: get_llm().generate(prompt))
+
+ERROR_MESSAGE = "An error occurred while processing the request. Please check your quota and try again later."
+
+def fetch_history(session_id):
+    # Recent turns within the history token budget, plus a summary of older ones.
+    with stage("ask", "history"):
+        return history_manager.get_context(session_id)
+
+def retrieve_context(query_text, filters=None, namespace=DEFAULT_NAMESPACE):
+    # Returns the retrieved chunk texts (best first), the ids of those chunks,
+    # the query embedding (these two key the answer cache) and the time spent
+    # in each stage in milliseconds. filters is an optional
+    # vector_store.SearchFilter. With RERANK=1, RERANK_CANDIDATES chunks are
+    # re-scored by the cross-encoder and only the ones close to the best
+    # score and within the context token budget are kept.
+    # Shared, already-loaded embedding model and the namespace's index.
+    engine = get_engine(namespace)
+    timings = {}
+    with stage("ask", "embed") as timer:
+        embedding = engine.embed_query(query_text)
+    timings["embed_ms"] = timer.seconds * 1000
+
+    with stage("ask", "search") as timer:
+        results = engine.search(query_text, embedding, k=RERANK_CANDIDATES if RERANK else 5, filters=filters)
+    timings["search_ms"] = timer.seconds * 1000
+
+    if RERANK and results:
+        with stage("ask", "rerank") as timer:
+            results = select_chunks(get_reranker().rerank(query_text, [doc for doc, _score in results]))
+        timings["rerank_ms"] = timer.seconds * 1000
+    logger.info("Retrieval: " + ", ".join(f"{name} {ms:.1f}" for name, ms in timings.items())
+                + f", {len(results)} chunks")
+
+    return [doc.page_content for doc, _score in results], [chunk_id(doc) for doc, _score in results], embedding, timings
+
+def build_prompt(query_text, conversation_history, retrieved_chunks):
+    # Returns the prompt and the number of tokens of history and context
+    # trimmed to keep it within PROMPT_TOKEN_BUDGET, see tokens.fit_prompt.
+    with stage("ask", "prompt_build"):
+        fixed_text = get_prompt_template().format(context="No previous conversation.\n\nAdditional context:\n",
+                                                  question=query_text)
+        conversation_history, retrieved_chunks, trimmed = fit_prompt(fixed_text, conversation_history,
+                                                                     retrieved_chunks)
+        if trimmed:
+            logger.info(f"Trimmed {trimmed} tokens of history and context to fit the prompt budget.")
 
-def get_response(query_text, session_id):
-    try:
-        # Prepare the DB.
-        embedding_model = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
-        db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_model)
-
-        # Retrieve conversation history
-        history = collection.find({"session_id": session_id}).sort("timestamp", 1)
-        conversation_history = "\n".join([f"User: {entry['query_text']}\nJohn: {entry['response_text']}" for entry in history])
-        print(conversation_history)
         # Append conversation history to context
         context_text = conversation_history if conversation_history else "No previous conversation."
+        if retrieved_chunks:
+            context_text += "\n\nAdditional context:\n" + "\n".join(retrieved_chunks)
+        return get_prompt_template().format(context=context_text, question=query_text), trimmed
+
+def chat_entry(session_id, query_text, response_text):
+    return {
+        "session_id": session_id,
+        "query_text": query_text,
+        "response_text": response_text,
+        "timestamp": time.time()
+    }
+
+def save_chat(session_id, query_text, response_text):
+    chat_history_collection().insert_one(chat_entry(session_id, query_text, response_text))
+
+async def save_chat_async(session_id, query_text, response_text):
+    await async_chat_history_collection().insert_one(chat_entry(session_id, query_text, response_text))
+
+def get_response(query_text, session_id, filters=None, namespace=DEFAULT_NAMESPACE):
+    try:
+        with stage("ask", "total"):
+            retrieved_chunks, chunk_ids, embedding, _timings = retrieve_context(query_text, filters, namespace)
+            index_version = get_engine(namespace).version
+            conversation_history = fetch_history(session_id)
+            # Cached answers are keyed by the question and its chunks only, so
+            # they are served and stored only for questions asked without
+            # conversation history, never across sessions.
+            answer_cache = None if conversation_history else get_answer_cache(namespace)
+            response_text = answer_cache.lookup(embedding, chunk_ids, index_version) if answer_cache else None
+            if response_text is None:
+                prompt, trimmed = build_prompt(query_text, conversation_history, retrieved_chunks)
+
+                # Generate the response
+                with stage("ask", "llm"):
+                    response_text = get_llm().generate(prompt)
+                if answer_cache:
+                    answer_cache.store(embedding, chunk_ids, index_version, response_text)
+                usage = (count_tokens(prompt), count_tokens(response_text), trimmed)
+                cached = False
+            else:
+                usage = (0, 0, 0)
+                cached = True
+
+            # Save chat and token usage to MongoDB
+            with stage("ask", "mongo_write"):
+                save_chat(session_id, query_text, response_text)
+                record_usage(session_id, *usage, cached=cached)
 
-        # Search the DB for relevant context
-        results = db.similarity_search_with_relevance_scores(query_text, k=5)
-        if len(results) > 0 and results[0][1] >= 0.2:
-            retrieved_context = "\n".join([doc.page_content for doc, _score in results])
-            context_text += f"\n\nAdditional context:\n{retrieved_context}"
-
-        # Format the prompt with context and question
-        prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-        prompt = prompt_template.format(context=context_text, question=query_text)
-
-        # Generate the response
-        response = model.generate_content(prompt)
-        response_text = response.candidates[0].content.parts[0].text
-        
-        # Save chat to MongoDB
-        chat_entry = {
-            "session_id": session_id,
-            "query_text": query_text,
-            "response_text": response_text,
-            "timestamp": time.time()
-        }
-        collection.insert_one(chat_entry)
-        
         return response_text
 
     except Exception as e:
-        print(f"Error occurred: {e}.")
-        raise Exception("An error occurred while processing the request. Please check your quota and try again later.")
+        logger.error(f"Error occurred: {e}.")
+        raise Exception(ERROR_MESSAGE)
+
+async def stream_response(query_text, session_id, filters=None, namespace=DEFAULT_NAMESPACE):
+    # Async generator of response text pieces. History and retrieval run
+    # concurrently in worker threads; the full answer is saved once the
+    # stream has finished.
+    try:
+        with stage("ask", "stream_total"):
+            conversation_history, (retrieved_chunks, chunk_ids, embedding, _timings) = await asyncio.gather(
+                asyncio.to_thread(fetch_history, session_id),
+                asyncio.to_thread(retrieve_context, query_text, filters, namespace),
+            )
+            index_version = get_engine(namespace).version
+            # As in get_response, only history-free questions use the cache.
+            answer_cache = None if conversation_history else get_answer_cache(namespace)
+            response_text = answer_cache.lookup(embedding, chunk_ids, index_version) if answer_cache else None
+            if response_text is not None:
+                yield response_text
+                usage = (0, 0, 0)
+                cached = True
+            else:
+                prompt, trimmed = build_prompt(query_text, conversation_history, retrieved_chunks)
+                parts = []
+                # Includes the time the client takes to read the stream.
+                with stage("ask", "llm_stream"):
+                    async for text in get_llm().stream(prompt):
+                        parts.append(text)
+                        yield text
+                response_text = "".join(parts)
+                if answer_cache:
+                    answer_cache.store(embedding, chunk_ids, index_version, response_text)
+                usage = (count_tokens(prompt), count_tokens(response_text), trimmed)
+                cached = False
+
+            with stage("ask", "mongo_write"):
+                await save_chat_async(session_id, query_text, response_text)
+                await record_usage_async(session_id, *usage, cached=cached)
+
+    except Exception as e:
+        logger.error(f"Error occurred: {e}.")
+        raise Exception(ERROR_MESSAGE)
 
 def main():
     parser = argparse.ArgumentParser()
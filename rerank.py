@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+from metrics import stage
+from tokens import count_tokens
+
+# Off by default: the cross-encoder adds a model load at startup and tens of
+# milliseconds per question on CPU.
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from retrieval and re-scored per question.
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+# Chunks scoring more than this many logits below the best one are dropped.
+RERANK_SCORE_GAP = float(os.getenv("RERANK_SCORE_GAP", "4.0"))
+# Upper bound on retrieved context in the prompt, in tokens.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+MAX_CONTEXT_CHUNKS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def select_chunks(scored, max_gap=RERANK_SCORE_GAP, token_budget=CONTEXT_TOKEN_BUDGET,
+                  max_chunks=MAX_CONTEXT_CHUNKS):
+    # scored is a list of (document, score) pairs, best first. Keeps chunks
+    # until one falls more than max_gap below the best score, the token
+    # budget is used up or max_chunks are kept. The best chunk is always kept.
+    selected = []
+    used = 0
+    for doc, score in scored:
+        if selected:
+            if len(selected) >= max_chunks or scored[0][1] - score > max_gap:
+                break
+            if used + count_tokens(doc.page_content) > token_budget:
+                break
+        selected.append((doc, score))
+        used += count_tokens(doc.page_content)
+    return selected
+
+
+class CrossEncoderReranker:
+    # Scores (question, chunk) pairs jointly with a small cross-encoder. All
+    # candidates of a question are scored in one batch.
+    def __init__(self, model_name=RERANK_MODEL_NAME):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info(f"Loading cross-encoder {self.model_name}.")
+                    with stage("ask", "rerank_model_load"):
+                        self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def rerank(self, query_text, documents):
+        # Returns (document, score) pairs sorted by cross-encoder score.
+        if not documents:
+            return []
+        scores = self.model.predict([(query_text, doc.page_content) for doc in documents],
+                                    batch_size=len(documents), show_progress_bar=False)
+        order = np.argsort(-np.asarray(scores), kind="stable")
+        return [(documents[i], float(scores[i])) for i in order]
+
+    def warm_up(self):
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    return _reranker
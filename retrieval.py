@@ -0,0 +1,415 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from embeddings import SentenceTransformerEmbeddings, QueryEmbeddingCache, QueryBatcher
+from embedding_server import EMBEDDING_SOCKET, RemoteEmbeddings
+from bm25 import BM25Index
+from vector_store import open_vector_store
+from metrics import stage
+from namespaces import DEFAULT_NAMESPACE, namespaced_path
+from index_versions import active_version, version_path
+
+CHROMA_PATH = "chroma"
+# Indexes of namespaces other than the default one, see namespaces.py.
+NAMESPACE_INDEX_DIR = "namespaces"
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# BM25 keyword index kept next to the Chroma files, see bm25.py.
+KEYWORD_INDEX_DIR = "bm25"
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+MIN_RELEVANCE = 0.2
+# Each retriever contributes this many candidates per requested result to
+# rank fusion.
+CANDIDATE_MULTIPLIER = 4
+RRF_K = 60
+# Indexes are opened on their first query and kept in an LRU of at most
+# MAX_OPEN_INDEXES, whose files add up to at most INDEX_MEMORY_MB; the least
+# recently used are closed to make room.
+MAX_OPEN_INDEXES = int(os.getenv("MAX_OPEN_INDEXES", "16"))
+INDEX_MEMORY_MB = int(os.getenv("INDEX_MEMORY_MB", "2048"))
+
+logger = logging.getLogger(__name__)
+
+
+def index_path(namespace=DEFAULT_NAMESPACE):
+    return namespaced_path(CHROMA_PATH, namespace, NAMESPACE_INDEX_DIR)
+
+
+def directory_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def chunk_id(doc):
+    # Chunks are stored under "<source>:<page>:<start_index>", see
+    # create_database.assign_page_keys.
+    page_key = doc.metadata.get("page_key", f"{doc.metadata.get('source')}:{doc.metadata.get('page')}")
+    return f"{page_key}:{doc.metadata.get('start_index', 0)}"
+
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    # ranked_lists are lists of keys, best first. Returns (key, score) pairs
+    # sorted by fused score.
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, key in enumerate(ranked):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class QueryEmbedder:
+    # The embedding model, loaded once per process (or reached through the
+    # embedding server when EMBEDDING_SOCKET is set, see embedding_server.py),
+    # with the query embedding cache and batcher in front of it. Shared by
+    # the engines of all namespaces.
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._model = None
+        self.query_cache = QueryEmbeddingCache()
+        self._batcher = QueryBatcher(lambda texts: self.model.encode(texts))
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    with stage("ask", "model_load"):
+                        if EMBEDDING_SOCKET:
+                            logger.info(f"Using the embedding server at {EMBEDDING_SOCKET}.")
+                            self._model = RemoteEmbeddings(EMBEDDING_SOCKET)
+                        else:
+                            logger.info(f"Loading embedding model {self.model_name}.")
+                            self._model = SentenceTransformerEmbeddings(self.model_name)
+        return self._model
+
+    def embed_query(self, query_text):
+        # Repeated queries come from the cache; the rest are encoded together
+        # with whatever other queries arrive within a few milliseconds.
+        vector = self.query_cache.get(query_text)
+        if vector is None:
+            vector = self._batcher.embed(query_text)
+            self.query_cache.put(query_text, vector)
+        return vector.tolist()
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = QueryEmbedder()
+    return _embedder
+
+
+class IndexHandle:
+    # One opened index version. Searches hold a reader reference while they
+    # run; once a newer version replaces it, the handle is closed when its
+    # last reader is done. store is None when there is no index yet.
+    def __init__(self, version, directory, store, keyword_index):
+        self.version = version
+        self.directory = directory
+        self.store = store
+        self.keyword_index = keyword_index
+        self.readers = 0
+        self.retired = False
+        self.memory_bytes = directory_size(directory) if directory else 0
+
+
+class RetrievalEngine:
+    # The vector store and BM25 index of one namespace, served from the
+    # active version of its index directory (see index_versions.py). The
+    # index is opened on first use and the active version is checked on
+    # every query; a newly activated version is opened while queries keep
+    # running on the previous one, which is closed once they are done.
+    # on_open(engine) is called after every (re)open, see EngineCache. Safe
+    # to share across worker threads.
+    def __init__(self, persist_directory=CHROMA_PATH, embedder=None, on_open=None):
+        self.persist_directory = persist_directory
+        self.embedder = embedder or get_embedder()
+        self.on_open = on_open
+        self._lock = threading.Lock()
+        # Held while a version is opened, so only one thread opens it.
+        self._open_lock = threading.Lock()
+        self._handle = None
+        self._handles = set()  # every handle not yet closed
+        self._prepared = {}  # version -> handle opened by prepare()
+        self.memory_bytes = 0
+
+    @property
+    def embedding_model(self):
+        return self.embedder.model
+
+    @property
+    def query_cache(self):
+        return self.embedder.query_cache
+
+    @property
+    def is_open(self):
+        return self._handle is not None
+
+    @property
+    def version(self):
+        handle = self._handle
+        return handle.version if handle is not None else None
+
+    def _open(self, version, directory):
+        store = open_vector_store(directory, self.embedding_model) if directory is not None else None
+        keyword_index = self._load_keyword_index(directory) if directory is not None else None
+        handle = IndexHandle(version, directory, store, keyword_index)
+        with self._lock:
+            self._handles.add(handle)
+        return handle
+
+    def _close(self, handle):
+        # Called with self._lock held.
+        if handle.store is not None:
+            handle.store.close()
+        self._handles.discard(handle)
+
+    def _retire(self, handle):
+        # Called with self._lock held.
+        handle.retired = True
+        if handle.readers == 0:
+            self._close(handle)
+
+    def acquire(self):
+        # The handle of the active version, with a reader reference that
+        # must be given back with release(); see reading().
+        version, directory = active_version(self.persist_directory)
+        with self._lock:
+            handle = self._handle
+            if handle is not None and handle.version == version:
+                handle.readers += 1
+                return handle
+        if not self._open_lock.acquire(blocking=handle is None):
+            # Another thread is opening the new version; serve this query
+            # from the current one meanwhile.
+            with self._lock:
+                if self._handle is not None:
+                    self._handle.readers += 1
+                    return self._handle
+            self._open_lock.acquire()
+        try:
+            with self._lock:
+                handle = self._handle
+                if handle is not None and handle.version == version:
+                    handle.readers += 1
+                    return handle
+                handle = self._prepared.pop(version, None)
+            if handle is None:
+                with stage("ask", "index_open"):
+                    handle = self._open(version, directory)
+            with self._lock:
+                previous = self._handle
+                if previous is not None:
+                    self._retire(previous)
+                    logger.info(f"Index version changed ({previous.version} -> {version}), switched to the new index.")
+                self._handle = handle
+                self.memory_bytes = handle.memory_bytes
+                handle.readers += 1
+        finally:
+            self._open_lock.release()
+        if self.on_open:
+            self.on_open(self)
+        return handle
+
+    def release(self, handle):
+        with self._lock:
+            handle.readers -= 1
+            if handle.retired and handle.readers == 0:
+                self._close(handle)
+
+    @contextmanager
+    def reading(self):
+        handle = self.acquire()
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def get_store(self):
+        # The store of the active version, for callers that do not need it
+        # to stay open (it is only closed once replaced and unused).
+        with self.reading() as handle:
+            return handle.store
+
+    def prepare(self, version):
+        # Opens a version before it is activated, so the first queries after
+        # activation do not pay for opening it. Returns the prepared store.
+        handle = self._open(version, version_path(self.persist_directory, version))
+        with self._lock:
+            stale = self._prepared.pop(version, None)
+            if stale is not None:
+                self._close(stale)
+            self._prepared[version] = handle
+        return handle.store
+
+    def refresh(self):
+        # Switches to the active version now rather than on the next query.
+        self.release(self.acquire())
+
+    def discard(self, version):
+        # Drops a prepared version that will not be activated.
+        with self._lock:
+            handle = self._prepared.pop(version, None)
+            if handle is not None:
+                self._close(handle)
+
+    def open_versions(self):
+        # Versions this process still has open, which must not be deleted.
+        with self._lock:
+            return {handle.version for handle in self._handles}
+
+    def _load_keyword_index(self, directory):
+        directory = os.path.join(directory, KEYWORD_INDEX_DIR)
+        if not HYBRID_SEARCH or not BM25Index.exists(directory):
+            return None
+        try:
+            keyword_index = BM25Index.load(directory)
+            logger.info(f"Loaded BM25 index with {len(keyword_index)} chunks.")
+            return keyword_index
+        except Exception as e:
+            logger.warning(f"Failed to load BM25 index, using vector search only: {e}")
+            return None
+
+    def reload(self):
+        # Closes the index; queries still running finish on it first.
+        with self._lock:
+            if self._handle is not None:
+                self._retire(self._handle)
+            self._handle = None
+            for handle in self._prepared.values():
+                self._close(handle)
+            self._prepared.clear()
+            self.memory_bytes = 0
+
+    def warm_up(self):
+        logger.info("Warming up retrieval engine...")
+        self.embedding_model.embed_query("warm up")
+        self.get_store()
+        logger.info("Retrieval engine ready.")
+
+    def embed_query(self, query_text):
+        return self.embedder.embed_query(query_text)
+
+    def search_by_vector(self, embedding, k=5, filters=None):
+        # Same (document, relevance score) pairs as
+        # similarity_search_with_relevance_scores, for an embedding the
+        # caller already has.
+        with self.reading() as handle:
+            if handle.store is None:
+                return []
+            return handle.store.search_by_vector(embedding, k=k, filters=filters)
+
+    def search(self, query_text, embedding, k=5, min_relevance=MIN_RELEVANCE, filters=None):
+        # Hybrid retrieval: vector and BM25 candidates fused with reciprocal
+        # rank fusion. Vector candidates only count when the best of them
+        # reaches min_relevance. Returns (document, fused score) pairs.
+        # filters (a vector_store.SearchFilter) restricts both retrievers to
+        # the matching chunks. The whole search runs on one index version.
+        with self.reading() as handle:
+            if handle.store is None:
+                return []
+            return self._search(handle, query_text, embedding, k, min_relevance, filters)
+
+    def _search(self, handle, query_text, embedding, k, min_relevance, filters):
+        store = handle.store
+        keyword_index = handle.keyword_index
+        if keyword_index is None:
+            with stage("ask", "vector_search"):
+                results = store.search_by_vector(embedding, k=k, filters=filters)
+            return results if results and results[0][1] >= min_relevance else []
+
+        depth = k * CANDIDATE_MULTIPLIER
+        with stage("ask", "vector_search"):
+            vector_results = store.search_by_vector(embedding, k=depth, filters=filters)
+        if not vector_results or vector_results[0][1] < min_relevance:
+            vector_results = []
+        documents = {chunk_id(doc): doc for doc, _score in vector_results}
+        with stage("ask", "keyword_search"):
+            keys = store.filter_ids(filters) if filters else None
+            keyword_results = keyword_index.search(query_text, k=depth, keys=keys)
+        fused = reciprocal_rank_fusion([
+            [chunk_id(doc) for doc, _score in vector_results],
+            [key for key, _score in keyword_results],
+        ])[:k]
+
+        missing = [key for key, _score in fused if key not in documents]
+        if missing:
+            documents.update(store.get_documents(missing))
+        return [(documents[key], score) for key, score in fused if key in documents]
+
+    def similarity_search_with_relevance_scores(self, query_text, k=5):
+        return self.search_by_vector(self.embed_query(query_text), k=k)
+
+
+class EngineCache:
+    # One RetrievalEngine per namespace, created on first use. Engines stay
+    # in the cache, but only the most recently used keep their index open:
+    # when an index is opened and the open ones exceed max_open or
+    # max_bytes, the least recently used are closed. A closed engine reopens
+    # its index on its next query.
+    def __init__(self, max_open=MAX_OPEN_INDEXES, max_bytes=INDEX_MEMORY_MB * 1024 * 1024):
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._engines = OrderedDict()  # namespace -> engine, least recently used first
+        self.evictions = 0
+
+    def get(self, namespace=DEFAULT_NAMESPACE):
+        with self._lock:
+            engine = self._engines.get(namespace)
+            if engine is None:
+                engine = RetrievalEngine(index_path(namespace), on_open=self._evict)
+                self._engines[namespace] = engine
+            self._engines.move_to_end(namespace)
+        return engine
+
+    def _evict(self, opened):
+        with self._lock:
+            open_engines = [(namespace, engine) for namespace, engine in self._engines.items() if engine.is_open]
+            used = sum(engine.memory_bytes for _namespace, engine in open_engines)
+            victims = []
+            for namespace, engine in open_engines:
+                if len(open_engines) - len(victims) <= max(self.max_open, 1) and used <= self.max_bytes:
+                    break
+                if engine is opened:
+                    continue
+                victims.append((namespace, engine))
+                used -= engine.memory_bytes
+        for namespace, engine in victims:
+            logger.info(f"Closing the index of namespace {namespace} to stay within the open index limits.")
+            engine.reload()
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            open_engines = [engine for engine in self._engines.values() if engine.is_open]
+            return {
+                "namespaces": len(self._engines),
+                "open": len(open_engines),
+                "open_mb": round(sum(engine.memory_bytes for engine in open_engines) / (1024 * 1024), 1),
+                "max_open": self.max_open,
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "evictions": self.evictions,
+            }
+
+
+engines = EngineCache()
+
+
+def get_engine(namespace=DEFAULT_NAMESPACE):
+    return engines.get(namespace)
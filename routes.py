@@ -0,0 +1,136 @@
+import logging
+import os
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+
+from ingest import (store_documents, save_upload, keep_upload, discard_upload, is_duplicate_async,
+                    remove_file, UploadTooLargeError)
+from jobs import index_jobs
+from metrics import stage_metrics, CONTENT_TYPE
+from namespaces import DEFAULT_NAMESPACE, InvalidNamespaceError, namespaced_path, validate_namespace
+from storage import documents_collection, async_documents_collection
+from warmup import warm_up
+
+# Endpoints shared by the servers: documents_router (uploads, deletes, index
+# updates and their jobs) is included by app.py and main.py, probes_router
+# (/metrics, /healthz, /readyz) by every server.
+UPLOAD_FOLDER = 'uploads'
+
+logger = logging.getLogger(__name__)
+
+documents_router = APIRouter()
+probes_router = APIRouter()
+
+
+def checked_namespace(namespace):
+    try:
+        return validate_namespace(namespace)
+    except InvalidNamespaceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def upload_folder(namespace):
+    return namespaced_path(UPLOAD_FOLDER, namespace, f"{UPLOAD_FOLDER}/namespaces")
+
+
+@documents_router.post("/upload/")
+async def upload_files(files: list[UploadFile] = File(...), namespace: str = DEFAULT_NAMESPACE):
+    namespace = checked_namespace(namespace)
+    # The whole batch is refused before anything is saved.
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
+    folder = upload_folder(namespace)
+    os.makedirs(folder, exist_ok=True)
+    saved = []
+    duplicates = []
+    hashes = set()
+    try:
+        for file in files:
+            # Stream to disk in bounded chunks, hashing as we go, so the same
+            # PDF is never parsed or stored twice.
+            try:
+                temp_path, file_hash = await save_upload(file, folder)
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            if file_hash in hashes or await is_duplicate_async(async_documents_collection(namespace), file_hash):
+                discard_upload(temp_path)
+                duplicates.append(file.filename)
+                logger.info(f"Skipping {file.filename}, it has already been uploaded.")
+                continue
+            hashes.add(file_hash)
+            file_path = os.path.join(folder, file.filename)
+            keep_upload(temp_path, file_path)
+            saved.append((file_path, file.filename, file_hash))
+    except BaseException:
+        # Files of a rejected batch are not stored, so none of them is kept.
+        for file_path, _filename, _file_hash in saved:
+            discard_upload(file_path)
+        raise
+
+    # Parse all files in the process pool and bulk-insert their pages,
+    # without blocking the event loop. The first use of a namespace creates
+    # its indexes, so the collection is looked up in the thread pool too.
+    collection = await run_in_threadpool(documents_collection, namespace)
+    stats = await run_in_threadpool(store_documents, collection, saved)
+    return {"filenames": [file.filename for file in files], "duplicates": duplicates,
+            "file_hashes": {filename: file_hash for _path, filename, file_hash in saved}, **stats}
+
+
+@documents_router.delete("/documents/{file_hash}")
+async def delete_document(file_hash: str, namespace: str = DEFAULT_NAMESPACE):
+    # Removes an uploaded file by the hash /upload/ reported for it. Pages it
+    # shares with other files stay; the index changes on the next update.
+    namespace = checked_namespace(namespace)
+    collection = await run_in_threadpool(documents_collection, namespace)
+    released, deleted = await run_in_threadpool(remove_file, collection, file_hash)
+    if not released:
+        raise HTTPException(status_code=404, detail=f"No document with hash {file_hash}.")
+    return {"references_removed": released, "pages_deleted": deleted}
+
+
+@documents_router.post("/update-database/")
+async def update_database(full: bool = False, namespace: str = DEFAULT_NAMESPACE):
+    # Imported here so that servers without document endpoints (api.py) do
+    # not load the indexing code.
+    from create_database import generate_data_store
+
+    # The update runs on the index job worker; poll /jobs/{job_id} for progress.
+    # Updates of different namespaces run side by side.
+    namespace = checked_namespace(namespace)
+    job, started = index_jobs.submit(generate_data_store, full=full, namespace=namespace)
+    if not started:
+        return JSONResponse(status_code=409, content={
+            "detail": f"A database update of namespace {namespace} is already running.",
+            "job_id": job.id,
+        })
+    logger.info(f"Started database update job {job.id} for namespace {namespace}.")
+    return JSONResponse(status_code=202, content={"detail": "Database update started.", "job_id": job.id})
+
+
+@documents_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+
+
+@probes_router.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint with the per-stage latency histograms.
+    return Response(content=stage_metrics.render(), media_type=CONTENT_TYPE)
+
+
+@probes_router.get("/healthz")
+async def healthz():
+    # Liveness: answers as soon as the server is up, even while warming up.
+    return {"status": "ok"}
+
+
+@probes_router.get("/readyz")
+async def readyz():
+    # Readiness: 503 until warm-up has finished, see warmup.py.
+    return JSONResponse(status_code=200 if warm_up.ready else 503, content=warm_up.status())
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import threading
+
+from pymongo import MongoClient
+
+from namespaces import DEFAULT_NAMESPACE, validate_namespace
+
+# One pooled client per process for every module that talks to MongoDB.
+# MONGO_URI is read when the client is first needed, after the entry point
+# has loaded .env. MONGO_URI=mongomock:// uses an in-memory stand-in (the
+# mongomock package) instead of a server, for local runs and tests.
+DEFAULT_MONGO_URI = "mongodb://localhost:27017"
+MOCK_URI_SCHEME = "mongomock://"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+DOCUMENT_DB = "document_db"
+DOCUMENTS_COLLECTION = "documents"
+CHAT_DB = "chat_db"
+CHAT_HISTORY_COLLECTION = "chat_history"
+SESSION_SUMMARIES_COLLECTION = "session_summaries"
+TOKEN_USAGE_COLLECTION = "token_usage"
+# Which page content every (file, page) of a namespace has, in the
+# "<documents collection>.refs" subcollection, see ingest.py.
+REFERENCES_SUBCOLLECTION = "refs"
+# Text extracted from PDF pages by (file hash, page), shared by all
+# namespaces, see ingest.py. Entries expire this many seconds after they were
+# cached; the TTL of an existing index is changed with collMod, not here.
+PAGE_TEXT_CACHE_COLLECTION = "page_text_cache"
+PAGE_TEXT_CACHE_TTL = int(os.getenv("PAGE_TEXT_CACHE_TTL", str(7 * 24 * 3600)))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_async_client = None
+# Reentrant: get_async_client() builds the sync client under it in mock mode.
+_lock = threading.RLock()
+_indexed_namespaces = set()
+
+
+def mongo_uri():
+    return os.getenv("MONGO_URI", DEFAULT_MONGO_URI)
+
+
+def is_mock():
+    return mongo_uri().startswith(MOCK_URI_SCHEME)
+
+
+def client_options():
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_MS,
+        "retryWrites": True,
+    }
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                if is_mock():
+                    import mongomock
+
+                    logger.info("Using the in-memory mongomock client.")
+                    _client = mongomock.MongoClient()
+                else:
+                    _client = MongoClient(mongo_uri(), **client_options())
+    return _client
+
+
+def get_async_client():
+    # Motor for async handlers. With mongomock the async client wraps the
+    # same in-memory client, so both see the same data.
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                if is_mock():
+                    _async_client = ThreadedAsyncClient(get_client())
+                else:
+                    from motor.motor_asyncio import AsyncIOMotorClient
+
+                    _async_client = AsyncIOMotorClient(mongo_uri(), **client_options())
+    return _async_client
+
+
+def documents_collection_name(namespace=DEFAULT_NAMESPACE):
+    # documents for the default namespace, documents_<namespace> for the others.
+    if validate_namespace(namespace) == DEFAULT_NAMESPACE:
+        return DOCUMENTS_COLLECTION
+    return f"{DOCUMENTS_COLLECTION}_{namespace}"
+
+
+def documents_collection(namespace=DEFAULT_NAMESPACE):
+    collection = get_client()[DOCUMENT_DB][documents_collection_name(namespace)]
+    if namespace != DEFAULT_NAMESPACE and namespace not in _indexed_namespaces:
+        # The default namespace is indexed by ensure_indexes() at startup.
+        # Others come and go at runtime, so theirs are created on first use.
+        ensure_document_indexes(collection)
+        _indexed_namespaces.add(namespace)
+    return collection
+
+
+def all_documents_collections():
+    # The documents collection of every namespace that has stored anything.
+    database = get_client()[DOCUMENT_DB]
+    return [database[name] for name in sorted(database.list_collection_names())
+            if name == DOCUMENTS_COLLECTION or (name.startswith(f"{DOCUMENTS_COLLECTION}_") and "." not in name)]
+
+
+def references_collection(collection):
+    # For a documents collection, pymongo or Motor.
+    return collection[REFERENCES_SUBCOLLECTION]
+
+
+def page_text_cache_collection():
+    return get_client()[DOCUMENT_DB][PAGE_TEXT_CACHE_COLLECTION]
+
+
+def chat_history_collection():
+    return get_client()[CHAT_DB][CHAT_HISTORY_COLLECTION]
+
+
+def session_summaries_collection():
+    return get_client()[CHAT_DB][SESSION_SUMMARIES_COLLECTION]
+
+
+def token_usage_collection():
+    return get_client()[CHAT_DB][TOKEN_USAGE_COLLECTION]
+
+
+def async_documents_collection(namespace=DEFAULT_NAMESPACE):
+    return get_async_client()[DOCUMENT_DB][documents_collection_name(namespace)]
+
+
+def async_chat_history_collection():
+    return get_async_client()[CHAT_DB][CHAT_HISTORY_COLLECTION]
+
+
+def async_token_usage_collection():
+    return get_async_client()[CHAT_DB][TOKEN_USAGE_COLLECTION]
+
+
+def ensure_document_indexes(collection):
+    collection.create_index("metadata.file_hash")
+    collection.create_index("metadata.source")
+    # Pages stored before page dedup have no content_hash.
+    collection.create_index("content_hash", unique=True, partialFilterExpression={"content_hash": {"$exists": True}})
+    references = references_collection(collection)
+    references.create_index("file_hash")
+    references.create_index("content_hash")
+
+
+def ensure_indexes():
+    # Called once at startup; creating an index that exists is a no-op.
+    ensure_document_indexes(documents_collection())
+    page_text_cache_collection().create_index("file_hash")
+    page_text_cache_collection().create_index("cached_at", expireAfterSeconds=PAGE_TEXT_CACHE_TTL)
+    chat_history_collection().create_index([("session_id", 1), ("timestamp", -1)])
+    session_summaries_collection().create_index("session_id", unique=True)
+    token_usage_collection().create_index("session_id")
+    token_usage_collection().create_index("day")
+    logger.info("MongoDB indexes are in place.")
+
+
+def close():
+    global _client, _async_client
+    with _lock:
+        if _async_client is not None and not isinstance(_async_client, ThreadedAsyncClient):
+            _async_client.close()
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_client = None
+        _indexed_namespaces.clear()
+
+
+class ThreadedAsyncCollection:
+    # The subset of Motor's collection API used here, running the calls of
+    # a synchronous collection in worker threads.
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return ThreadedAsyncCollection(self.collection[name])
+
+    async def find_one(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.find_one, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.update_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.delete_many, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await asyncio.to_thread(self.collection.count_documents, *args, **kwargs)
+
+
+class ThreadedAsyncClient:
+    def __init__(self, client):
+        self.client = client
+
+    def __getitem__(self, db_name):
+        return ThreadedAsyncDatabase(self.client[db_name])
+
+
+class ThreadedAsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, collection_name):
+        return ThreadedAsyncCollection(self.database[collection_name])
@@ -0,0 +1,98 @@
+import os
+import sys
+
+# Tests run against the in-memory MongoDB stand-in and the local LLM
+# backend, so they need neither a server nor an API key. Set before the
+# modules under test read them.
+os.environ["MONGO_URI"] = "mongomock://"
+os.environ["LLM_BACKEND"] = "fake"
+# Indexes built by the tests use the NumPy vector store.
+os.environ["VECTOR_BACKEND"] = "numpy"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re  # noqa: E402
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+import retrieval  # noqa: E402
+import storage  # noqa: E402
+from bm25 import BM25Index  # noqa: E402
+from embeddings import QueryEmbeddingCache  # noqa: E402
+from index_versions import activate, create_version  # noqa: E402
+from retrieval import KEYWORD_INDEX_DIR, EngineCache  # noqa: E402
+from vector_store import open_vector_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_mongo():
+    # Every test starts with an empty in-memory database.
+    storage.close()
+    yield
+    storage.close()
+
+
+class FakeEmbedder:
+    # Bag-of-words vectors over hashed words, in place of the embedding
+    # model: texts sharing words are similar. Has the interface of
+    # retrieval.QueryEmbedder and of the model behind it.
+    dimension = 64
+
+    def __init__(self):
+        self.query_cache = QueryEmbeddingCache()
+        self.calls = 0
+        self.texts = 0
+
+    @property
+    def model(self):
+        return self
+
+    def encode(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, sum(word.encode("utf-8")) % self.dimension] += 1
+        return vectors
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+@pytest.fixture
+def embedder():
+    return FakeEmbedder()
+
+
+@pytest.fixture
+def build_index(embedder):
+    # Writes a version of the index directory root holding chunks, a dict of
+    # chunk id -> (text, metadata), and activates it unless told not to.
+    # Returns the version.
+    def build(root, chunks, activate_it=True):
+        version, path = create_version(str(root))
+        store = open_vector_store(path, embedder)
+        ids = list(chunks)
+        texts = [text for text, _metadata in chunks.values()]
+        store.add_embeddings(ids, embedder.encode(texts), texts, [metadata for _text, metadata in chunks.values()])
+        keyword_index = BM25Index()
+        keyword_index.add(ids, texts)
+        keyword_index.save(os.path.join(path, KEYWORD_INDEX_DIR))
+        if activate_it:
+            activate(str(root), version)
+        return version
+
+    return build
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch, embedder):
+    # A fresh engine cache sharing the stand-in embedder, with index
+    # directories under tmp_path. Returns the cache.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(retrieval, "_embedder", embedder)
+    cache = EngineCache()
+    monkeypatch.setattr(retrieval, "engines", cache)
+    return cache
@@ -0,0 +1,42 @@
+import time
+
+from answer_cache import SemanticCache
+
+
+def test_hit_needs_same_chunks_and_similar_query():
+    cache = SemanticCache(threshold=0.95, ttl=60, max_entries=10)
+    cache.store([1.0, 0.0], ["c2", "c1"], "v1", "answer")
+    assert cache.lookup([2.0, 0.01], ["c1", "c2"], "v1") == "answer"
+    assert cache.lookup([1.0, 0.0], ["c1"], "v1") is None
+    assert cache.lookup([0.0, 1.0], ["c1", "c2"], "v1") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+
+def test_new_index_version_drops_entries():
+    cache = SemanticCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.store([1.0, 0.0], ["c1"], "v1", "answer")
+    assert cache.lookup([1.0, 0.0], ["c1"], "v2") is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.lookup([1.0, 0.0], ["c1"], "v1") is None
+
+
+def test_entries_expire_and_are_evicted():
+    cache = SemanticCache(threshold=0.9, ttl=0.05, max_entries=2)
+    cache.store([1.0, 0.0], ["c1"], "v1", "first")
+    time.sleep(0.1)
+    assert cache.lookup([1.0, 0.0], ["c1"], "v1") is None
+
+    cache.ttl = 60
+    for chunk in ("c1", "c2", "c3"):
+        cache.store([1.0, 0.0], [chunk], "v1", chunk)
+    assert cache.lookup([1.0, 0.0], ["c1"], "v1") is None
+    assert cache.lookup([1.0, 0.0], ["c3"], "v1") == "c3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SemanticCache(max_entries=0)
+    cache.store([1.0], ["c1"], "v1", "answer")
+    assert cache.lookup([1.0], ["c1"], "v1") is None
+    assert cache.stats()["entries"] == 0
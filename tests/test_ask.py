@@ -0,0 +1,70 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import query_data
+from answer_cache import get_answer_cache
+from llm import FakeBackend, set_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # app.py mounts static/ relative to the working directory.
+    monkeypatch.chdir(ROOT)
+    import app
+
+    def retrieve_context(query_text, filters=None, namespace="default"):
+        return ["The pump must be serviced every 6 months."], ["manual.pdf:0:0"], [1.0, 0.0], {}
+
+    monkeypatch.setattr(query_data, "retrieve_context", retrieve_context)
+    monkeypatch.setattr(query_data, "get_engine", lambda namespace="default": SimpleNamespace(version="v1"))
+    set_llm(FakeBackend())
+    get_answer_cache().invalidate()
+    return TestClient(app.app)
+
+
+def events(response):
+    # (event, data) pairs of a text/event-stream body.
+    parsed = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        parsed.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return parsed
+
+
+def test_stream_sends_text_then_done(client):
+    response = client.post("/ask/stream", json={"query_text": "How often?", "session_id": "s1"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    parsed = events(response)
+    assert parsed[-1] == ("done", {})
+    pieces = [data["text"] for event, data in parsed[:-1]]
+    assert len(pieces) > 1
+    assert "".join(pieces) == "This is a generated answer to: How often?"
+
+    # The whole answer is saved once the stream is done.
+    turn = query_data.chat_history_collection().find_one({"session_id": "s1"})
+    assert turn["response_text"] == "".join(pieces)
+
+
+def test_stream_matches_ask(client):
+    streamed = events(client.post("/ask/stream", json={"query_text": "Which pump?", "session_id": "s2"}))
+    answer = client.post("/ask", json={"query_text": "Which pump?", "session_id": "s3"}).json()["response"]
+    assert "".join(data["text"] for event, data in streamed if event == "message") == answer
+
+
+def test_stream_reports_errors_as_events(client, monkeypatch):
+    def retrieve_context(*args, **kwargs):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(query_data, "retrieve_context", retrieve_context)
+    response = client.post("/ask/stream", json={"query_text": "How often?", "session_id": "s1"})
+    assert response.status_code == 200
+    assert events(response) == [("error", {"detail": query_data.ERROR_MESSAGE})]
+    assert client.post("/ask/stream", json={"query_text": "x", "session_id": "s1",
+                                            "namespace": "Not Valid"}).status_code == 400
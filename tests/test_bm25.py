@@ -0,0 +1,63 @@
+from bm25 import BM25Index
+
+TEXTS = {
+    "a.pdf:0:0": "Invoices are due within thirty days of delivery.",
+    "a.pdf:1:0": "Late invoices accrue interest at two percent per month.",
+    "b.pdf:0:0": "The warranty covers manufacturing defects for one year.",
+    "b.pdf:1:0": "Warranty claims need the original receipt.",
+}
+
+
+def build():
+    index = BM25Index()
+    index.add(list(TEXTS), list(TEXTS.values()))
+    return index
+
+
+def keys(results):
+    return [key for key, _score in results]
+
+
+def test_search_ranks_and_filters():
+    index = build()
+    assert keys(index.search("warranty receipt", k=1)) == ["b.pdf:1:0"]
+    assert set(keys(index.search("invoices", k=5))) == {"a.pdf:0:0", "a.pdf:1:0"}
+    assert keys(index.search("invoices", k=5, keys=["a.pdf:1:0", "b.pdf:0:0"])) == ["a.pdf:1:0"]
+    assert index.search("nothing matches", k=5) == []
+
+
+def test_upsert_and_delete():
+    index = build()
+    index.add(["a.pdf:0:0"], ["Payment terms changed."])
+    assert len(index) == 4
+    assert "a.pdf:0:0" not in keys(index.search("delivery", k=5))
+    assert keys(index.search("payment", k=5)) == ["a.pdf:0:0"]
+    index.delete(["b.pdf:0:0", "missing"])
+    assert len(index) == 3
+    assert keys(index.search("defects", k=5)) == []
+
+
+def test_save_load_and_compact(tmp_path):
+    index = build()
+    index.add(["c.pdf:0:0"], ["Shipping is free above fifty euros."])
+    index.delete(["a.pdf:1:0"])
+    index.save(tmp_path)
+
+    loaded = BM25Index.load(tmp_path)
+    assert len(loaded) == 4
+    assert len(loaded.segments) == 2
+    assert keys(loaded.search("shipping", k=5)) == ["c.pdf:0:0"]
+    assert keys(loaded.search("interest", k=5)) == []
+
+    loaded.compact()
+    assert len(loaded.segments) == 1
+    assert len(loaded.segments[0]) == 4
+    loaded.delete(["c.pdf:0:0"])
+    loaded.save(tmp_path)
+    assert sorted(path.name for path in tmp_path.iterdir() if path.name.startswith("seg-")) \
+        == loaded._segment_names
+
+    reloaded = BM25Index.load(tmp_path)
+    assert len(reloaded) == 3
+    assert keys(reloaded.search("shipping", k=5)) == []
+    assert keys(reloaded.search("warranty receipt", k=1)) == ["b.pdf:1:0"]
@@ -0,0 +1,38 @@
+from langchain_core.documents import Document
+
+from chunking import iter_chunks, split_pages
+
+
+def page(text, source, page_num):
+    return Document(page_content=text, metadata={"source": source, "page": page_num,
+                                                 "page_key": f"{source}:{page_num}"})
+
+
+PAGES = [page(" ".join(f"word{i}-{n}" for n in range(120)), "manual.pdf", i) for i in range(5)]
+
+
+def test_split_pages_keeps_metadata_and_offsets():
+    text = PAGES[0].page_content
+    chunks = split_pages([(text, PAGES[0].metadata)], chunk_size=200, chunk_overlap=50, unit="chars")
+    assert len(chunks) > 1
+    for chunk_text, metadata in chunks:
+        assert len(chunk_text) <= 200
+        assert text[metadata["start_index"]:metadata["start_index"] + len(chunk_text)] == chunk_text
+        assert metadata["page_key"] == "manual.pdf:0"
+    assert chunks[0][1]["start_index"] == 0
+
+
+def flatten(batches):
+    return [(chunk.page_content, chunk.metadata) for batch in batches for chunk in batch]
+
+
+def test_iter_chunks_matches_a_serial_split_in_page_order():
+    serial = split_pages([(doc.page_content, doc.metadata) for doc in PAGES], 200, 50, "chars")
+    # Two batches are split in-process, five go through the worker pool.
+    in_process = list(iter_chunks(iter(PAGES), 200, 50, "chars", batch_size=3))
+    parallel = list(iter_chunks(iter(PAGES), 200, 50, "chars", batch_size=1))
+    assert len(in_process) == 2 and len(parallel) == 5
+    assert flatten(in_process) == serial
+    assert flatten(parallel) == serial
+    assert [batch[0].metadata["page"] for batch in parallel] == [0, 1, 2, 3, 4]
+    assert list(iter_chunks(iter([]))) == []
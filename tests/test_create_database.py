@@ -0,0 +1,93 @@
+import functools
+import hashlib
+
+import chunking
+import create_database
+from create_database import generate_data_store
+from index_versions import list_versions
+from ingest import remove_file, store_pages
+from jobs import IndexJob
+from retrieval import get_engine, index_path
+from storage import documents_collection
+from vector_store import NumpyVectorStore, SearchFilter
+
+
+def store_file(file_hash, texts, namespace="default"):
+    store_pages(documents_collection(namespace), [
+        {"page_content": text, "content_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+         "metadata": {"source": f"{file_hash}.pdf", "page": page, "file_hash": file_hash, "uploaded_at": 100.0}}
+        for page, text in enumerate(texts)
+    ])
+
+
+def search(query, **filters):
+    engine = get_engine()
+    results = engine.search(query, engine.embed_query(query), k=10,
+                            filters=SearchFilter(**filters) if filters else None)
+    return [doc.page_content for doc, _score in results]
+
+
+def test_full_build_then_incremental_updates(engines, embedder):
+    store_file("a", ["Pump service interval is six months.", "Seal kit PX-4410 fits the pump.",
+                     "Cabin heater fuse is 15 A."])
+    store_file("b", ["Warranty covers defects for one year.", "Claims need the receipt."])
+    job = IndexJob("full")
+    generate_data_store(full=True, progress=job)
+    first = get_engine().version
+    assert first is not None
+    assert job.chunks_total == job.chunks_done == 5
+    assert search("warranty defects")[0] == "Warranty covers defects for one year."
+
+    # Nothing changed: no new version, nothing embedded.
+    embedder.texts = 0
+    generate_data_store()
+    assert get_engine().version == first
+    assert embedder.texts == 0
+
+    # b goes away; c repeats a page of a and adds one.
+    remove_file(documents_collection(), "b")
+    store_file("c", ["Pump service interval is six months.", "Oil grade is 10W-40."])
+    job = IndexJob("update")
+    generate_data_store(progress=job)
+    assert get_engine().version != first
+    # The new page and the warm-up query of the new version.
+    assert embedder.texts == 2
+    assert job.chunks_total == job.chunks_done == 1
+    assert "Warranty covers defects for one year." not in search("warranty defects")
+    assert sorted(search("oil grade pump", sources=["c.pdf"])) == ["Oil grade is 10W-40.",
+                                                                   "Pump service interval is six months."]
+    assert len(list_versions(index_path())) == 2
+
+
+def test_updates_stream_changed_pages(engines, monkeypatch):
+    store_file("a", ["First page of the manual."])
+    generate_data_store(full=True)
+
+    pages = [f"Page {i} about part {i} of the assembly." for i in range(60)]
+    store_file("b", pages)
+    read = []
+    load_documents = create_database.load_documents
+
+    def counting_load(collection):
+        for doc in load_documents(collection):
+            read.append(doc)
+            yield doc
+
+    first_write = []
+    add_embeddings = NumpyVectorStore.add_embeddings
+
+    def recording_add(self, ids, *args):
+        first_write.append(len(read))
+        return add_embeddings(self, ids, *args)
+
+    monkeypatch.setattr(create_database, "load_documents", counting_load)
+    monkeypatch.setattr(create_database, "iter_chunks", functools.partial(chunking.iter_chunks, batch_size=1))
+    monkeypatch.setattr(chunking, "MAX_CHUNK_WORKERS", 1)
+    monkeypatch.setattr(create_database, "UPSERT_BATCH_SIZE", 1)
+    monkeypatch.setattr(NumpyVectorStore, "add_embeddings", recording_add)
+    generate_data_store()
+
+    assert len(read) == 61
+    # Chunks were written while most pages were still to be read.
+    assert first_write[0] < 30
+    assert len(get_engine().get_store()) == 61
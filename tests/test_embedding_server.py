@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+import embedding_server
+from embedding_server import EmbeddingServer, EmbeddingServerError, RemoteEmbeddings
+
+
+class FailingEmbedder:
+    # Fails on texts containing "boom", like a model running out of memory.
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.dimension = embedder.dimension
+
+    def encode(self, texts):
+        if any("boom" in text for text in texts):
+            raise RuntimeError("out of memory")
+        return self.embedder.encode(texts)
+
+
+def start(socket_path, model):
+    server = EmbeddingServer(socket_path, model)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to about 100 bytes, too short for
+    # pytest's tmp_path.
+    directory = tempfile.mkdtemp(prefix="emb-")
+    yield os.path.join(directory, "embeddings.sock")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def server(socket_path, embedder):
+    server = start(socket_path, FailingEmbedder(embedder))
+    yield server
+    stop(server)
+
+
+def test_round_trip(server, socket_path, embedder):
+    remote = RemoteEmbeddings(socket_path)
+    texts = [f"pump seal {i}" for i in range(100)]
+    assert remote.dimension == embedder.dimension
+    np.testing.assert_array_equal(remote.encode(texts), embedder.encode(texts))
+    assert remote.embed_query("pump") == embedder.embed_query("pump")
+    assert remote.encode([]).shape == (0, embedder.dimension)
+
+
+def test_error_reply_drops_the_connection(server, socket_path, embedder):
+    remote = RemoteEmbeddings(socket_path)
+    with pytest.raises(EmbeddingServerError, match="out of memory"):
+        remote.encode(["boom"])
+    assert remote._connections.qsize() == 0
+    np.testing.assert_array_equal(remote.encode(["pump"]), embedder.encode(["pump"]))
+
+
+def test_oversized_request_is_refused(server, socket_path, embedder, monkeypatch):
+    remote = RemoteEmbeddings(socket_path)
+    monkeypatch.setattr(embedding_server, "MAX_REQUEST_BYTES", 100)
+    with pytest.raises(EmbeddingServerError, match="exceeds"):
+        remote.encode(["pump " * 100])
+    # The server closed that connection; the next request opens a new one.
+    assert remote._connections.qsize() == 0
+    np.testing.assert_array_equal(remote.encode(["pump"]), embedder.encode(["pump"]))
+
+
+def test_interrupted_reply_is_not_read_by_the_next_request(server, socket_path, embedder, monkeypatch):
+    remote = RemoteEmbeddings(socket_path)
+    receive = embedding_server.recv_into_exactly
+    calls = []
+
+    def interrupted(sock, view):
+        # The client is interrupted after the header, before the vectors.
+        if threading.current_thread() is threading.main_thread():
+            calls.append(len(view))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+        receive(sock, view)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(embedding_server, "recv_into_exactly", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            remote.encode(["seal"])
+    assert remote._connections.qsize() == 0
+    np.testing.assert_array_equal(remote.encode(["pump"]), embedder.encode(["pump"]))
+
+
+def test_reconnects_after_a_server_restart(server, socket_path, embedder):
+    remote = RemoteEmbeddings(socket_path)
+    remote.encode(["pump"])
+    stop(server)
+    restarted = start(socket_path, embedder)
+    try:
+        np.testing.assert_array_equal(remote.encode(["seal"]), embedder.encode(["seal"]))
+    finally:
+        stop(restarted)
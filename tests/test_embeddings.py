@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pytest
+
+from embeddings import QueryBatcher, QueryEmbeddingCache
+
+
+def test_query_cache_normalizes_and_evicts():
+    cache = QueryEmbeddingCache(max_entries=2)
+    cache.put("How  often is the Pump serviced?", np.ones(3))
+    assert cache.get("how often is the pump serviced?") is not None
+    cache.put("second", np.zeros(3))
+    cache.get("how often is the pump serviced?")
+    cache.put("third", np.zeros(3))
+    # "second" was the least recently used.
+    assert cache.get("second") is None
+    assert cache.get("third") is not None
+    assert cache.stats() == {"entries": 2, "hits": 3, "misses": 1}
+
+    disabled = QueryEmbeddingCache(max_entries=0)
+    disabled.put("text", np.ones(3))
+    assert disabled.get("text") is None
+
+
+def test_batcher_encodes_concurrent_queries_together():
+    calls = []
+    release = threading.Event()
+
+    def encode(texts):
+        calls.append(list(texts))
+        release.wait(5)
+        return np.asarray([[len(text), i] for i, text in enumerate(texts)], dtype=np.float32)
+
+    batcher = QueryBatcher(encode, max_batch_size=8, max_wait=0.2)
+    # The first query occupies the encoder while the others queue up.
+    first = batcher.submit("first")
+    while not calls:
+        pass
+    futures = [batcher.submit(text) for text in ("a", "bb", "a", "ccc")]
+    release.set()
+    assert first.result(5)[0] == 5
+    assert [future.result(5)[0] for future in futures] == [1, 2, 1, 3]
+    # Repeated texts in one batch are encoded once.
+    assert calls == [["first"], ["a", "bb", "ccc"]]
+
+
+def test_batcher_caps_batch_size_and_passes_errors_on():
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        if "bad" in texts:
+            raise ValueError("cannot encode")
+        return np.zeros((len(texts), 2), dtype=np.float32)
+
+    batcher = QueryBatcher(encode, max_batch_size=2, max_wait=0.2)
+    futures = [batcher.submit(text) for text in ("a", "b", "c")]
+    for future in futures:
+        future.result(5)
+    assert max(calls) <= 2
+    with pytest.raises(ValueError):
+        batcher.embed("bad")
+
+
+def test_repeated_queries_come_from_the_cache():
+    from retrieval import QueryEmbedder
+
+    class Model:
+        calls = 0
+
+        def encode(self, texts):
+            Model.calls += 1
+            return np.ones((len(texts), 3), dtype=np.float32)
+
+    embedder = QueryEmbedder()
+    embedder._model = Model()
+    assert embedder.embed_query("Pump service?") == [1.0, 1.0, 1.0]
+    assert embedder.embed_query("pump  SERVICE?") == [1.0, 1.0, 1.0]
+    assert Model.calls == 1
+    assert embedder.query_cache.stats()["hits"] == 1
@@ -0,0 +1,72 @@
+import time
+
+from history import HistoryManager
+from storage import chat_history_collection, session_summaries_collection
+from tokens import count_tokens
+
+
+def add_turns(session_id, count, start=0):
+    chat_history_collection().insert_many([
+        {"session_id": session_id, "query_text": f"question {i}", "response_text": f"answer {i}",
+         "timestamp": 1000.0 + i}
+        for i in range(start, start + count)
+    ])
+
+
+def manager(prompts, **kwargs):
+    def summarize(prompt):
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    return HistoryManager(chat_history_collection, session_summaries_collection, summarize, **kwargs)
+
+
+def wait_for_summary(session_id, covered_until, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        summary = session_summaries_collection().find_one({"session_id": session_id})
+        if summary is not None and summary["covered_until"] == covered_until:
+            return summary
+        assert time.time() < deadline, "the summary was not updated"
+        time.sleep(0.01)
+
+
+def test_short_history_is_returned_verbatim():
+    prompts = []
+    add_turns("s1", 3)
+    context = manager(prompts).get_context("s1")
+    assert context == "\n".join(f"User: question {i}\nJohn: answer {i}" for i in range(3))
+    assert manager(prompts).get_context("unknown") == ""
+    assert prompts == []
+
+
+def test_window_is_bounded_and_older_turns_are_summarized():
+    prompts = []
+    history = manager(prompts, max_turns=4)
+    add_turns("s1", 10)
+    context = history.get_context("s1")
+    assert "question 5" not in context
+    assert context.index("question 6") < context.index("question 9")
+    # Turns 0-5 are folded in the background, oldest first.
+    wait_for_summary("s1", 1005.0)
+    assert "question 0" in prompts[0] and "question 5" in prompts[0] and "question 6" not in prompts[0]
+
+    context = history.get_context("s1")
+    assert context.startswith("Summary of earlier conversation:\nsummary 1")
+    assert len(prompts) == 1
+
+    # Only turns that left the window since are folded next time, on top of
+    # the previous summary.
+    add_turns("s1", 2, start=10)
+    history.get_context("s1")
+    wait_for_summary("s1", 1007.0)
+    assert "summary 1" in prompts[1] and "question 6" in prompts[1] and "question 5" not in prompts[1]
+
+
+def test_window_respects_the_token_budget():
+    prompts = []
+    add_turns("s1", 10)
+    turn_tokens = count_tokens("User: question 9\nJohn: answer 9")
+    context = manager(prompts, token_budget=turn_tokens * 3).get_context("s1")
+    assert context.count("User:") <= 3
+    assert "question 9" in context
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+from bm25 import BM25Index
+from index_versions import activate, collect_garbage, create_version, list_versions, read_current, version_path
+from retrieval import KEYWORD_INDEX_DIR
+from vector_store import NUMPY_STORE_DIR, open_vector_store
+
+
+def build_versions(root, count):
+    versions = []
+    for _ in range(count):
+        version, path = create_version(str(root))
+        open(os.path.join(path, "index"), "w").close()
+        versions.append(version)
+    return versions
+
+
+def test_keeps_newest_versions_up_to_the_active_one(tmp_path):
+    versions = build_versions(tmp_path, 5)
+    activate(str(tmp_path), versions[3])
+    # versions[4] is newer than the active one, like a build in progress.
+    assert collect_garbage(str(tmp_path), keep=2) == versions[:2]
+    assert list_versions(str(tmp_path)) == versions[2:]
+    assert read_current(str(tmp_path)) == versions[3]
+
+
+def test_skips_versions_in_use(tmp_path):
+    versions = build_versions(tmp_path, 3)
+    activate(str(tmp_path), versions[2])
+    assert collect_garbage(str(tmp_path), in_use={versions[0]}, keep=1) == [versions[1]]
+    assert list_versions(str(tmp_path)) == [versions[0], versions[2]]
+
+
+def test_removes_pre_versioning_index(tmp_path):
+    open(tmp_path / "chroma.sqlite3", "w").close()
+    versions = build_versions(tmp_path, 1)
+    activate(str(tmp_path), versions[0])
+    assert collect_garbage(str(tmp_path), keep=1) == ["legacy"]
+    assert sorted(os.listdir(tmp_path)) == ["CURRENT", "versions"]
+
+
+def test_nothing_to_collect_without_an_active_version(tmp_path):
+    build_versions(tmp_path, 3)
+    assert collect_garbage(str(tmp_path), keep=1) == []
+
+
+CHUNKS = {f"manual.pdf:{page}:0": (f"Page {page} covers the pump seal {page}.", {"source": "manual.pdf", "page": page})
+          for page in range(20)}
+
+
+def same_file(first, second, name):
+    return os.stat(os.path.join(first, name)).st_ino == os.stat(os.path.join(second, name)).st_ino
+
+
+def add(store, embedder, chunks):
+    texts = [text for text, _metadata in chunks.values()]
+    store.add_embeddings(list(chunks), embedder.encode(texts), texts, [metadata for _text, metadata in chunks.values()])
+
+
+def test_incremental_version_links_files_not_changed_in_place(tmp_path, build_index):
+    old = version_path(str(tmp_path), build_index(tmp_path, CHUNKS))
+    _, new = create_version(str(tmp_path), copy_active=True)
+    assert same_file(old, new, os.path.join(NUMPY_STORE_DIR, "vectors.f32"))
+    assert same_file(old, new, os.path.join(KEYWORD_INDEX_DIR, "seg-000000", "doc_ids.npy"))
+    assert not same_file(old, new, os.path.join(NUMPY_STORE_DIR, "metadata.sqlite"))
+
+
+def test_updating_a_version_leaves_its_parent_unchanged(tmp_path, build_index, embedder):
+    old = version_path(str(tmp_path), build_index(tmp_path, CHUNKS))
+    _, new = create_version(str(tmp_path), copy_active=True)
+    store = open_vector_store(new, embedder)
+    store.delete(["manual.pdf:0:0"])
+    add(store, embedder, {"winch.pdf:0:0": ("The winch cable is rated for two tons.", {"source": "winch.pdf", "page": 0})})
+    keyword_index = BM25Index.load(os.path.join(new, KEYWORD_INDEX_DIR))
+    keyword_index.delete(["manual.pdf:0:0"])
+    keyword_index.save(os.path.join(new, KEYWORD_INDEX_DIR))
+
+    assert open_vector_store(new, embedder).get_texts()[0] == list(CHUNKS)[1:] + ["winch.pdf:0:0"]
+    assert open_vector_store(old, embedder).get_texts()[0] == list(CHUNKS)
+    assert len(BM25Index.load(os.path.join(old, KEYWORD_INDEX_DIR))) == 20
+    assert not np.load(os.path.join(old, KEYWORD_INDEX_DIR, "seg-000000", "deleted.npy")).any()
+
+
+def test_sibling_versions_keep_their_rows(tmp_path, build_index, embedder):
+    # Two builds from the same parent append to the same linked file; the
+    # second must not truncate the first one's rows.
+    build_index(tmp_path, CHUNKS)
+    _, first = create_version(str(tmp_path), copy_active=True)
+    add(open_vector_store(first, embedder), embedder,
+        {"a.pdf:0:0": ("The winch cable is rated for two tons.", {"source": "a.pdf", "page": 0})})
+    _, second = create_version(str(tmp_path), copy_active=True)
+    add(open_vector_store(second, embedder), embedder,
+        {"b.pdf:0:0": ("The cabin heater uses a separate fuse.", {"source": "b.pdf", "page": 0})})
+
+    store = open_vector_store(first, embedder)
+    assert len(store) == 21
+    results = store.search_by_vector(embedder.embed_query("winch cable rated"), k=1)
+    assert results[0][0].page_content == "The winch cable is rated for two tons."
@@ -0,0 +1,81 @@
+import hashlib
+
+from ingest import cache_pages, clear_documents, remove_file, store_pages
+from storage import documents_collection, page_text_cache_collection, references_collection
+
+
+def page(file_hash, page_num, text):
+    return {"page_content": text, "content_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "metadata": {"source": f"{file_hash}.pdf", "page": page_num, "file_hash": file_hash,
+                         "uploaded_at": 1.0}}
+
+
+def test_store_pages_stores_each_content_once():
+    collection = documents_collection()
+    assert store_pages(collection, [page("a", 0, "intro"), page("a", 1, "body"), page("a", 2, "intro")]) == 2
+    assert store_pages(collection, [page("b", 0, "body"), page("b", 1, "appendix")]) == 1
+    assert collection.count_documents({}) == 3
+    assert references_collection(collection).count_documents({}) == 5
+    # Storing the same file again adds nothing.
+    assert store_pages(collection, [page("b", 0, "body"), page("b", 1, "appendix")]) == 0
+    assert references_collection(collection).count_documents({}) == 5
+
+
+def test_remove_file_keeps_shared_pages():
+    collection = documents_collection()
+    store_pages(collection, [page("a", 0, "shared"), page("a", 1, "only a")])
+    store_pages(collection, [page("b", 3, "shared")])
+
+    assert remove_file(collection, "a") == (2, 1)
+    shared = collection.find_one({"page_content": "shared"})
+    assert shared["metadata"]["file_hash"] == "b"
+    assert shared["metadata"]["page"] == 3
+    assert collection.find_one({"page_content": "only a"}) is None
+
+    assert remove_file(collection, "b") == (1, 1)
+    assert collection.count_documents({}) == 0
+    assert remove_file(collection, "b") == (0, 0)
+
+
+def test_remove_file_deletes_pages_stored_before_dedup():
+    collection = documents_collection()
+    collection.insert_one({"page_content": "old", "metadata": {"source": "c.pdf", "page": 0, "file_hash": "c"}})
+    assert remove_file(collection, "c") == (1, 1)
+    assert collection.count_documents({}) == 0
+
+
+def test_deleting_files_prunes_the_extraction_cache():
+    collection = documents_collection()
+    cache = page_text_cache_collection()
+    for pages in ([page("a", 0, "x"), page("a", 1, "y")], [page("b", 0, "z")]):
+        store_pages(collection, pages)
+        cache_pages(cache, pages)
+    cache_pages(cache, [page("elsewhere", 0, "w")])
+
+    remove_file(collection, "a")
+    assert sorted(entry["file_hash"] for entry in cache.find()) == ["b", "elsewhere"]
+    assert clear_documents(collection) == 1
+    assert [entry["file_hash"] for entry in cache.find()] == ["elsewhere"]
+    assert references_collection(collection).count_documents({}) == 0
+
+
+def test_cache_is_kept_while_another_namespace_stores_the_file():
+    default, team = documents_collection(), documents_collection("team")
+    cache = page_text_cache_collection()
+    for collection in (default, team):
+        store_pages(collection, [page("a", 0, "x"), page("b", 0, "y")])
+    cache_pages(cache, [page("a", 0, "x"), page("b", 0, "y")])
+    # Pages stored before dedup, with no references, count as well.
+    documents_collection("old").insert_one({"page_content": "z", "metadata": {"source": "c.pdf", "page": 0,
+                                                                              "file_hash": "c"}})
+    cache_pages(cache, [page("c", 0, "z")])
+
+    remove_file(default, "a")
+    assert clear_documents(default) == 1
+    assert sorted(entry["file_hash"] for entry in cache.find()) == ["a", "b", "c"]
+    remove_file(team, "a")
+    assert sorted(entry["file_hash"] for entry in cache.find()) == ["b", "c"]
+    clear_documents(team)
+    assert sorted(entry["file_hash"] for entry in cache.find()) == ["c"]
+    clear_documents(documents_collection("old"))
+    assert cache.count_documents({}) == 0
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import create_database
+from jobs import JobManager
+from routes import documents_router
+
+
+def wait_until_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished:
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.01)
+
+
+def test_one_job_per_namespace():
+    manager = JobManager(max_workers=2)
+    release = threading.Event()
+
+    def update(progress, namespace):
+        progress.set_phase("embedding", chunks_total=10, chunks_done=0)
+        progress.advance(4)
+        release.wait(5)
+
+    job, started = manager.submit(update)
+    again, started_again = manager.submit(update)
+    other, started_other = manager.submit(update, namespace="team")
+    assert started and not started_again and again is job
+    assert started_other and other.namespace == "team"
+
+    release.set()
+    wait_until_finished(job)
+    wait_until_finished(other)
+    assert job.to_dict()["status"] == "succeeded"
+    assert (job.phase, job.chunks_total, job.chunks_done) == ("done", 10, 4)
+    assert manager.submit(update)[1]
+
+
+def test_failed_job_reports_its_error():
+    manager = JobManager(max_workers=1)
+
+    def update(progress, namespace):
+        raise RuntimeError("no pages")
+
+    job, _started = manager.submit(update)
+    wait_until_finished(job)
+    assert (job.status, job.error) == ("failed", "no pages")
+    assert manager.get(job.id) is job
+    assert manager.get("missing") is None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def generate_data_store(full=False, progress=None, namespace=None):
+        calls.append((full, namespace))
+        release.wait(5)
+
+    monkeypatch.setattr(create_database, "generate_data_store", generate_data_store)
+    app = FastAPI()
+    app.include_router(documents_router)
+    yield TestClient(app), release, calls
+    release.set()
+
+
+def test_update_database_runs_in_the_background(client):
+    client, release, calls = client
+    response = client.post("/update-database/", params={"full": "true"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    conflict = client.post("/update-database/")
+    assert conflict.status_code == 409
+    assert conflict.json()["job_id"] == job_id
+    assert client.post("/update-database/", params={"namespace": "team"}).status_code == 202
+    assert client.post("/update-database/", params={"namespace": "../x"}).status_code == 400
+
+    release.set()
+    deadline = time.time() + 5
+    while client.get(f"/jobs/{job_id}").json()["status"] != "succeeded":
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert sorted(calls, key=str) == [(False, "team"), (True, "default")]
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_index_builds_log_through_the_server_handlers():
+    # Only the command line run adds its own handler; in-process jobs would
+    # otherwise print every line twice.
+    assert not create_database.logger.handlers
+    assert create_database.logger.propagate
@@ -0,0 +1,60 @@
+import pytest
+
+from answer_cache import get_answer_cache
+from namespaces import InvalidNamespaceError, namespaced_path, validate_namespace
+from retrieval import EngineCache, index_path
+from storage import documents_collection, documents_collection_name
+
+CHUNKS = {"a.pdf:0:0": ("Pump service interval is six months.", {"source": "a.pdf", "page": 0,
+                                                                   "page_key": "a.pdf:0"})}
+
+
+def test_names_and_paths():
+    assert validate_namespace("team-a_1") == "team-a_1"
+    for name in ("", "../etc", "a b", "x" * 65, None):
+        with pytest.raises(InvalidNamespaceError):
+            validate_namespace(name)
+    assert namespaced_path("uploads", "default", "uploads/namespaces") == "uploads"
+    assert namespaced_path("uploads", "team", "uploads/namespaces") == "uploads/namespaces/team"
+    assert index_path() == "chroma" and index_path("team") == "namespaces/team"
+    assert (documents_collection_name(), documents_collection_name("team")) == ("documents", "documents_team")
+
+
+def test_namespaces_keep_their_data_apart():
+    documents_collection("team").insert_one({"page_content": "team page"})
+    assert documents_collection().count_documents({}) == 0
+    assert "metadata.file_hash_1" in documents_collection("team").index_information()
+    assert get_answer_cache("team") is get_answer_cache("team")
+    assert get_answer_cache("team") is not get_answer_cache()
+
+
+def open_engine(cache, namespace):
+    engine = cache.get(namespace)
+    engine.refresh()
+    return engine
+
+
+def test_least_recently_used_indexes_are_closed(engines, build_index):
+    for namespace in ("a", "b", "c"):
+        build_index(index_path(namespace), CHUNKS)
+    cache = EngineCache(max_open=2)
+    a, b = open_engine(cache, "a"), open_engine(cache, "b")
+    cache.get("a")
+    c = open_engine(cache, "c")
+    # b was used least recently.
+    assert (a.is_open, b.is_open, c.is_open) == (True, False, True)
+    assert cache.stats()["open"] == 2 and cache.stats()["evictions"] == 1
+
+    # A closed engine reopens on its next query.
+    assert b.search("pump", b.embed_query("pump"))
+    assert b.is_open and not a.is_open
+
+
+def test_open_indexes_are_bounded_by_size(engines, build_index):
+    for namespace in ("a", "b"):
+        build_index(index_path(namespace), CHUNKS)
+    a = open_engine(EngineCache(max_open=10, max_bytes=1), "a")
+    cache = EngineCache(max_open=10, max_bytes=a.memory_bytes + 1)
+    a, b = open_engine(cache, "a"), open_engine(cache, "b")
+    # The index just opened stays open even when it alone is over the limit.
+    assert (a.is_open, b.is_open) == (False, True)
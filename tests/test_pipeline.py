@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from pipeline import BackgroundWriter, prefetch
+
+
+def test_prefetch_yields_in_order_and_runs_ahead_boundedly():
+    produced = []
+
+    def numbers():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    items = prefetch(numbers(), maxsize=2)
+    assert next(items) == 0
+    # The producer stops once the queue is full.
+    threading.Event().wait(0.1)
+    assert len(produced) <= 4
+    assert list(items) == list(range(1, 20))
+
+
+def test_prefetch_passes_producer_errors_on():
+    def failing():
+        yield 1
+        raise ValueError("bad page")
+
+    items = prefetch(failing())
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_prefetch_stops_the_producer_when_the_consumer_stops():
+    produced = []
+
+    def endless():
+        i = 0
+        while True:
+            produced.append(i)
+            yield i
+            i += 1
+
+    for item in prefetch(endless(), maxsize=2):
+        if item == 3:
+            break
+    count = len(produced)
+    threading.Event().wait(0.1)
+    assert len(produced) == count
+
+
+def test_background_writer_writes_everything_and_reports_errors():
+    written = []
+    with BackgroundWriter(written.append, maxsize=2) as writer:
+        for i in range(10):
+            writer.put(i)
+    assert written == list(range(10))
+
+    def write(item):
+        if item == 2:
+            raise OSError("disk full")
+        written.append(item)
+
+    writer = BackgroundWriter(write)
+    with pytest.raises(OSError):
+        for i in range(100):
+            writer.put(i)
+            threading.Event().wait(0.001)
+        writer.close()
@@ -0,0 +1,15 @@
+import asyncio
+
+import storage
+from query_data import fetch_history, save_chat, save_chat_async
+
+
+def test_history_follows_the_current_client():
+    save_chat("s1", "first question", "first answer")
+    storage.close()
+    # Written through the new client, sync and async alike.
+    asyncio.run(save_chat_async("s1", "second question", "second answer"))
+    save_chat("s1", "third question", "third answer")
+    history = fetch_history("s1")
+    assert "first question" not in history
+    assert history.index("second question") < history.index("third question")
@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+
+from rerank import CrossEncoderReranker, select_chunks
+from tokens import count_tokens
+
+
+def scored(*scores, text="short chunk"):
+    return [(Document(page_content=f"{text} {i}"), score) for i, score in enumerate(scores)]
+
+
+def contents(selected):
+    return [doc.page_content for doc, _score in selected]
+
+
+def test_keeps_chunks_close_to_the_best_score():
+    selected = select_chunks(scored(9.0, 8.0, 5.5, 4.0, 1.0), max_gap=4.0)
+    assert contents(selected) == ["short chunk 0", "short chunk 1", "short chunk 2"]
+
+
+def test_stops_at_max_chunks_and_token_budget():
+    assert len(select_chunks(scored(5.0, 5.0, 5.0, 5.0), max_chunks=2)) == 2
+    chunks = scored(5.0, 5.0, 5.0, text="word " * 100)
+    budget = count_tokens(chunks[0][0].page_content) * 2
+    assert len(select_chunks(chunks, token_budget=budget)) == 2
+
+
+def test_best_chunk_is_always_kept():
+    chunks = scored(1.0, 0.9, text="word " * 100)
+    assert contents(select_chunks(chunks, token_budget=1)) == [chunks[0][0].page_content]
+    assert select_chunks([]) == []
+
+
+def test_rerank_sorts_by_cross_encoder_score():
+    class Model:
+        def predict(self, pairs, **kwargs):
+            return [len(chunk) for _query, chunk in pairs]
+
+    reranker = CrossEncoderReranker()
+    reranker._model = Model()
+    documents = [Document(page_content=text) for text in ("bb", "dddd", "a", "ccc")]
+    assert [(doc.page_content, score) for doc, score in reranker.rerank("q", documents)] == [
+        ("dddd", 4.0), ("ccc", 3.0), ("bb", 2.0), ("a", 1.0)]
+    assert reranker.rerank("q", []) == []
@@ -0,0 +1,91 @@
+import shutil
+
+import pytest
+
+from index_versions import collect_garbage
+from retrieval import KEYWORD_INDEX_DIR, RetrievalEngine, reciprocal_rank_fusion
+from vector_store import SearchFilter
+
+
+def metadata(source, page, start_index=0):
+    return {"source": source, "page": page, "start_index": start_index, "page_key": f"{source}:{page}",
+            "uploaded_at": 100.0}
+
+
+CHUNKS = {
+    "manual.pdf:0:0": ("The hydraulic pump must be serviced every six months.", metadata("manual.pdf", 0)),
+    "manual.pdf:1:0": ("Replace the pump seal kit PX-4410 when it leaks.", metadata("manual.pdf", 1)),
+    "manual.pdf:2:0": ("The cabin heater uses a separate fuse.", metadata("manual.pdf", 2)),
+    "guide.pdf:0:0": ("Pump noise usually means low oil pressure.", metadata("guide.pdf", 0)),
+}
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [key for key, _score in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+    assert reciprocal_rank_fusion([]) == []
+
+
+@pytest.fixture
+def engine(tmp_path, build_index, embedder):
+    build_index(tmp_path, CHUNKS)
+    return RetrievalEngine(str(tmp_path), embedder=embedder)
+
+
+def ids(results):
+    return [f"{doc.metadata['page_key']}:{doc.metadata['start_index']}" for doc, _score in results]
+
+
+def test_hybrid_search_finds_exact_terms(engine):
+    query = "seal kit PX-4410"
+    results = engine.search(query, engine.embed_query(query), k=2)
+    assert ids(results)[0] == "manual.pdf:1:0"
+    assert results[0][0].page_content == CHUNKS["manual.pdf:1:0"][0]
+    assert len(results) == 2
+
+
+def test_search_applies_filters_to_both_retrievers(engine):
+    query = "pump"
+    results = engine.search(query, engine.embed_query(query), k=5, filters=SearchFilter(sources=["guide.pdf"]))
+    assert ids(results) == ["guide.pdf:0:0"]
+    results = engine.search(query, engine.embed_query(query), k=5, filters=SearchFilter(pages=[(1, 2)]))
+    assert set(ids(results)) <= {"manual.pdf:1:0", "manual.pdf:2:0"}
+    assert "manual.pdf:1:0" in ids(results)
+
+
+def test_vector_search_alone_without_a_keyword_index(tmp_path, build_index, embedder):
+    version = build_index(tmp_path, CHUNKS)
+    shutil.rmtree(tmp_path / "versions" / version / KEYWORD_INDEX_DIR)
+    engine = RetrievalEngine(str(tmp_path), embedder=embedder)
+    query = "cabin heater fuse"
+    results = engine.search(query, engine.embed_query(query), k=1)
+    assert ids(results) == ["manual.pdf:2:0"]
+    # Nothing close enough: no results rather than unrelated chunks.
+    assert engine.search("zzz", engine.embed_query("zzz"), k=1) == []
+
+
+def test_engine_without_an_index(tmp_path, embedder):
+    engine = RetrievalEngine(str(tmp_path), embedder=embedder)
+    assert engine.search("pump", engine.embed_query("pump")) == []
+    assert engine.version is None
+
+
+def test_readers_finish_on_the_version_they_started_on(tmp_path, build_index, embedder):
+    first = build_index(tmp_path, CHUNKS)
+    engine = RetrievalEngine(str(tmp_path), embedder=embedder)
+    with engine.reading() as handle:
+        second = build_index(tmp_path, {"winch.pdf:0:0": ("The winch cable is rated for two tons.",
+                                                          metadata("winch.pdf", 0))})
+        engine.refresh()
+        assert engine.version == second
+        assert handle.version == first and handle.retired
+        # The old version stays open, and is not collected, until released.
+        assert engine.open_versions() == {first, second}
+        assert collect_garbage(str(tmp_path), in_use=engine.open_versions(), keep=1) == []
+        query = "seal kit PX-4410"
+        assert ids(handle.store.search_by_vector(engine.embed_query(query), k=1)) == ["manual.pdf:1:0"]
+        query = "winch cable"
+        assert ids(engine.search(query, engine.embed_query(query), k=5)) == ["winch.pdf:0:0"]
+    assert engine.open_versions() == {second}
+    assert collect_garbage(str(tmp_path), in_use=engine.open_versions(), keep=1) == [first]
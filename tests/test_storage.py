@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+import storage
+
+
+def test_async_client_without_a_sync_client():
+    # In mock mode the async client wraps the sync one, built under the same
+    # lock.
+    assert storage._client is None
+    done = threading.Event()
+    clients = []
+
+    def build():
+        clients.append(storage.get_async_client())
+        done.set()
+
+    threading.Thread(target=build, daemon=True).start()
+    assert done.wait(5), "get_async_client() deadlocked"
+    assert clients[0].client is storage.get_client()
+
+
+def test_sync_and_async_collections_share_data():
+    async def insert():
+        await storage.async_documents_collection("team").insert_one({"page_content": "hello"})
+
+    asyncio.run(insert())
+    assert storage.documents_collection("team").find_one({})["page_content"] == "hello"
+    assert storage.documents_collection().count_documents({}) == 0
+
+
+def test_close_drops_the_in_memory_database():
+    storage.chat_history_collection().insert_one({"session_id": "s"})
+    storage.close()
+    assert storage.chat_history_collection().count_documents({}) == 0
@@ -0,0 +1,38 @@
+from tokens import count_tokens, fit_prompt
+
+
+def words(count, word="token"):
+    return " ".join([word] * count)
+
+
+def test_everything_fits():
+    history, chunks, trimmed = fit_prompt("question", "user: hi\nbot: hello", ["one", "two"], budget=1000)
+    assert (history, chunks, trimmed) == ("user: hi\nbot: hello", ["one", "two"], 0)
+
+
+def test_lowest_ranked_chunks_are_dropped_first():
+    chunks = [words(50, "best"), words(50, "second"), words(50, "third")]
+    budget = count_tokens("question") + count_tokens(chunks[0]) + count_tokens(chunks[1]) + 5
+    history, kept, trimmed = fit_prompt("question", "", chunks, budget=budget)
+    assert kept == chunks[:2]
+    assert trimmed == count_tokens(chunks[2])
+
+
+def test_best_chunk_is_cut_short_rather_than_dropped():
+    chunk = words(500)
+    history, kept, trimmed = fit_prompt("question", "old line\nnew line", [chunk], budget=100)
+    assert len(kept) == 1 and chunk.startswith(kept[0]) and kept[0] != chunk
+    assert history == ""
+    assert count_tokens("question") + count_tokens(kept[0]) <= 100
+    assert trimmed > 0
+
+
+def test_history_keeps_most_recent_whole_lines():
+    history = "\n".join(f"line {i} " + words(20, "chat") for i in range(20))
+    fixed_tokens = count_tokens("question")
+    fitted, kept, trimmed = fit_prompt("question", history, ["context"], budget=fixed_tokens + 80)
+    assert fitted and history.endswith(fitted)
+    assert fitted.startswith("line ")
+    assert count_tokens(fitted) + count_tokens("context") + fixed_tokens <= fixed_tokens + 80
+    assert kept == ["context"]
+    assert trimmed == count_tokens(history) - count_tokens(fitted)
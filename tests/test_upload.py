@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+
+import ingest
+import routes
+from ingest import UploadSizeLimit, UploadTooLargeError, save_upload
+
+
+def test_save_upload_streams_and_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "UPLOAD_CHUNK_SIZE", 7)
+    data = os.urandom(100)
+    upload = UploadFile(io.BytesIO(data), filename="a.pdf")
+    temp_path, file_hash = asyncio.run(save_upload(upload, str(tmp_path)))
+    assert file_hash == hashlib.sha256(data).hexdigest()
+    with open(temp_path, "rb") as f:
+        assert f.read() == data
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(save_upload(UploadFile(io.BytesIO(data), filename="b.pdf"), str(tmp_path), max_bytes=99))
+    assert os.listdir(tmp_path) == [os.path.basename(temp_path)]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stored = []
+
+    def store_documents(collection, files):
+        stored.extend(files)
+        return {"pages": len(files)}
+
+    monkeypatch.setattr(routes, "store_documents", store_documents)
+    monkeypatch.setattr(routes, "save_upload", functools.partial(save_upload, max_bytes=1000))
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimit, max_bytes=10000)
+    app.include_router(routes.documents_router)
+    return TestClient(app), stored, tmp_path / "uploads"
+
+
+def test_upload_keeps_files_and_skips_repeats(client):
+    client, stored, folder = client
+    response = client.post("/upload/", files=[("files", ("a.pdf", b"first")), ("files", ("b.pdf", b"second")),
+                                              ("files", ("c.pdf", b"first"))])
+    assert response.status_code == 200
+    body = response.json()
+    assert body["duplicates"] == ["c.pdf"]
+    assert body["file_hashes"] == {"a.pdf": hashlib.sha256(b"first").hexdigest(),
+                                   "b.pdf": hashlib.sha256(b"second").hexdigest()}
+    assert [filename for _path, filename, _hash in stored] == ["a.pdf", "b.pdf"]
+    assert sorted(os.listdir(folder)) == ["a.pdf", "b.pdf"]
+
+
+def test_rejected_batches_leave_no_files(client):
+    client, stored, folder = client
+    response = client.post("/upload/", files=[("files", ("a.pdf", b"first")), ("files", ("notes.txt", b"text"))])
+    assert response.status_code == 400
+    response = client.post("/upload/", files=[("files", ("a.pdf", b"first")), ("files", ("big.pdf", b"x" * 2000))])
+    assert response.status_code == 413
+    assert stored == []
+    assert os.listdir(folder) == []
+
+
+def test_oversized_requests_are_refused_while_they_arrive(client):
+    client, stored, folder = client
+    response = client.post("/upload/", files=[("files", ("big.pdf", b"x" * 20000))])
+    assert response.status_code == 413
+
+    def body():
+        for _ in range(30):
+            yield b"x" * 500
+
+    # No Content-Length: the body is counted as it is received.
+    response = client.post("/upload/", content=body(), headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert stored == []
@@ -0,0 +1,18 @@
+import asyncio
+
+from usage import record_usage, record_usage_async, usage_by_day, usage_by_session
+
+
+def test_usage_totals():
+    record_usage("s1", 100, 20, trimmed_tokens=5)
+    asyncio.run(record_usage_async("s1", 0, 0, cached=True))
+    record_usage("s2", 50, 10)
+
+    totals = usage_by_session("s1")
+    assert (totals["requests"], totals["cached_requests"]) == (2, 1)
+    assert (totals["prompt_tokens"], totals["completion_tokens"], totals["total_tokens"]) == (100, 20, 120)
+    assert totals["trimmed_tokens"] == 5
+    assert usage_by_session("missing") is None
+
+    days = usage_by_day()
+    assert len(days) == 1 and days[0]["requests"] == 3 and days[0]["total_tokens"] == 180
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from vector_store import NumpyVectorStore, SearchFilter
+
+
+def metadata(source, page, uploaded_at):
+    return {"source": source, "page": page, "uploaded_at": uploaded_at, "page_key": f"{source}:{page}"}
+
+
+def build(directory):
+    store = NumpyVectorStore(str(directory))
+    store.add_embeddings(
+        ["a.pdf:0:0", "a.pdf:1:0", "b.pdf:0:0", "b.pdf:5:0"],
+        np.eye(4, dtype=np.float32),
+        ["a0", "a1", "b0", "b5"],
+        [metadata("a.pdf", 0, 100.0), metadata("a.pdf", 1, 100.0), metadata("b.pdf", 0, 200.0),
+         metadata("b.pdf", 5, 200.0)],
+    )
+    return store
+
+
+def test_search_and_reopen(tmp_path):
+    store = build(tmp_path)
+    results = store.search_by_vector([0.0, 0.0, 1.0, 0.1], k=2)
+    assert [doc.page_content for doc, _score in results] == ["b0", "b5"]
+    assert results[0][1] > results[1][1]
+    assert results[0][0].metadata["source"] == "b.pdf"
+
+    reopened = NumpyVectorStore(str(tmp_path))
+    assert len(reopened) == 4
+    assert reopened.get_texts() == (["a.pdf:0:0", "a.pdf:1:0", "b.pdf:0:0", "b.pdf:5:0"], ["a0", "a1", "b0", "b5"])
+    assert set(reopened.get_documents(["a.pdf:1:0", "missing"])) == {"a.pdf:1:0"}
+
+
+def test_upsert_delete_and_compact(tmp_path):
+    store = build(tmp_path)
+    store.add_embeddings(["a.pdf:0:0"], [[0.0, 0.0, 0.6, 0.8]], ["a0 new"], [metadata("a.pdf", 0, 150.0)])
+    store.delete(["b.pdf:5:0"])
+    assert len(store) == 3
+    # b5 would be the best match, but is deleted.
+    top = store.search_by_vector([0.0, 0.0, 0.0, 1.0], k=1)
+    assert [doc.page_content for doc, _score in top] == ["a0 new"]
+
+    store.compact()
+    assert len(store) == 3
+    assert NumpyVectorStore(str(tmp_path)).get_texts()[1] == ["a1", "b0", "a0 new"]
+
+
+def test_int8_quantization_keeps_the_ranking(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), quantization="int8")
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 16)).astype(np.float32)
+    store.add_embeddings([str(i) for i in range(50)], vectors, [str(i) for i in range(50)], [{}] * 50)
+    results = store.search_by_vector(vectors[7], k=1)
+    assert results[0][0].page_content == "7"
+    assert results[0][1] == pytest.approx(1.0, abs=0.01)
+    assert NumpyVectorStore(str(tmp_path)).quantization == "int8"
+def test_filters(tmp_path):
+    store = build(tmp_path)
+    assert store.filter_ids(SearchFilter(sources=["b.pdf"])) == ["b.pdf:0:0", "b.pdf:5:0"]
+    assert store.filter_ids(SearchFilter(pages=[(1, 4)])) == ["a.pdf:1:0"]
+    assert store.filter_ids(SearchFilter(uploaded_after=150.0)) == ["b.pdf:0:0", "b.pdf:5:0"]
+    assert store.filter_ids(SearchFilter(sources=["a.pdf", "b.pdf"], pages=[(0, 0)], uploaded_before=150.0)) \
+        == ["a.pdf:0:0"]
+
+    results = store.search_by_vector([1.0, 0.0, 0.0, 0.0], k=2, filters=SearchFilter(sources=["b.pdf"]))
+    assert [doc.page_content for doc, _score in results][0] in ("b0", "b5")
+    assert all(doc.metadata["source"] == "b.pdf" for doc, _score in results)
+
+
+def test_filters_skip_deleted_chunks(tmp_path):
+    store = build(tmp_path)
+    store.delete(["b.pdf:0:0"])
+    assert store.filter_ids(SearchFilter(sources=["b.pdf"])) == ["b.pdf:5:0"]
+    store.compact()
+    assert len(store) == 3
+    assert store.filter_ids(SearchFilter(sources=["b.pdf"])) == ["b.pdf:5:0"]
+
+
+def test_shared_pages_match_every_occurrence(tmp_path):
+    store = build(tmp_path)
+    # a.pdf page 0 also occurs as page 7 of c.pdf, uploaded later.
+    store.set_occurrences([("a.pdf:0", "a.pdf", 0, 100.0), ("a.pdf:0", "c.pdf", 7, 300.0),
+                           ("a.pdf:1", "a.pdf", 1, 100.0), ("b.pdf:0", "b.pdf", 0, 200.0),
+                           ("b.pdf:5", "b.pdf", 5, 200.0)])
+    assert store.filter_ids(SearchFilter(sources=["c.pdf"])) == ["a.pdf:0:0"]
+    assert store.filter_ids(SearchFilter(pages=[(7, 7)])) == ["a.pdf:0:0"]
+    assert store.filter_ids(SearchFilter(uploaded_after=250.0)) == ["a.pdf:0:0"]
+    assert store.filter_ids(SearchFilter(sources=["a.pdf", "c.pdf"])) == ["a.pdf:0:0", "a.pdf:1:0"]
+
+    store.compact()
+    reopened = NumpyVectorStore(str(tmp_path))
+    assert reopened.filter_ids(SearchFilter(sources=["c.pdf"])) == ["a.pdf:0:0"]
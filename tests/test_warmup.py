@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routes
+from metrics import stage_metrics
+from routes import probes_router
+from warmup import WarmUp
+
+
+@pytest.fixture
+def warm_up(monkeypatch):
+    # A fresh warm-up behind the probes of a bare app. Returns
+    # (warm_up, client).
+    warm_up = WarmUp()
+    monkeypatch.setattr(routes, "warm_up", warm_up)
+    app = FastAPI()
+    app.include_router(probes_router)
+    return warm_up, TestClient(app)
+
+
+def test_runs_steps_in_order_once():
+    stage_metrics.reset()
+    warm_up = WarmUp()
+    ran = []
+    steps = [("retrieval", lambda: ran.append("retrieval")), ("llm", lambda: ran.append("llm"))]
+    warm_up.start(steps, background=False)
+    warm_up.start(steps, background=False)
+    assert ran == ["retrieval", "llm"]
+    assert warm_up.ready
+    assert list(warm_up.status()["steps"]) == ["retrieval", "llm"]
+    assert {"startup.retrieval", "startup.llm"} <= set(stage_metrics.summary())
+
+
+def test_a_failed_step_leaves_the_server_not_ready():
+    warm_up = WarmUp()
+
+    def fail():
+        raise RuntimeError("model not found")
+
+    ran = []
+    warm_up.start([("retrieval", fail), ("llm", lambda: ran.append("llm"))], background=False)
+    assert warm_up.status()["status"] == "failed"
+    assert warm_up.status()["error"] == "model not found"
+    assert ran == []
+
+
+def test_readyz_waits_for_background_warm_up(warm_up):
+    warm_up, client = warm_up
+    release = threading.Event()
+    assert client.get("/readyz").status_code == 503
+    warm_up.start([("retrieval", lambda: release.wait(5))], background=True)
+    # Live but not ready while the step runs.
+    assert client.get("/healthz").json() == {"status": "ok"}
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["status"] == "warming"
+    release.set()
+    warm_up._thread.join(5)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert "retrieval" in response.json()["steps"]
@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+
+# Upper bound on the whole prompt sent to the LLM, in tokens: template,
+# question, conversation history and retrieved context together.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+# tiktoken encoding used for counting. It is not Gemini's tokenizer, but
+# close enough for budgeting and much faster than asking the API. Without
+# tiktoken (or its encoding file) counts fall back to four characters per
+# token.
+TOKEN_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+                except Exception as e:
+                    logger.warning(f"Could not load tiktoken encoding {TOKEN_ENCODING}, estimating tokens "
+                                   f"from characters: {str(e)}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, keep_end=False):
+    # The first (or, with keep_end, the last) max_tokens tokens of text.
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        if count_tokens(text) <= max_tokens:
+            return text
+        # count_tokens rounds up, so this many characters count max_tokens.
+        max_chars = (max_tokens - 1) * CHARS_PER_TOKEN
+        if max_chars == 0:
+            return ""
+        return text[-max_chars:] if keep_end else text[:max_chars]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:] if keep_end else tokens[:max_tokens])
+
+
+def fit_prompt(fixed_text, history, chunks, budget=PROMPT_TOKEN_BUDGET):
+    # Trims history and the retrieved chunks so that they fit in the budget
+    # next to fixed_text (the template and the question). Chunks come best
+    # first and take priority, as the answer is grounded on them; the lowest
+    # ranked are dropped first, and the best one is cut short rather than
+    # dropped. History gets what is left, keeping its most recent lines.
+    # Returns (history, chunks, tokens trimmed).
+    available = max(budget - count_tokens(fixed_text), 0)
+    kept = []
+    used = 0
+    trimmed = 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        # Once a chunk has been dropped, lower ranked ones are dropped too.
+        if trimmed == 0 and used + tokens <= available:
+            kept.append(chunk)
+            used += tokens
+        elif not kept and available > 0:
+            chunk = truncate_tokens(chunk, available)
+            kept.append(chunk)
+            used += count_tokens(chunk)
+            trimmed += tokens - count_tokens(chunk)
+        else:
+            trimmed += tokens
+
+    history_tokens = count_tokens(history)
+    if history_tokens > available - used:
+        fitted = truncate_tokens(history, available - used, keep_end=True)
+        if fitted and fitted != history and "\n" in fitted:
+            # Drop the partial oldest line.
+            fitted = fitted[fitted.index("\n") + 1:]
+        trimmed += history_tokens - count_tokens(fitted)
+        history = fitted
+    return history, kept, trimmed
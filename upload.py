@@ -1,35 +1,27 @@
 # store_documents_in_mongo.py
 import os
-import fitz  # PyMuPDF
-from pymongo import MongoClient
 from dotenv import load_dotenv
+import ingest
+from storage import documents_collection
 
 load_dotenv()
 
 DATA_PATH = "data/books"  # Ensure this directory contains your PDF files
-MONGO_URI = os.environ['MONGO_URI']
-DATABASE_NAME = "document_db"
-COLLECTION_NAME = "documents"
-
-client = MongoClient(MONGO_URI)
-db = client[DATABASE_NAME]
-collection = db[COLLECTION_NAME]
 
 def store_documents():
+    collection = documents_collection()
+    files = []
     for filename in os.listdir(DATA_PATH):
         if filename.endswith(".pdf"):
             filepath = os.path.join(DATA_PATH, filename)
+            file_hash = ingest.hash_file(filepath)
+            if ingest.is_duplicate(collection, file_hash):
+                print(f"Skipping already stored document: {filename}")
+                continue
             print(f"Processing document: {filename}")
-            with fitz.open(filepath) as pdf:
-                for page_num in range(len(pdf)):
-                    page = pdf.load_page(page_num)
-                    text = page.get_text()
-                    document = {
-                        "page_content": text,
-                        "metadata": {"source": filename, "page": page_num}
-                    }
-                    collection.insert_one(document)
-    print("Documents stored in MongoDB.")
+            files.append((filepath, filename, file_hash))
+    stats = ingest.store_documents(collection, files)
+    print(f"Documents stored in MongoDB ({stats['pages']} pages, {stats['pages_per_second']} pages/sec).")
 
 if __name__ == "__main__":
     store_documents()
\ No newline at end of file
@@ -0,0 +1,84 @@
+import logging
+import time
+from datetime import datetime, timezone
+
+from storage import token_usage_collection, async_token_usage_collection
+
+# Per-request token accounting, one document per answered question in the
+# token_usage collection, replacing the old token_log.txt. Counts come from
+# tokens.count_tokens. Answers served from the answer cache are recorded
+# with cached=True and no tokens, as no LLM call was made.
+
+logger = logging.getLogger(__name__)
+
+USAGE_TOTALS = {
+    "requests": {"$sum": 1},
+    "cached_requests": {"$sum": {"$cond": ["$cached", 1, 0]}},
+    "prompt_tokens": {"$sum": "$prompt_tokens"},
+    "completion_tokens": {"$sum": "$completion_tokens"},
+    "trimmed_tokens": {"$sum": "$trimmed_tokens"},
+}
+
+
+def usage_entry(session_id, prompt_tokens, completion_tokens, trimmed_tokens=0, cached=False):
+    timestamp = time.time()
+    return {
+        "session_id": session_id,
+        "timestamp": timestamp,
+        # UTC day, so daily totals are a plain group by.
+        "day": datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d"),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "trimmed_tokens": trimmed_tokens,
+        "cached": cached,
+    }
+
+
+def record_usage(*args, **kwargs):
+    # Accounting must never fail the request it accounts for.
+    try:
+        token_usage_collection().insert_one(usage_entry(*args, **kwargs))
+    except Exception as e:
+        logger.error(f"Failed to record token usage: {str(e)}")
+
+
+async def record_usage_async(*args, **kwargs):
+    try:
+        await async_token_usage_collection().insert_one(usage_entry(*args, **kwargs))
+    except Exception as e:
+        logger.error(f"Failed to record token usage: {str(e)}")
+
+
+def with_total(row):
+    row["total_tokens"] = row["prompt_tokens"] + row["completion_tokens"]
+    return row
+
+
+def usage_by_session(session_id):
+    rows = list(token_usage_collection().aggregate([
+        {"$match": {"session_id": session_id}},
+        {"$group": {"_id": "$session_id", **USAGE_TOTALS}},
+    ]))
+    if not rows:
+        return None
+    row = rows[0]
+    row["session_id"] = row.pop("_id")
+    return with_total(row)
+
+
+def usage_by_day(days=30, session_id=None):
+    # One row per UTC day over the last days days, newest first.
+    since = datetime.fromtimestamp(time.time() - days * 86400, timezone.utc).strftime("%Y-%m-%d")
+    match = {"day": {"$gte": since}}
+    if session_id is not None:
+        match["session_id"] = session_id
+    rows = token_usage_collection().aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$day", **USAGE_TOTALS}},
+        {"$sort": {"_id": -1}},
+    ])
+    result = []
+    for row in rows:
+        row["day"] = row.pop("_id")
+        result.append(with_total(row))
+    return result
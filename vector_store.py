@@ -0,0 +1,611 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+# "chroma" keeps using the Chroma persist directory; "numpy" uses
+# NumpyVectorStore, kept in a subdirectory of the same persist directory.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_DIR = "vectors"
+# "float32" or "int8" (a quarter of the size, with one scale per row).
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float32")
+# Rows scored per matrix-vector product, so int8 blocks converted to float32
+# stay small.
+SEARCH_BLOCK_ROWS = 8192
+# Deleted rows are only dropped from the files once they are this fraction
+# of all rows, see NumpyVectorStore.compact.
+MAX_DELETED_RATIO = 0.2
+HEADER_FILE = "header.json"
+METADATA_FILE = "metadata.sqlite"
+# Chroma's own metadata holds one source and page per chunk; every file and
+# page a deduplicated page occurs at is kept next to it in this file.
+OCCURRENCES_FILE = "occurrences.sqlite"
+SQL_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def relevance_from_cosine(similarity):
+    # Same scale as Chroma's default squared L2 distance turned into a
+    # relevance score by langchain, so MIN_RELEVANCE means the same thing
+    # for both backends.
+    return 1.0 - (2.0 - 2.0 * similarity) / math.sqrt(2)
+
+
+class SearchFilter:
+    # Restricts retrieval to chunks of some sources, page ranges and/or an
+    # upload time window. pages are inclusive (first, last) pairs of page
+    # numbers as stored in chunk metadata (0-based); upload times are epoch
+    # seconds. Chunks without an upload time never match a time bound.
+    def __init__(self, sources=None, pages=None, uploaded_after=None, uploaded_before=None):
+        self.sources = sorted(set(sources)) if sources else None
+        self.pages = [(int(first), int(last)) for first, last in pages] if pages else None
+        self.uploaded_after = uploaded_after
+        self.uploaded_before = uploaded_before
+
+    def __bool__(self):
+        return bool(self.sources or self.pages or self.uploaded_after is not None
+                    or self.uploaded_before is not None)
+
+    def mask(self, pages, uploaded_at):
+        # Page range and upload time conditions over arrays of chunk pages
+        # and upload times; sources are handled by the caller.
+        keep = np.ones(len(pages), dtype=bool)
+        if self.pages:
+            in_range = np.zeros(len(pages), dtype=bool)
+            for first, last in self.pages:
+                in_range |= (pages >= first) & (pages <= last)
+            keep &= in_range
+        if self.uploaded_after is not None:
+            keep &= uploaded_at >= self.uploaded_after
+        if self.uploaded_before is not None:
+            keep &= uploaded_at <= self.uploaded_before
+        return keep
+
+    def chroma_where(self):
+        clauses = []
+        if self.sources:
+            clauses.append({"source": {"$in": self.sources}})
+        if self.pages:
+            ranges = [{"$and": [{"page": {"$gte": first}}, {"page": {"$lte": last}}]} for first, last in self.pages]
+            clauses.append(ranges[0] if len(ranges) == 1 else {"$or": ranges})
+        if self.uploaded_after is not None:
+            clauses.append({"uploaded_at": {"$gte": self.uploaded_after}})
+        if self.uploaded_before is not None:
+            clauses.append({"uploaded_at": {"$lte": self.uploaded_before}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def filter_columns(metadata):
+    # Values of the filterable columns of NumpyVectorStore.
+    page = metadata.get("page")
+    uploaded_at = metadata.get("uploaded_at")
+    return (metadata.get("source"), None if page is None else int(page),
+            None if uploaded_at is None else float(uploaded_at), metadata.get("page_key"))
+
+
+def create_occurrence_table(connection):
+    # One row per file and page a stored page occurs at, by the page key its
+    # chunks carry (see create_database.assign_page_keys). A page stored once
+    # for several files matches the filters of each of them. Stores built
+    # before this table existed leave it empty and filter on the chunks' own
+    # source and page.
+    connection.execute("CREATE TABLE IF NOT EXISTS occurrences (page_key TEXT NOT NULL, source TEXT, page INTEGER, "
+                       "uploaded_at REAL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS occurrences_source ON occurrences (source)")
+    connection.commit()
+
+
+def replace_occurrences(connection, rows):
+    # rows are (page key, source, page, upload time).
+    connection.execute("DELETE FROM occurrences")
+    connection.executemany("INSERT INTO occurrences (page_key, source, page, uploaded_at) VALUES (?, ?, ?, ?)", rows)
+    connection.commit()
+
+
+def has_occurrences(connection):
+    return connection.execute("SELECT 1 FROM occurrences LIMIT 1").fetchone() is not None
+
+
+class ChromaVectorStore:
+    # The langchain Chroma store behind the same interface as
+    # NumpyVectorStore.
+    def __init__(self, persist_directory, embedding_model):
+        from langchain_community.vectorstores import Chroma
+
+        self.db = Chroma(persist_directory=persist_directory, embedding_function=embedding_model)
+        self._occurrences_path = os.path.join(persist_directory, OCCURRENCES_FILE)
+        self._occurrences = None
+        self._uses_occurrences = False
+        if os.path.exists(self._occurrences_path):
+            self._occurrences = sqlite3.connect(self._occurrences_path, check_same_thread=False)
+            self._uses_occurrences = has_occurrences(self._occurrences)
+        self._subsets = {}
+
+    def add_documents(self, documents, ids):
+        self.db.add_documents(documents, ids=ids)
+        self._subsets = {}
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        self.db._collection.upsert(ids=ids, embeddings=np.asarray(embeddings).tolist(), documents=texts,
+                                   metadatas=metadatas)
+        self._subsets = {}
+
+    def delete(self, ids):
+        if ids:
+            self.db.delete(ids=ids)
+            self._subsets = {}
+
+    def get_texts(self):
+        stored = self.db.get(include=["documents"])
+        return stored["ids"], stored["documents"]
+
+    def get_documents(self, ids):
+        stored = self.db.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            key: Document(page_content=text, metadata=metadata or {})
+            for key, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        }
+
+    def set_occurrences(self, rows):
+        if self._occurrences is None:
+            self._occurrences = sqlite3.connect(self._occurrences_path, check_same_thread=False)
+            create_occurrence_table(self._occurrences)
+        replace_occurrences(self._occurrences, rows)
+        self._uses_occurrences = has_occurrences(self._occurrences)
+        self._subsets = {}
+
+    def _stored_subset(self, source):
+        # Chunks with the source and page of their own metadata.
+        stored = self.db.get(where={"source": source} if source is not None else None, include=["metadatas"])
+        metadatas = [metadata or {} for metadata in stored["metadatas"]]
+        return (
+            stored["ids"],
+            [metadata.get("page_key") for metadata in metadatas],
+            [metadata.get("page") for metadata in metadatas],
+            [metadata.get("uploaded_at") for metadata in metadatas],
+        )
+
+    def _occurrence_subset(self, source):
+        # Chunks once for every occurrence of their page: the occurrences of
+        # the source are resolved to page keys, and those to chunk ids.
+        query = "SELECT page_key, page, uploaded_at FROM occurrences"
+        occurrences = self._occurrences.execute(query + " WHERE source = ?" if source is not None else query,
+                                                (source,) if source is not None else ()).fetchall()
+        page_keys = list(dict.fromkeys(page_key for page_key, _page, _uploaded_at in occurrences))
+        chunks = {}
+        for start in range(0, len(page_keys), SQL_BATCH_SIZE):
+            batch = page_keys[start:start + SQL_BATCH_SIZE]
+            stored = self.db.get(where={"page_key": {"$in": batch}}, include=["metadatas"])
+            for key, metadata in zip(stored["ids"], stored["metadatas"]):
+                chunks.setdefault((metadata or {}).get("page_key"), []).append(key)
+        rows = [(key, page_key, page, uploaded_at)
+                for page_key, page, uploaded_at in occurrences for key in chunks.get(page_key, ())]
+        return tuple(list(column) for column in zip(*rows)) if rows else ([], [], [], [])
+
+    def _subset(self, source):
+        # Ids, page keys, pages and upload times of the chunks of one source
+        # (all sources for None), read once and kept until the store
+        # changes, as in NumpyVectorStore.
+        subset = self._subsets.get(source)
+        if subset is None:
+            ids, page_keys, pages, uploaded_at = (self._occurrence_subset(source) if self._uses_occurrences
+                                                  else self._stored_subset(source))
+            subset = (
+                np.asarray(ids, dtype=object),
+                np.asarray(page_keys, dtype=object),
+                np.asarray([-1 if page is None else int(page) for page in pages], dtype=np.int64),
+                np.asarray([np.nan if value is None else float(value) for value in uploaded_at], dtype=np.float64),
+            )
+            self._subsets[source] = subset
+        return subset
+
+    def _filter(self, filters):
+        # Ids and page keys of the matching chunks, each once.
+        subsets = [self._subset(source) for source in (filters.sources or [None])]
+        keep = filters.mask(np.concatenate([subset[2] for subset in subsets]),
+                            np.concatenate([subset[3] for subset in subsets]))
+        ids = np.concatenate([subset[0] for subset in subsets])[keep]
+        page_keys = np.concatenate([subset[1] for subset in subsets])[keep]
+        return list(dict.fromkeys(ids.tolist())), list(dict.fromkeys(page_keys.tolist()))
+
+    def filter_ids(self, filters):
+        return self._filter(filters)[0]
+
+    def search_by_vector(self, embedding, k=5, filters=None):
+        # Chroma applies the filter through its metadata index before the
+        # nearest-neighbour search. With an occurrence table, the filter is
+        # first resolved to the page keys of the matching chunks.
+        where = filters.chroma_where() if filters else None
+        if filters and self._uses_occurrences:
+            _ids, page_keys = self._filter(filters)
+            if not page_keys:
+                return []
+            where = {"page_key": {"$in": page_keys}}
+        relevance_score_fn = self.db._select_relevance_score_fn()
+        results = self.db.similarity_search_by_vector_with_relevance_scores(
+            list(map(float, embedding)), k=k, filter=where)
+        return [(doc, relevance_score_fn(distance)) for doc, distance in results]
+
+    def __len__(self):
+        return self.db._collection.count()
+
+    def maybe_compact(self):
+        pass
+
+    def close(self):
+        # Chroma caches one client system per path. Every index version has
+        # its own path, so only this store's entry is dropped; clearing the
+        # whole cache would also reset the stores of other versions and
+        # namespaces.
+        try:
+            client = self.db._client
+            type(client)._identifer_to_system.pop(client._identifier, None)
+        except Exception as e:
+            logger.warning(f"Failed to drop Chroma client from its cache: {e}")
+
+
+class NumpyVectorStore:
+    # Unit-length embeddings in a flat row-major file that readers
+    # memory-map, with a SQLite table of (row, id, text, metadata, deleted)
+    # next to it. Writes only append rows and mark replaced or deleted rows
+    # in the table; header.json records how many rows are complete, so
+    # readers never see a half-written row. Several processes opening the
+    # same directory share the vectors through the page cache. Source, page
+    # and upload time are also kept as indexed columns for filtered search.
+    def __init__(self, directory, embedding_model=None, quantization=VECTOR_QUANTIZATION):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.embedding_model = embedding_model
+        self._lock = threading.Lock()
+        header = self._read_header()
+        self.quantization = header.get("quantization", quantization)
+        if self.quantization not in ("float32", "int8"):
+            raise ValueError(f"Unknown vector quantization: {self.quantization}")
+        self.dimension = header.get("dimension")
+        self._count = header.get("count", 0)
+        self._meta = self._connect()
+        self._open_arrays()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_header(self):
+        try:
+            with open(self._path(HEADER_FILE), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_header(self):
+        path = self._path(HEADER_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"dimension": self.dimension, "count": self._count, "quantization": self.quantization}, f)
+        os.replace(path + ".tmp", path)
+
+    def _connect(self, path=None):
+        meta = sqlite3.connect(path or self._path(METADATA_FILE), check_same_thread=False)
+        meta.execute("CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL, text TEXT, "
+                     "metadata TEXT, deleted INTEGER NOT NULL DEFAULT 0, source TEXT, page INTEGER, uploaded_at REAL, "
+                     "page_key TEXT)")
+        # Stores written before filtering existed lack the filter columns;
+        # their chunks only match filters after a --full rebuild.
+        columns = {name for _, name, *_ in meta.execute("PRAGMA table_info(chunks)")}
+        for name, kind in (("source", "TEXT"), ("page", "INTEGER"), ("uploaded_at", "REAL")):
+            if name not in columns:
+                meta.execute(f"ALTER TABLE chunks ADD COLUMN {name} {kind}")
+        if "page_key" not in columns:
+            # Chunk ids are "<page key>:<start index>".
+            meta.execute("ALTER TABLE chunks ADD COLUMN page_key TEXT")
+            meta.executemany("UPDATE chunks SET page_key = ? WHERE row = ?",
+                             [(key.rsplit(":", 1)[0], row) for row, key in meta.execute("SELECT row, id FROM chunks")])
+        meta.execute("CREATE INDEX IF NOT EXISTS chunks_live_id ON chunks (id) WHERE deleted = 0")
+        meta.execute("CREATE INDEX IF NOT EXISTS chunks_live_source ON chunks (source, row) WHERE deleted = 0")
+        meta.execute("CREATE INDEX IF NOT EXISTS chunks_live_page_key ON chunks (page_key) WHERE deleted = 0")
+        create_occurrence_table(meta)
+        return meta
+
+    @property
+    def _vector_file(self):
+        return self._path("vectors.i8" if self.quantization == "int8" else "vectors.f32")
+
+    def _open_arrays(self):
+        if self._count:
+            dtype = np.int8 if self.quantization == "int8" else np.float32
+            self._vectors = np.memmap(self._vector_file, dtype=dtype, mode="r", shape=(self._count, self.dimension))
+            self._scales = (np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r", shape=(self._count,))
+                            if self.quantization == "int8" else None)
+        else:
+            self._vectors = np.zeros((0, self.dimension or 0), dtype=np.float32)
+            self._scales = None
+        self._deleted = np.zeros(self._count, dtype=bool)
+        rows = [row for (row,) in self._meta.execute("SELECT row FROM chunks WHERE deleted = 1 AND row < ?",
+                                                    (self._count,))]
+        self._deleted[rows] = True
+        self._subsets = {}
+        self._uses_occurrences = has_occurrences(self._meta)
+
+    def __len__(self):
+        return self._count - int(self._deleted.sum())
+
+    def _encode(self, vectors):
+        if self.quantization == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors, None
+
+    def add_documents(self, documents, ids):
+        texts = [doc.page_content for doc in documents]
+        self.add_embeddings(ids, self.embedding_model.encode(texts), texts, [doc.metadata for doc in documents])
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = normalize_rows(embeddings)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional embeddings, got {vectors.shape[1]}.")
+        encoded, scales = self._encode(vectors)
+        with self._lock:
+            self._mark_deleted(ids)
+            start = self._count
+            # Truncate anything left over from an interrupted write first.
+            self._unshare(self._vector_file, start * self.dimension * encoded.itemsize)
+            with open(self._vector_file, "ab") as f:
+                f.truncate(start * self.dimension * encoded.itemsize)
+                f.write(encoded.tobytes())
+            if scales is not None:
+                self._unshare(self._path("scales.f32"), start * 4)
+                with open(self._path("scales.f32"), "ab") as f:
+                    f.truncate(start * 4)
+                    f.write(scales.tobytes())
+            self._meta.execute("DELETE FROM chunks WHERE row >= ?", (start,))
+            self._meta.executemany(
+                "INSERT INTO chunks (row, id, text, metadata, source, page, uploaded_at, page_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(start + i, key, text, json.dumps(metadata or {}, default=str), *filter_columns(metadata or {}))
+                 for i, (key, text, metadata) in enumerate(zip(ids, texts, metadatas))],
+            )
+            self._meta.commit()
+            self._count = start + len(ids)
+            self._write_header()
+            self._open_arrays()
+
+    def _unshare(self, path, size):
+        # Index versions hard-link the vector files (see index_versions).
+        # Appending past every version's rows is harmless to the others, but
+        # truncating a linked file that is longer than this store's rows
+        # (rows of another version, e.g. one built from the same parent)
+        # would cut them off, so such a file gets a private copy first.
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        if stat.st_nlink == 1 or stat.st_size <= size:
+            return
+        with open(path, "rb") as source, open(path + ".tmp", "wb") as destination:
+            remaining = size
+            while remaining:
+                block = source.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                destination.write(block)
+                remaining -= len(block)
+        os.replace(path + ".tmp", path)
+
+    def _mark_deleted(self, ids):
+        rows = [row for row, _key, _text, _metadata in self._select("id", ids)]
+        if rows:
+            self._meta.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+            self._deleted[[row for row in rows if row < self._count]] = True
+            self._subsets = {}
+        return rows
+
+    def delete(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        with self._lock:
+            self._mark_deleted(ids)
+            self._meta.commit()
+
+    def _select(self, column, values, live_only=True, columns="row, id, text, metadata"):
+        # SQLite limits the number of bound parameters, so look up in batches.
+        results = []
+        for start in range(0, len(values), SQL_BATCH_SIZE):
+            batch = values[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            query = f"SELECT {columns} FROM chunks WHERE {column} IN ({placeholders})"
+            if live_only:
+                query += " AND deleted = 0"
+            results.extend(self._meta.execute(query, batch).fetchall())
+        return results
+
+    def set_occurrences(self, rows):
+        with self._lock:
+            replace_occurrences(self._meta, rows)
+            self._uses_occurrences = has_occurrences(self._meta)
+            self._subsets = {}
+
+    def _fetch(self, column, values, live_only=True):
+        with self._lock:
+            return self._select(column, values, live_only)
+
+    def get_texts(self):
+        with self._lock:
+            rows = self._meta.execute("SELECT id, text FROM chunks WHERE deleted = 0 ORDER BY row").fetchall()
+        return [key for key, _ in rows], [text for _, text in rows]
+
+    def get_documents(self, ids):
+        return {
+            key: Document(page_content=text, metadata=json.loads(metadata))
+            for _row, key, text, metadata in self._fetch("id", list(ids))
+        }
+
+    def _subset(self, source):
+        # Live rows of one source (all sources for None) with their ids,
+        # pages and upload times, read through the source index once and kept
+        # until the store changes. With an occurrence table a row is listed
+        # once for every occurrence of its page.
+        subset = self._subsets.get(source)
+        if subset is None:
+            if self._uses_occurrences:
+                query = ("SELECT chunks.row, chunks.id, occurrences.page, occurrences.uploaded_at FROM occurrences "
+                         "JOIN chunks ON chunks.page_key = occurrences.page_key "
+                         "WHERE chunks.deleted = 0 AND chunks.row < ?")
+                column = "occurrences.source"
+            else:
+                query = "SELECT row, id, page, uploaded_at FROM chunks WHERE deleted = 0 AND row < ?"
+                column = "source"
+            params = [self._count]
+            if source is not None:
+                query += f" AND {column} = ?"
+                params.append(source)
+            with self._lock:
+                stored = self._meta.execute(query, params).fetchall()
+            subset = (
+                np.asarray([row for row, _key, _page, _uploaded_at in stored], dtype=np.int64),
+                np.asarray([key for _row, key, _page, _uploaded_at in stored], dtype=object),
+                np.asarray([-1 if page is None else page for _row, _key, page, _uploaded_at in stored], dtype=np.int64),
+                np.asarray([np.nan if uploaded_at is None else uploaded_at for *_, uploaded_at in stored],
+                           dtype=np.float64),
+            )
+            self._subsets[source] = subset
+        return subset
+
+    def _filter(self, filters):
+        # Rows and ids matching filters, sorted by row.
+        subsets = [self._subset(source) for source in (filters.sources or [None])]
+        rows = np.concatenate([subset[0] for subset in subsets])
+        ids = np.concatenate([subset[1] for subset in subsets])
+        keep = filters.mask(np.concatenate([subset[2] for subset in subsets]),
+                            np.concatenate([subset[3] for subset in subsets]))
+        rows, first = np.unique(rows[keep], return_index=True)
+        return rows, ids[keep][first]
+
+    def filter_ids(self, filters):
+        return self._filter(filters)[1].tolist()
+
+    def search_by_vector(self, embedding, k=5, filters=None):
+        # With filters, only the rows of the matching chunks are read and
+        # scored.
+        vectors, scales, deleted = self._vectors, self._scales, self._deleted
+        if len(vectors) == 0 or k <= 0:
+            return []
+        query = normalize_rows(embedding)
+        if filters:
+            selected, _ids = self._filter(filters)
+            selected = selected[selected < len(vectors)]
+            blocks = (selected[start:start + SEARCH_BLOCK_ROWS] for start in range(0, len(selected), SEARCH_BLOCK_ROWS))
+        else:
+            blocks = (np.arange(start, min(start + SEARCH_BLOCK_ROWS, len(vectors)))
+                      for start in range(0, len(vectors), SEARCH_BLOCK_ROWS))
+        best_rows = []
+        best_scores = []
+        for block_rows in blocks:
+            if filters:
+                block = vectors[block_rows]
+            else:
+                block = vectors[block_rows[0]:block_rows[-1] + 1]
+            if scales is not None:
+                scores = (block.astype(np.float32) @ query) * scales[block_rows]
+            else:
+                scores = block @ query
+            scores[deleted[block_rows]] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_rows.append(block_rows[top])
+            best_scores.append(scores[top])
+        if not best_rows:
+            return []
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores, kind="stable")[:k]
+        rows, scores = rows[order], scores[order]
+        keep = np.isfinite(scores)
+        rows, scores = rows[keep].tolist(), scores[keep].tolist()
+
+        stored = {row: (text, metadata) for row, _key, text, metadata in self._fetch("row", rows, live_only=False)}
+        return [
+            (Document(page_content=stored[row][0], metadata=json.loads(stored[row][1])), relevance_from_cosine(score))
+            for row, score in zip(rows, scores) if row in stored
+        ]
+
+    def maybe_compact(self):
+        if self._count and (self._count - len(self)) / self._count > MAX_DELETED_RATIO:
+            self.compact()
+
+    def compact(self):
+        # Rewrite the live rows into new files and swap them in. Readers that
+        # still have the old files mapped keep reading them until they reopen.
+        with self._lock:
+            live = np.flatnonzero(~self._deleted)
+            dtype = np.int8 if self.quantization == "int8" else np.float32
+            tmp_meta = self._path(METADATA_FILE + ".tmp")
+            if os.path.exists(tmp_meta):
+                os.remove(tmp_meta)
+            new_meta = self._connect(tmp_meta)
+            with open(self._vector_file + ".tmp", "wb") as vectors_out, \
+                    open(self._path("scales.f32.tmp"), "wb") as scales_out:
+                for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+                    rows = live[start:start + SEARCH_BLOCK_ROWS]
+                    vectors_out.write(np.asarray(self._vectors[rows], dtype=dtype).tobytes())
+                    if self._scales is not None:
+                        scales_out.write(np.asarray(self._scales[rows], dtype=np.float32).tobytes())
+                    stored = {row: values for row, *values in self._select(
+                        "row", rows.tolist(), live_only=False,
+                        columns="row, id, text, metadata, source, page, uploaded_at, page_key")}
+                    new_meta.executemany(
+                        "INSERT INTO chunks (row, id, text, metadata, source, page, uploaded_at, page_key) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(start + i, *stored[row]) for i, row in enumerate(rows.tolist())],
+                    )
+            replace_occurrences(new_meta, self._meta.execute(
+                "SELECT page_key, source, page, uploaded_at FROM occurrences").fetchall())
+            new_meta.close()
+            self._meta.close()
+            os.replace(self._vector_file + ".tmp", self._vector_file)
+            if self._scales is not None:
+                os.replace(self._path("scales.f32.tmp"), self._path("scales.f32"))
+            else:
+                os.remove(self._path("scales.f32.tmp"))
+            os.replace(tmp_meta, self._path(METADATA_FILE))
+            removed = self._count - len(live)
+            self._count = len(live)
+            self._write_header()
+            self._meta = self._connect()
+            self._open_arrays()
+        logger.info(f"Compacted vector store to {self._count} rows, dropped {removed} deleted rows.")
+
+    def close(self):
+        # Nothing to release eagerly: searches still running on this store
+        # keep using its maps and connection, which go away with the last
+        # reference to it.
+        pass
+
+
+def open_vector_store(persist_directory, embedding_model, backend=VECTOR_BACKEND):
+    if backend == "numpy":
+        return NumpyVectorStore(os.path.join(persist_directory, NUMPY_STORE_DIR), embedding_model)
+    if backend == "chroma":
+        return ChromaVectorStore(persist_directory, embedding_model)
+    raise ValueError(f"Unknown vector backend: {backend}")
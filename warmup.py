@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import time
+
+from metrics import stage
+
+# With FAST_START=1 the servers do not load the embedding model, index,
+# reranker and LLM client in their startup hook, which uvicorn runs before it
+# binds the port. They are loaded by a background thread instead, so /healthz
+# answers at once and /readyz reports 503 until warm-up has finished.
+# Requests that arrive earlier load what they need themselves. Without it
+# warm-up runs in the startup hook, as before.
+FAST_START = os.getenv("FAST_START", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    # Runs named warm-up steps once and keeps their state for /readyz. Step
+    # durations are also recorded as "startup" stages in /metrics.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "pending"  # then "warming", and "ready" or "failed"
+        self.error = None
+        self.steps = {}  # step name -> seconds
+        self.seconds = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self, steps, background=FAST_START):
+        # steps are (name, callable) pairs, run in order.
+        with self._lock:
+            if self.state != "pending":
+                return
+            self.state = "warming"
+        if background:
+            self._thread = threading.Thread(target=self._run, args=(steps,), name="warm-up", daemon=True)
+            self._thread.start()
+        else:
+            self._run(steps)
+
+    def _run(self, steps):
+        started = time.perf_counter()
+        try:
+            for name, step in steps:
+                with stage("startup", name) as timer:
+                    step()
+                self.steps[name] = round(timer.seconds, 3)
+            self.state = "ready"
+            logger.info(f"Warm-up finished in {time.perf_counter() - started:.1f}s.")
+        except Exception as e:
+            # A failed warm-up leaves the server live but not ready; requests
+            # retry the failed step themselves.
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Warm-up failed: {str(e)}")
+        finally:
+            self.seconds = round(time.perf_counter() - started, 3)
+
+    def status(self):
+        return {
+            "status": self.state,
+            "fast_start": FAST_START,
+            "seconds": self.seconds,
+            "steps": dict(self.steps),
+            "error": self.error,
+        }
+
+
+warm_up = WarmUp()